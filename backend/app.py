@@ -5,13 +5,15 @@ import sys
 import os
 import threading
 import json
-from datetime import datetime
+import time
+from datetime import datetime, timezone
 
 # Add ml_model to path
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'ml_model'))
 
-from book_embedding import VietnameseBookEmbedding
-from vietnamese_tts import VietnameseTTS
+# book_embedding / vietnamese_tts (numpy, faiss, sentence_transformers, torch) được import trong warm-up nền
+# hoặc lần đầu cần tới, để server khởi động nhanh (xem backend/profile_imports.py)
+from warmup import WarmupTask
 
 app = Flask(__name__)
 CORS(app)
@@ -20,34 +22,171 @@ socketio = SocketIO(app, cors_allowed_origins="*")
 # Configuration
 DATASET_PATH = r"C:\Users\karin\.cache\kagglehub\datasets\iambestfeeder\10000-vietnamese-books\versions\1\output"
 CHECKPOINT_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'checkpoints')
+# ANN index: hnsw | ivf | flat (brute-force)
+INDEX_TYPE = os.environ.get('INDEX_TYPE', 'hnsw')
+# Embedding storage: memory | mmap | float16 | int8
+STORAGE_MODE = os.environ.get('STORAGE_MODE', 'mmap')
+# Gom các query đến trong khoảng này (ms) thành một lần encode, 0 = tắt
+QUERY_BATCH_WAIT_MS = float(os.environ.get('QUERY_BATCH_WAIT_MS', 5))
+# Search mặc định: dense | hybrid (BM25 + dense re-score) | lexical
+SEARCH_MODE = os.environ.get('SEARCH_MODE', 'hybrid')
+# Encoder backend: torch | onnx | onnx-int8 (ONNX Runtime trên CPU, export lần đầu)
+ENCODER_BACKEND = os.environ.get('ENCODER_BACKEND', 'torch')
+# Batching theo độ dài: ngân sách token mỗi batch khi training, 0 = batch cố định 32 sách
+MAX_BATCH_TOKENS = int(os.environ.get('MAX_BATCH_TOKENS', 0))
+# Số process encode khi training (1 = encode trong process hiện tại)
+ENCODE_WORKERS = int(os.environ.get('ENCODE_WORKERS', 1))
+# Kiểm tra snapshot.json mỗi N giây, tự hot reload khi có version mới (0 = chỉ reload qua /api/index/reload)
+INDEX_WATCH_INTERVAL = float(os.environ.get('INDEX_WATCH_INTERVAL', 10))
+# Sharded search: số shard process trên localhost (0 = một index trong process backend) và timeout mỗi shard
+SEARCH_SHARDS = int(os.environ.get('SEARCH_SHARDS', 0))
+SHARD_TIMEOUT_MS = float(os.environ.get('SHARD_TIMEOUT_MS', 200))
+# Cache kết quả search theo index version: số entry (0 = tắt), chia sẻ giữa các worker qua SQLite trong checkpoints
+RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', 1024))
+RESULT_CACHE_SHARED = os.environ.get('RESULT_CACHE_SHARED', '0') == '1'
+# Training telemetry: đẩy training_status (kèm telemetry) qua Socket.IO tối đa một lần mỗi N giây
+TRAINING_STATUS_INTERVAL = float(os.environ.get('TRAINING_STATUS_INTERVAL', 2))
+# Corpus pack (python ml_model/corpus_pack.py <dataset> <pack_dir>): đọc sách từ pack, thư mục dataset là fallback
+CORPUS_PACK = os.environ.get('CORPUS_PACK') or None
+# Training chạy trong process riêng (training_jobs.py): số core (0 = tất cả trừ một), số thread torch / OpenMP
+# (0 = bằng số core) và nice của process training
+TRAINING_CPUS = int(os.environ.get('TRAINING_CPUS', 0))
+TRAINING_THREADS = int(os.environ.get('TRAINING_THREADS', 0))
+TRAINING_NICE = int(os.environ.get('TRAINING_NICE', 10))
 
 # Global model instance
 model = None
 tts_model = None
-training_thread = None
+training_jobs = None
+catalog_manager = None
+line_index_store = None
+corpus_pack = None
+model_lock = threading.Lock()
+jobs_lock = threading.Lock()
+catalog_lock = threading.Lock()
+pack_lock = threading.Lock()
+started_at = time.time()
 
 
 def initialize_model():
     """Initialize ML model"""
     global model
-    if model is None:
-        model = VietnameseBookEmbedding(DATASET_PATH, CHECKPOINT_DIR)
+    if model is not None:
+        return
+    with model_lock:
+        if model is not None:
+            return
+        from book_embedding import VietnameseBookEmbedding
+        
+        instance = VietnameseBookEmbedding(
+            DATASET_PATH, CHECKPOINT_DIR, index_type=INDEX_TYPE, storage=STORAGE_MODE,
+            query_batch_wait_ms=QUERY_BATCH_WAIT_MS, encode_workers=ENCODE_WORKERS,
+            encoder_backend=ENCODER_BACKEND, search_shards=SEARCH_SHARDS, shard_timeout_ms=SHARD_TIMEOUT_MS,
+            result_cache_size=RESULT_CACHE_SIZE, result_cache_shared=RESULT_CACHE_SHARED,
+            corpus_pack=CORPUS_PACK
+        )
         # Try to load existing embeddings
-        model.load_embeddings()
+        instance.load_embeddings()
+        if INDEX_WATCH_INTERVAL > 0:
+            instance.watch_index(INDEX_WATCH_INTERVAL, on_reload=lambda result: socketio.emit('index_reloaded', result))
+        model = instance
+
+
+def initialize_pack():
+    """Mở corpus pack một lần (None nếu không cấu hình CORPUS_PACK hoặc pack chưa build)"""
+    global corpus_pack
+    if CORPUS_PACK and corpus_pack is None:
+        with pack_lock:
+            if corpus_pack is None:
+                from corpus_pack import open_pack
+                corpus_pack = open_pack(CORPUS_PACK)
+    return corpus_pack
+
+
+def initialize_catalog():
+    """Catalog sách (catalog.npz trong checkpoints), refresh theo mtime thư mục dataset"""
+    global catalog_manager
+    pack = initialize_pack()
+    with catalog_lock:
+        if catalog_manager is None:
+            from book_catalog import CatalogManager
+            catalog_manager = CatalogManager(DATASET_PATH, CHECKPOINT_DIR, pack=pack)
+    return catalog_manager.current()
+
+
+def initialize_line_index():
+    """Line-offset index của từng sách (line_index/ trong checkpoints), build lazily lần đầu đọc"""
+    global line_index_store
+    pack = initialize_pack()
+    with catalog_lock:
+        if line_index_store is None:
+            from line_index import LineIndexStore
+            line_index_store = LineIndexStore(DATASET_PATH, CHECKPOINT_DIR, pack=pack)
+    return line_index_store
 
 
 def initialize_tts():
     """Initialize TTS model"""
     global tts_model
     if tts_model is None:
+        from vietnamese_tts import VietnameseTTS
         tts_model = VietnameseTTS()
     return tts_model
 
 
+def warm_up_encoder():
+    """Load encoder (sentence_transformers / torch hoặc ONNX Runtime) và encode một query mẫu"""
+    from book_embedding import RELOAD_PROBE_QUERY
+    model.encode_query(RELOAD_PROBE_QUERY)
+
+
+# Warm-up: import module ML, load index snapshot, load encoder; /api/health/ready OK khi xong các bước này
+# Catalog sách là bước optional chạy sau cùng: lỗi chỉ hiện trong warmup.degraded, không chặn search
+warmup = WarmupTask([
+    ('import', lambda: __import__('book_embedding')),
+    ('index', initialize_model),
+    ('encoder', warm_up_encoder),
+    ('catalog', initialize_catalog, False)
+])
+
+
+def warming_up_response():
+    """503 + Retry-After cho endpoint cần model khi warm-up đang chạy, None nếu được phục vụ"""
+    if not warmup.running:
+        return None
+    response = jsonify({'error': 'Model is warming up', 'warmup': warmup.status()})
+    response.status_code = 503
+    response.headers['Retry-After'] = '2'
+    return response
+
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({'status': 'ok', 'timestamp': datetime.now().isoformat()})
+    return jsonify({'status': 'ok', 'ready': warmup.ready, 'timestamp': datetime.now().isoformat()})
+
+
+@app.route('/api/health/live', methods=['GET'])
+def health_live():
+    """Liveness: process đang chạy và nhận request (không phụ thuộc model)"""
+    return jsonify({
+        'status': 'ok',
+        'uptime_seconds': round(time.time() - started_at, 3),
+        'timestamp': datetime.now().isoformat()
+    })
+
+
+@app.route('/api/health/ready', methods=['GET'])
+def health_ready():
+    """
+    Readiness: 200 khi các bước bắt buộc của warm-up xong (index + encoder đã load), 503 khi đang warm-up hoặc lỗi
+    Catalog lỗi không làm fail readiness, chỉ được liệt kê trong warmup.degraded
+    """
+    # Chạy dưới WSGI server (không qua __main__): readiness probe đầu tiên khởi động warm-up
+    warmup.start()
+    status = warmup.status()
+    return jsonify({'status': 'ready' if warmup.ready else status['state'], 'warmup': status}), \
+        200 if warmup.ready else 503
 
 
 @app.route('/api/books/search', methods=['POST'])
@@ -56,19 +195,107 @@ def search_books():
     try:
         data = request.get_json()
         query = data.get('query', '')
-        top_k = data.get('top_k', 10)
+        top_k = int(data.get('top_k', 10))
+        # Knobs recall/latency cho ANN index
+        ef_search = data.get('ef_search')
+        nprobe = data.get('nprobe')
+        exact = bool(data.get('exact', False))
+        # Gộp điểm passage (tìm sâu trong nội dung), kết quả có best_line
+        passages = bool(data.get('passages', True))
+        mode = data.get('mode', SEARCH_MODE)
+        # Projection: chỉ trả về các field này (list hoặc "title,preview"), mặc định tất cả
+        fields = data.get('fields')
+        if isinstance(fields, str):
+            fields = [field.strip() for field in fields.split(',') if field.strip()]
         
         if not query:
             return jsonify({'error': 'Query is required'}), 400
         
+        busy = warming_up_response()
+        if busy is not None:
+            return busy
         initialize_model()
-        results = model.search(query, top_k=top_k)
+        # Cả request đọc một snapshot; reload / re-index giữa chừng không đóng version này
+        with model.use_snapshot() as snapshot:
+            results = model.search(
+                query,
+                top_k=top_k,
+                ef_search=int(ef_search) if ef_search is not None else None,
+                nprobe=int(nprobe) if nprobe is not None else None,
+                exact=exact,
+                passages=passages,
+                mode=mode,
+                fields=fields,
+                snapshot=snapshot
+            )
         
         return jsonify({
             'success': True,
             'query': query,
             'results': results,
-            'count': len(results)
+            'count': len(results),
+            'index_version': snapshot.version if snapshot is not None else None
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/search/stats', methods=['GET'])
+def search_stats():
+    """Query embedding / result cache hit-rate, micro-batch sizes and the index snapshot being served"""
+    try:
+        busy = warming_up_response()
+        if busy is not None:
+            return busy
+        initialize_model()
+        return jsonify({
+            'success': True,
+            'stats': model.get_query_stats(),
+            'index': model.get_index_stats()
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/index/reload', methods=['POST'])
+def reload_index():
+    """Hot reload embeddings / index from the checkpoint directory without restarting"""
+    try:
+        initialize_model()
+        from book_embedding import RELOAD_PROBE_QUERY
+        data = request.get_json(silent=True) or {}
+        result = model.reload_index(data.get('probe_query') or RELOAD_PROBE_QUERY)
+        if not result['reloaded']:
+            return jsonify({'success': False, 'error': result['error'], 'reload': result}), 409
+        socketio.emit('index_reloaded', result)
+        return jsonify({'success': True, 'reload': result})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/books/<path:filename>/similar', methods=['GET'])
+def similar_books(filename):
+    """Books similar to the given one, looked up in the precomputed k-NN graph"""
+    try:
+        top_k = int(request.args.get('top_k', 10))
+        fields = request.args.get('fields')
+        fields = [field.strip() for field in fields.split(',') if field.strip()] if fields else None
+        
+        busy = warming_up_response()
+        if busy is not None:
+            return busy
+        initialize_model()
+        with model.use_snapshot() as snapshot:
+            results = model.similar_books(filename, top_k=top_k, fields=fields, snapshot=snapshot)
+        if results is None:
+            return jsonify({'error': 'Book not found in index'}), 404
+        
+        return jsonify({
+            'success': True,
+            'filename': filename,
+            'results': results,
+            'count': len(results),
+            'index_version': snapshot.version
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -76,99 +303,207 @@ def search_books():
 
 @app.route('/api/books/<path:filename>', methods=['GET'])
 def get_book_content(filename):
-    """Get full content of a book"""
+    """
+    Get the lines of a book
+    start_line / count: only that window of lines (seek by the line-offset index), default the whole book
+    include_content=1: also return the joined text as content
+    ETag / Last-Modified come from the file size and mtime (as packed, for books in the corpus pack);
+    conditional GETs get 304 without reading the book
+    """
     try:
-        file_path = os.path.join(DATASET_PATH, filename)
-        
-        if not os.path.exists(file_path):
+        store = initialize_line_index()
+        stat = store.stat(filename)
+        if stat is None:
             return jsonify({'error': 'Book not found'}), 404
         
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
+        size, mtime_ns = stat
+        etag = f"{size:x}-{mtime_ns:x}"
+        last_modified = datetime.fromtimestamp(mtime_ns // 10 ** 9, tz=timezone.utc)
+        if request.if_none_match.contains(etag) or (
+                not request.if_none_match and request.if_modified_since is not None
+                and request.if_modified_since >= last_modified):
+            response = app.response_class(status=304)
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            return response
         
-        # Split into lines for reading functionality
-        lines = content.split('\n')
+        index = store.get(filename, stat)
+        total_lines = len(index)
+        start_line = int(request.args.get('start_line', 0))
+        count = int(request.args.get('count', total_lines))
+        if start_line < 0 or count < 0:
+            return jsonify({'error': 'start_line and count must be >= 0'}), 400
+        lines = index.lines(start_line, count)
         
-        return jsonify({
+        data = {
             'success': True,
             'filename': filename,
             'title': filename.replace('.txt', ''),
-            'content': content,
             'lines': lines,
-            'total_lines': len(lines)
-        })
+            'start_line': min(start_line, total_lines),
+            'count': len(lines),
+            'total_lines': total_lines
+        }
+        if request.args.get('include_content') == '1':
+            data['content'] = '\n'.join(lines)
+        
+        response = jsonify(data)
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.cache_control.no_cache = True
+        return response
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
 @app.route('/api/books/list', methods=['GET'])
 def list_books():
-    """List all books with pagination"""
+    """
+    List all books with pagination (slice of the in-memory catalog)
+    sort = filename | title | size, order = asc | desc; cursor = next_cursor of the previous page
+    (keyset pagination), otherwise page / per_page
+    """
     try:
         page = int(request.args.get('page', 1))
         per_page = int(request.args.get('per_page', 50))
+        sort = request.args.get('sort', 'filename')
+        order = request.args.get('order', 'asc')
+        cursor = request.args.get('cursor')
         
-        files = [f for f in os.listdir(DATASET_PATH) if f.endswith('.txt')]
-        files.sort()
-        
-        total = len(files)
-        start = (page - 1) * per_page
-        end = start + per_page
-        
-        books = []
-        for filename in files[start:end]:
-            file_path = os.path.join(DATASET_PATH, filename)
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    preview = f.read(300)
-                books.append({
-                    'filename': filename,
-                    'title': filename.replace('.txt', ''),
-                    'preview': preview
-                })
-            except:
-                pass
+        try:
+            result = initialize_catalog().list(sort, order, limit=per_page, cursor=cursor,
+                                               offset=(page - 1) * per_page)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
+        total = result['total']
         return jsonify({
             'success': True,
-            'books': books,
-            'page': page,
+            'books': result['books'],
+            'page': None if cursor else page,
             'per_page': per_page,
             'total': total,
-            'total_pages': (total + per_page - 1) // per_page
+            'total_pages': (total + per_page - 1) // per_page,
+            'sort': sort,
+            'order': order,
+            'next_cursor': result['next_cursor']
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+def on_job_event(job, event, payload):
+    """Chuyển tiếp event của process training sang các sự kiện Socket.IO sẵn có"""
+    socketio.emit('training_job', {'job': job, 'event': event})
+    if job['kind'] == 'tts':
+        if event == 'done':
+            socketio.emit('tts_training_complete', {
+                'message': 'TTS training completed',
+                'metadata': payload.get('metadata')
+            })
+        elif event == 'failed':
+            socketio.emit('tts_training_error', {'error': payload['error']})
+        return
+    
+    if event == 'progress':
+        socketio.emit('training_status', payload)
+    elif event == 'paused':
+        socketio.emit('training_status', training_status_dict())
+    elif event == 'done':
+        # Process training đã publish index mới: server reload ngay thay vì chờ watcher
+        if model is not None:
+            result = model.reload_index()
+            if result['reloaded']:
+                socketio.emit('index_reloaded', result)
+        socketio.emit('training_status', training_status_dict())
+        if job['kind'] == 'incremental':
+            socketio.emit('training_complete', {
+                'message': 'Incremental indexing completed',
+                'summary': payload.get('summary')
+            })
+        else:
+            socketio.emit('training_complete', {
+                'message': 'Training completed successfully'
+            })
+    elif event == 'failed':
+        socketio.emit('training_error', {
+            'error': payload['error']
+        })
+
+
+def initialize_training_jobs():
+    """Job manager (training_jobs.json trong checkpoints), training chạy trong process riêng"""
+    global training_jobs
+    with jobs_lock:
+        if training_jobs is None:
+            from training_jobs import TrainingJobManager, JOBS_FILE, default_cpus
+            config = {
+                'model': {
+                    'dataset_path': DATASET_PATH, 'checkpoint_dir': CHECKPOINT_DIR, 'index_type': INDEX_TYPE,
+                    'storage': STORAGE_MODE, 'encode_workers': ENCODE_WORKERS, 'encoder_backend': ENCODER_BACKEND,
+                    'corpus_pack': CORPUS_PACK
+                },
+                'cpus': TRAINING_CPUS or default_cpus(),
+                'threads': TRAINING_THREADS,
+                'nice': TRAINING_NICE,
+                'status_interval': TRAINING_STATUS_INTERVAL
+            }
+            training_jobs = TrainingJobManager(os.path.join(CHECKPOINT_DIR, JOBS_FILE), config, on_job_event).start()
+    return training_jobs
+
+
+def training_status_dict():
+    """Status của model trong server + tiến độ gần nhất của job train / incremental đang chạy"""
+    jobs = initialize_training_jobs()
+    status = model.get_training_status() if model is not None else {'is_training': False}
+    job = jobs.active(('train', 'incremental'))
+    if job is None:
+        job = jobs.latest(('train', 'incremental'))
+    if job is not None:
+        status.update(jobs.last_status(job['id']) or job['progress'] or {})
+        status['job'] = job
+    status['is_training'] = job is not None and job['state'] in ('queued', 'running')
+    status['jobs'] = jobs.stats()
+    return status
+
+
 @app.route('/api/training/start', methods=['POST'])
 def start_training():
-    """Start or resume training"""
-    global training_thread
-    
+    """Start or resume training (in a separate job process)"""
     try:
-        initialize_model()
-        
-        if model.is_training:
+        jobs = initialize_training_jobs()
+        if jobs.active(('train', 'incremental')):
             return jsonify({'error': 'Training is already running'}), 400
         
-        def train_task():
-            try:
-                model.train(batch_size=32, save_interval=50)
-                socketio.emit('training_complete', {
-                    'message': 'Training completed successfully'
-                })
-            except Exception as e:
-                socketio.emit('training_error', {
-                    'error': str(e)
-                })
+        job = jobs.submit('train', {
+            'batch_size': 32,
+            'save_interval': 50,
+            'max_batch_tokens': MAX_BATCH_TOKENS or None
+        })
         
-        training_thread = threading.Thread(target=train_task)
-        training_thread.start()
+        return jsonify({
+            'success': True,
+            'message': 'Training started',
+            'job': job
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/training/incremental', methods=['POST'])
+def start_incremental_training():
+    """Embed only new or changed books and merge them into the existing index"""
+    try:
+        jobs = initialize_training_jobs()
+        if jobs.active(('train', 'incremental')):
+            return jsonify({'error': 'Training is already running'}), 400
+        
+        job = jobs.submit('incremental', {'batch_size': 32})
         
         return jsonify({
             'success': True,
-            'message': 'Training started'
+            'message': 'Incremental indexing started',
+            'job': job
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -176,18 +511,18 @@ def start_training():
 
 @app.route('/api/training/pause', methods=['POST'])
 def pause_training():
-    """Pause training"""
+    """Pause training (the job stops after the current batch and saves a checkpoint)"""
     try:
-        initialize_model()
-        
-        if not model.is_training:
-            return jsonify({'error': 'No training in progress'}), 400
-        
-        model.pause_training()
+        jobs = initialize_training_jobs()
+        try:
+            job = jobs.pause()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         return jsonify({
             'success': True,
-            'message': 'Training paused'
+            'message': 'Training paused',
+            'job': job
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -197,8 +532,11 @@ def pause_training():
 def training_status():
     """Get training status"""
     try:
+        busy = warming_up_response()
+        if busy is not None:
+            return busy
         initialize_model()
-        status = model.get_training_status()
+        status = training_status_dict()
         
         return jsonify({
             'success': True,
@@ -208,6 +546,51 @@ def training_status():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/training/jobs', methods=['GET'])
+def list_training_jobs():
+    """Job registry: queued / running / paused / done / failed jobs, newest first"""
+    try:
+        jobs = initialize_training_jobs()
+        return jsonify({
+            'success': True,
+            'jobs': jobs.jobs()[::-1],
+            'stats': jobs.stats()
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/training/jobs/<job_id>', methods=['GET'])
+def get_training_job(job_id):
+    """One job with its latest full status"""
+    try:
+        jobs = initialize_training_jobs()
+        job = jobs.get(job_id)
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+        return jsonify({'success': True, 'job': job, 'status': jobs.last_status(job_id)})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/training/jobs/<job_id>/<action>', methods=['POST'])
+def control_training_job(job_id, action):
+    """Pause or resume a job"""
+    try:
+        jobs = initialize_training_jobs()
+        if jobs.get(job_id) is None:
+            return jsonify({'error': 'Job not found'}), 404
+        if action not in ('pause', 'resume'):
+            return jsonify({'error': f'Unknown action: {action} (pause | resume)'}), 400
+        try:
+            job = jobs.pause(job_id) if action == 'pause' else jobs.resume(job_id)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({'success': True, 'job': job})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/api/tts/synthesize', methods=['POST'])
 def synthesize_speech():
     """Synthesize speech from text"""
@@ -257,29 +640,18 @@ def get_voices():
 
 @app.route('/api/tts/train', methods=['POST'])
 def train_tts():
-    """Train TTS model from VietSpeech dataset"""
+    """Train TTS model from VietSpeech dataset (in a separate job process)"""
     try:
-        tts = initialize_tts()
-        
-        def train_task():
-            try:
-                metadata = tts.train_from_dataset()
-                socketio.emit('tts_training_complete', {
-                    'message': 'TTS training completed',
-                    'metadata': metadata
-                })
-            except Exception as e:
-                socketio.emit('tts_training_error', {
-                    'error': str(e)
-                })
-        
-        import threading
-        thread = threading.Thread(target=train_task)
-        thread.start()
+        jobs = initialize_training_jobs()
+        try:
+            job = jobs.submit('tts')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         return jsonify({
             'success': True,
-            'message': 'TTS training started'
+            'message': 'TTS training started',
+            'job': job
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -302,9 +674,12 @@ def handle_disconnect():
 def handle_training_status_request():
     """Send training status to client"""
     try:
+        # Đang warm-up: không load model trong handler, trả về status của job training kèm tiến độ warm-up
+        if warmup.running:
+            emit('training_status', dict(training_status_dict(), warmup=warmup.status()))
+            return
         initialize_model()
-        status = model.get_training_status()
-        emit('training_status', status)
+        emit('training_status', training_status_dict())
     except Exception as e:
         emit('error', {'error': str(e)})
 
@@ -317,4 +692,11 @@ if __name__ == '__main__':
     print(f"Dataset path: {DATASET_PATH}")
     print(f"Checkpoint directory: {CHECKPOINT_DIR}")
     
-    socketio.run(app, host='0.0.0.0', port=5000, debug=True)
+    debug = True
+    # Debug reloader: process cha chỉ theo dõi file, warm-up chạy trong process con (WERKZEUG_RUN_MAIN)
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        warmup.start()
+        # Job còn queued từ lần chạy trước được chạy tiếp
+        initialize_training_jobs()
+    
+    socketio.run(app, host='0.0.0.0', port=5000, debug=debug)
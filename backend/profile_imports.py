@@ -0,0 +1,117 @@
+"""
+Import-time profile của backend (python -X importtime)
+- Chạy `import app` trong process mới, tách thời gian self / cumulative của từng module
+- Báo module nặng (torch, sentence_transformers, faiss...) bị import lúc khởi động: các module này
+  phải được import trong warm-up nền, không phải khi load app.py
+- Exit code 1 nếu có module nặng hoặc tổng thời gian vượt --budget-ms, dùng để bắt regression
+
+python profile_imports.py [--module app] [--top 20] [--budget-ms 1500] [--output import_profile.json]
+"""
+
+import os
+import sys
+import json
+import time
+import subprocess
+from typing import Dict, List
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+ML_MODEL_DIR = os.path.join(BACKEND_DIR, '..', 'ml_model')
+
+# Không được import khi load app.py (chỉ trong warm-up / lần đầu dùng)
+HEAVY_MODULES = (
+    'torch', 'sentence_transformers', 'transformers', 'faiss', 'onnxruntime', 'onnx',
+    'espnet2', 'gtts', 'datasets', 'sklearn', 'scipy', 'book_embedding', 'vietnamese_tts'
+)
+
+
+def parse_importtime(stderr: str) -> List[Dict]:
+    """Các dòng 'import time: self [us] | cumulative | imported package' -> list module"""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len('import time:'):].split('|')
+            modules.append({
+                'module': name.strip(),
+                'depth': (len(name) - len(name.lstrip()) - 1) // 2,
+                'self_ms': int(self_us) / 1000.0,
+                'cumulative_ms': int(cumulative_us) / 1000.0
+            })
+        except ValueError:
+            continue
+    return modules
+
+
+def _run(code: str) -> subprocess.CompletedProcess:
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [BACKEND_DIR, ML_MODEL_DIR, env.get('PYTHONPATH')]))
+    return subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=BACKEND_DIR, env=env,
+                          capture_output=True, text=True)
+
+
+def profile(module: str = 'app', top: int = 20) -> Dict:
+    # Interpreter trống làm mốc để so với wall time (chi phí khởi động Python)
+    start = time.perf_counter()
+    _run('pass')
+    baseline_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    result = _run(f'import {module}')
+    wall_ms = (time.perf_counter() - start) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr.splitlines()[-1] if result.stderr else ''}")
+
+    modules = parse_importtime(result.stderr)
+    top_level = [m for m in modules if m['depth'] == 0]
+    heavy = sorted({m['module'].split('.')[0] for m in modules} & set(HEAVY_MODULES))
+    return {
+        'module': module,
+        'python': sys.version.split()[0],
+        'wall_ms': round(wall_ms, 1),
+        'baseline_ms': round(baseline_ms, 1),
+        'import_ms': round(sum(m['cumulative_ms'] for m in top_level if m['module'] == module), 1),
+        'modules_imported': len(modules),
+        'heavy_modules': heavy,
+        'top_cumulative': [
+            {'module': m['module'], 'cumulative_ms': round(m['cumulative_ms'], 1), 'self_ms': round(m['self_ms'], 1)}
+            for m in sorted(top_level, key=lambda m: -m['cumulative_ms'])[:top]
+        ],
+        'top_self': [
+            {'module': m['module'], 'self_ms': round(m['self_ms'], 1)}
+            for m in sorted(modules, key=lambda m: -m['self_ms'])[:top]
+        ]
+    }
+
+
+def _arg(name: str, default=None):
+    if name in sys.argv:
+        return sys.argv[sys.argv.index(name) + 1]
+    return default
+
+
+if __name__ == "__main__":
+    report = profile(_arg('--module', 'app'), int(_arg('--top', 20)))
+    budget_ms = float(_arg('--budget-ms', 0))
+
+    print(f"import {report['module']}: {report['import_ms']:.0f} ms "
+          f"(wall {report['wall_ms']:.0f} ms, empty interpreter {report['baseline_ms']:.0f} ms, "
+          f"{report['modules_imported']} modules)")
+    print(f"{'cumulative ms':>14}{'self ms':>10}  module")
+    for m in report['top_cumulative']:
+        print(f"{m['cumulative_ms']:>14.1f}{m['self_ms']:>10.1f}  {m['module']}")
+
+    failures = []
+    if report['heavy_modules']:
+        failures.append(f"heavy modules imported at startup: {', '.join(report['heavy_modules'])}")
+    if budget_ms and report['import_ms'] > budget_ms:
+        failures.append(f"import time {report['import_ms']:.0f} ms exceeds budget {budget_ms:.0f} ms")
+    report['failures'] = failures
+
+    if _arg('--output'):
+        with open(_arg('--output'), 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
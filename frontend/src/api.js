@@ -14,14 +14,25 @@ export const searchBooks = async (query, topK = 10) => {
   return response.data;
 };
 
-export const getBookContent = async (filename) => {
-  const response = await api.get(`/api/books/${encodeURIComponent(filename)}`);
+// startLine / count: chỉ lấy một cửa sổ dòng (mặc định cả sách)
+export const getBookContent = async (filename, startLine, count) => {
+  const response = await api.get(`/api/books/${encodeURIComponent(filename)}`, {
+    params: { start_line: startLine, count }
+  });
+  return response.data;
+};
+
+export const getSimilarBooks = async (filename, topK = 6) => {
+  const response = await api.get(`/api/books/${encodeURIComponent(filename)}/similar`, {
+    params: { top_k: topK, fields: 'title' }
+  });
   return response.data;
 };
 
-export const listBooks = async (page = 1, perPage = 50) => {
+// sort: filename | title | size, order: asc | desc; cursor = next_cursor của trang trước (thay cho page)
+export const listBooks = async (page = 1, perPage = 50, { sort, order, cursor } = {}) => {
   const response = await api.get('/api/books/list', {
-    params: { page, per_page: perPage }
+    params: { page, per_page: perPage, sort, order, cursor }
   });
   return response.data;
 };
@@ -3,7 +3,7 @@ import { FaBook, FaStar, FaHeart, FaRegHeart } from 'react-icons/fa';
 import { useBookStore } from '../store';
 
 export default function BookCard({ book }) {
-  const { title, preview, similarity_score, filename } = book;
+  const { title, preview, similarity_score, filename, best_line } = book;
   const { isFavorite, addFavorite, removeFavorite } = useBookStore();
   
   const isBookFavorite = isFavorite(filename);
@@ -20,7 +20,7 @@ export default function BookCard({ book }) {
   };
   
   return (
-    <Link to={`/book/${encodeURIComponent(filename)}`}>
+    <Link to={`/book/${encodeURIComponent(filename)}${best_line != null ? `?line=${best_line}` : ''}`}>
       <div className="book-card relative">
         {/* Favorite Button */}
         <button
@@ -1,14 +1,17 @@
 import { useState, useEffect, useRef } from 'react';
-import { useParams, useNavigate } from 'react-router-dom';
+import { Link, useParams, useNavigate, useSearchParams } from 'react-router-dom';
 import { FaArrowLeft, FaPlay, FaPause, FaVolumeUp, FaMale, FaFemale, FaCog, FaHeart, FaRegHeart, FaRobot } from 'react-icons/fa';
-import { getBookContent } from '../api';
+import { getBookContent, getSimilarBooks } from '../api';
 import { generatePiperAudio, checkPiperHealth } from '../api/piperApi';
 import { getBestVietnameseVoice, hasVietnameseVoice, logAvailableVoices } from '../utils/voiceDetector';
 import { useBookStore } from '../store';
 import SettingsPanel from '../components/SettingsPanel';
 
+const LINE_WINDOW = 500;
+
 export default function BookReader() {
   const { filename } = useParams();
+  const [searchParams] = useSearchParams();
   const navigate = useNavigate();
   const [book, setBook] = useState(null);
   const [loading, setLoading] = useState(true);
@@ -18,7 +21,9 @@ export default function BookReader() {
   const [hasViVoice, setHasViVoice] = useState(false);
   const [audioQueue, setAudioQueue] = useState([]);
   const [currentAudioIndex, setCurrentAudioIndex] = useState(0);
+  const [similarBooks, setSimilarBooks] = useState([]);
   const audioPlayerRef = useRef(null);
+  const loadToken = useRef(0);
   
   const {
     isReading,
@@ -52,9 +57,12 @@ export default function BookReader() {
 
   useEffect(() => {
     loadBook();
+    loadSimilarBooks();
     checkPiperStatus();
     checkVietnameseVoice();
     return () => {
+      // Dừng nạp các cửa sổ dòng còn lại
+      loadToken.current += 1;
       // Stop all audio when leaving page
       window.speechSynthesis.cancel();
       window.speechSynthesis.pause();
@@ -88,11 +96,24 @@ export default function BookReader() {
     }
   };
 
+  // Tải sách theo cửa sổ dòng: hiện ngay cửa sổ đầu (tới dòng cần mở), phần còn lại nạp dần ở nền
   const loadBook = async () => {
+    const token = ++loadToken.current;
     setLoading(true);
     try {
-      const data = await getBookContent(filename);
+      const line = parseInt(searchParams.get('line'), 10);
+      const firstCount = Math.max(LINE_WINDOW, isNaN(line) ? 0 : line + LINE_WINDOW);
+      const data = await getBookContent(filename, 0, firstCount);
+      if (token !== loadToken.current) return;
       setBook(data);
+      loadRemainingLines(token, data.lines.length, data.total_lines);
+      // Mở tại đoạn khớp với kết quả tìm kiếm (best_line)
+      if (!isNaN(line) && line < data.lines.length) {
+        setCurrentLineIndex(line);
+        setTimeout(() => {
+          document.getElementById(`line-${line}`)?.scrollIntoView({ block: 'center' });
+        }, 0);
+      }
     } catch (error) {
       console.error('Error loading book:', error);
       alert('Không thể tải sách: ' + error.message);
@@ -101,6 +122,30 @@ export default function BookReader() {
     }
   };
 
+  const loadRemainingLines = async (token, start, total) => {
+    for (let next = start; next < total; next += LINE_WINDOW * 4) {
+      try {
+        const data = await getBookContent(filename, next, LINE_WINDOW * 4);
+        // Đã chuyển sang sách khác: bỏ phần còn lại
+        if (token !== loadToken.current) return;
+        setBook((current) => current && { ...current, lines: current.lines.concat(data.lines) });
+      } catch (error) {
+        console.error('Error loading lines:', error);
+        return;
+      }
+    }
+  };
+
+  const loadSimilarBooks = async () => {
+    try {
+      const data = await getSimilarBooks(filename);
+      setSimilarBooks(data.results || []);
+    } catch (error) {
+      // Sách chưa có trong index (chưa train) -> không hiện mục sách tương tự
+      setSimilarBooks([]);
+    }
+  };
+
   const toggleReading = () => {
     if (isReading) {
       // Stop reading completely
@@ -493,6 +538,25 @@ export default function BookReader() {
         </div>
       </div>
 
+      {/* Similar Books */}
+      {similarBooks.length > 0 && (
+        <div className="bg-white rounded-lg shadow-md p-6 mt-6">
+          <h2 className="text-lg font-semibold text-gray-800 mb-3">Sách tương tự</h2>
+          <ul className="space-y-2">
+            {similarBooks.map((similar) => (
+              <li key={similar.filename}>
+                <Link
+                  to={`/book/${encodeURIComponent(similar.filename)}`}
+                  className="text-primary-600 hover:underline"
+                >
+                  {similar.title || similar.filename}
+                </Link>
+              </li>
+            ))}
+          </ul>
+        </div>
+      )}
+
       {/* Hidden audio player for Piper TTS */}
       <audio
         ref={audioPlayerRef}
@@ -145,6 +145,58 @@ export default function Training({ socket }) {
           </p>
         </div>
 
+        {/* Telemetry: thời gian từng stage để thấy nút thắt (I/O, tokenize, encode, checkpoint) */}
+        {status.telemetry && (
+          <div className="bg-gray-50 rounded-lg p-4 mb-6">
+            <div className="grid grid-cols-2 md:grid-cols-4 gap-4 mb-4 text-center">
+              <div>
+                <p className="text-xs text-gray-600">Sách/giây</p>
+                <p className="font-semibold text-gray-800">{status.telemetry.books_per_second}</p>
+              </div>
+              <div>
+                <p className="text-xs text-gray-600">Token/giây</p>
+                <p className="font-semibold text-gray-800">{Math.round(status.telemetry.tokens_per_second)}</p>
+              </div>
+              <div>
+                <p className="text-xs text-gray-600">Peak RAM</p>
+                <p className="font-semibold text-gray-800">
+                  {status.telemetry.peak_rss_bytes
+                    ? `${Math.round(status.telemetry.peak_rss_bytes / (1024 * 1024))} MB`
+                    : '-'}
+                </p>
+              </div>
+              <div>
+                <p className="text-xs text-gray-600">Ghi checkpoint</p>
+                <p className="font-semibold text-gray-800">
+                  {status.telemetry.checkpoint.writes} lần / {status.telemetry.checkpoint.total_seconds}s
+                </p>
+              </div>
+            </div>
+            <table className="w-full text-xs text-gray-700">
+              <thead>
+                <tr className="text-gray-500">
+                  <th className="text-left">Stage</th>
+                  <th className="text-right">Tổng (s)</th>
+                  <th className="text-right">p50 (ms)</th>
+                  <th className="text-right">p95 (ms)</th>
+                  <th className="text-right">p99 (ms)</th>
+                </tr>
+              </thead>
+              <tbody>
+                {Object.entries(status.telemetry.stages).map(([name, stage]) => (
+                  <tr key={name}>
+                    <td>{name}</td>
+                    <td className="text-right">{stage.total_seconds}</td>
+                    <td className="text-right">{stage.p50_ms}</td>
+                    <td className="text-right">{stage.p95_ms}</td>
+                    <td className="text-right">{stage.p99_ms}</td>
+                  </tr>
+                ))}
+              </tbody>
+            </table>
+          </div>
+        )}
+
         {/* Control Buttons */}
         <div className="flex flex-col sm:flex-row gap-4 justify-center">
           {!isTraining ? (
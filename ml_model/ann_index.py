@@ -0,0 +1,312 @@
+"""
+ANN Index cho tìm kiếm sách
+Hỗ trợ HNSW / IVF (faiss-cpu) và brute-force fallback khi không có faiss
+
+RAM của từng loại (N vector, d chiều):
+- flat: không copy, search thẳng trên EmbeddingStore (mmap / float16 / int8), chậm nhất nhưng RAM ~ 0
+- hnsw / ivf với storage='sq8' (mặc định): faiss giữ vector dạng 8-bit, ~N*d byte
+  (+ graph ~N*m*8 byte với HNSW); điểm được tính lại exact trên EmbeddingStore cho top_k ứng viên
+- hnsw / ivf với storage='flat': faiss giữ thêm một bản float32 đầy đủ (~N*d*4 byte),
+  tức là nhân đôi embeddings khi STORAGE_MODE=mmap / int8 - chỉ nên dùng khi RAM dư
+
+Trong checkpoint, index của mỗi version nằm trong thư mục ann_index.v<N>/ (snapshot_files.py),
+checkpoint cũ lưu ann_index.faiss / ann_index.json thẳng trong checkpoint_dir
+"""
+
+import os
+import json
+import shutil
+import numpy as np
+from typing import Dict, Optional, Tuple
+import logging
+
+from embedding_store import EmbeddingStore
+from snapshot_files import published_path, remove_path, staged_path
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = 'ann_index.faiss'
+INDEX_INFO_FILE = 'ann_index.json'
+ANN_DIR = 'ann_index'
+# File của checkpoint cũ -> tên logic thay thế nó (dọn file cũ khi đã có ann_index.v<N>/)
+LEGACY_FILES = {INDEX_FILE: ANN_DIR, INDEX_INFO_FILE: ANN_DIR}
+VECTOR_STORAGES = ('sq8', 'flat')      # cách faiss lưu vector trong index
+DEFAULT_VECTOR_STORAGE = 'sq8'
+BUILD_BLOCK_SIZE = 65536               # số vector add vào faiss mỗi lần (không copy cả ma trận)
+TRAIN_SAMPLE_SIZE = 100000             # số vector dùng để train SQ / k-means
+
+
+def _import_faiss():
+    """Import faiss nếu có, trả về None nếu chưa cài"""
+    try:
+        import faiss
+        return faiss
+    except ImportError:
+        return None
+
+
+class BruteForceIndex:
+    """
+    Exact search: dot product với toàn bộ ma trận (theo block qua EmbeddingStore)
+    Dùng làm fallback và làm chuẩn (ground truth) để đo recall
+    """
+
+    kind = 'flat'
+
+    def __init__(self, **params):
+        self.params = params
+        self.store = None
+
+    def __len__(self):
+        return 0 if self.store is None else len(self.store)
+
+    def build(self, embeddings):
+        # Store mmap / lượng tử hóa được dùng trực tiếp, không copy vào RAM
+        if isinstance(embeddings, EmbeddingStore):
+            self.store = embeddings
+        else:
+            self.store = EmbeddingStore(np.ascontiguousarray(embeddings, dtype=np.float32))
+        return self
+
+    def search(self, query: np.ndarray, top_k: int, **search_params) -> Tuple[np.ndarray, np.ndarray]:
+        return self.store.search(query, top_k)
+
+    def save(self, directory: str):
+        # Dữ liệu nằm sẵn trong embeddings.npy, chỉ cần ghi info
+        _write_info(directory, self.kind, len(self), self.params)
+
+    def load_data(self, directory: str, embeddings):
+        return self.build(embeddings)
+
+
+class _FaissIndex:
+    """Base cho các index dùng faiss (inner product, khớp với scoring cũ)"""
+
+    kind = None
+
+    def __init__(self, **params):
+        self.faiss = _import_faiss()
+        if self.faiss is None:
+            raise ImportError("faiss-cpu is not installed")
+        self.params = params
+        self.params.setdefault('storage', DEFAULT_VECTOR_STORAGE)
+        if self.params['storage'] not in VECTOR_STORAGES:
+            raise ValueError(f"Unknown vector storage: {self.params['storage']} "
+                             f"(choose from {list(VECTOR_STORAGES)})")
+        self.index = None
+        # Embeddings gốc (mmap / EmbeddingStore, không copy) để tính lại điểm exact khi vector bị nén
+        self.embeddings = None
+
+    def __len__(self):
+        return 0 if self.index is None else self.index.ntotal
+
+    @property
+    def compressed(self) -> bool:
+        return self.params['storage'] != 'flat'
+
+    def _create(self, dim: int, count: int):
+        raise NotImplementedError
+
+    def _search_parameters(self, **search_params):
+        return None
+
+    def build(self, embeddings: np.ndarray):
+        # Train trên một mẫu rồi add theo block: không bao giờ giữ cả ma trận float32 trong RAM
+        count, dim = len(embeddings), embeddings.shape[1]
+        self.index = self._create(dim, count)
+        if not self.index.is_trained:
+            if count > TRAIN_SAMPLE_SIZE:
+                sample = np.sort(np.random.default_rng(0).choice(count, TRAIN_SAMPLE_SIZE, replace=False))
+            else:
+                sample = slice(0, count)
+            self.index.train(np.ascontiguousarray(embeddings[sample], dtype=np.float32))
+        for start in range(0, count, BUILD_BLOCK_SIZE):
+            self.index.add(np.ascontiguousarray(embeddings[start:start + BUILD_BLOCK_SIZE], dtype=np.float32))
+        self.embeddings = embeddings
+        return self
+
+    def _rerank(self, ids: np.ndarray, query: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Tính lại điểm exact cho ứng viên từ vector nén (đọc đúng top_k dòng từ store)"""
+        order = np.argsort(ids)
+        rows = np.asarray(self.embeddings[ids[order]], dtype=np.float32)
+        scores = np.empty(len(ids), dtype=np.float32)
+        scores[order] = rows @ query
+        best = np.argsort(-scores, kind='stable')
+        return scores[best], ids[best]
+
+    def search(self, query: np.ndarray, top_k: int, **search_params) -> Tuple[np.ndarray, np.ndarray]:
+        top_k = min(top_k, len(self))
+        if top_k <= 0:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+
+        query = np.asarray(query, dtype=np.float32).reshape(1, -1)
+        params = self._search_parameters(**search_params)
+        if params is not None:
+            scores, ids = self.index.search(query, top_k, params=params)
+        else:
+            scores, ids = self.index.search(query, top_k)
+
+        # faiss trả về -1 khi không đủ kết quả (ví dụ nprobe quá nhỏ)
+        valid = ids[0] >= 0
+        scores, ids = scores[0][valid], ids[0][valid].astype(np.int64)
+        if self.compressed and self.embeddings is not None and len(ids):
+            scores, ids = self._rerank(ids, query[0])
+        return scores, ids
+
+    def save(self, directory: str):
+        # Ghi file tạm rồi os.replace: snapshot đang phục vụ search không thấy file ghi dở
+        path = os.path.join(directory, INDEX_FILE)
+        self.faiss.write_index(self.index, path + '.tmp')
+        os.replace(path + '.tmp', path)
+        _write_info(directory, self.kind, len(self), self.params)
+
+    def load_data(self, directory: str, embeddings: np.ndarray):
+        self.index = self.faiss.read_index(os.path.join(directory, INDEX_FILE))
+        self.embeddings = embeddings
+        return self
+
+
+class HNSWIndex(_FaissIndex):
+    """
+    HNSW graph index
+    - m: số cạnh mỗi node (lớn hơn = recall cao hơn, tốn RAM hơn)
+    - ef_construction: độ rộng tìm kiếm khi build
+    - ef_search: độ rộng tìm kiếm khi query (knob recall/latency)
+    - storage: 'sq8' (IndexHNSWSQ, 1 byte/chiều) | 'flat' (IndexHNSWFlat, bản float32 đầy đủ)
+    """
+
+    kind = 'hnsw'
+
+    def _create(self, dim: int, count: int):
+        m = int(self.params.get('m', 32))
+        if self.compressed:
+            index = self.faiss.IndexHNSWSQ(dim, self.faiss.ScalarQuantizer.QT_8bit, m,
+                                           self.faiss.METRIC_INNER_PRODUCT)
+        else:
+            index = self.faiss.IndexHNSWFlat(dim, m, self.faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = int(self.params.get('ef_construction', 200))
+        index.hnsw.efSearch = int(self.params.get('ef_search', 64))
+        return index
+
+    def _search_parameters(self, ef_search: Optional[int] = None, **_):
+        if ef_search is None:
+            return None
+        return self.faiss.SearchParametersHNSW(efSearch=int(ef_search))
+
+
+class IVFIndex(_FaissIndex):
+    """
+    IVF (inverted file) index
+    - nlist: số cluster (mặc định ~4*sqrt(N))
+    - nprobe: số cluster được quét khi query (knob recall/latency)
+    - storage: 'sq8' (IndexIVFScalarQuantizer) | 'flat' (IndexIVFFlat)
+    """
+
+    kind = 'ivf'
+
+    def _create(self, dim: int, count: int):
+        nlist = self.params.get('nlist') or int(4 * np.sqrt(max(count, 1)))
+        # k-means của faiss cần ~39 điểm mỗi cluster để train ổn định
+        nlist = max(1, min(int(nlist), count // 39))
+        self.params['nlist'] = nlist
+        quantizer = self.faiss.IndexFlatIP(dim)
+        if self.compressed:
+            index = self.faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, self.faiss.ScalarQuantizer.QT_8bit,
+                                                       self.faiss.METRIC_INNER_PRODUCT)
+        else:
+            index = self.faiss.IndexIVFFlat(quantizer, dim, nlist, self.faiss.METRIC_INNER_PRODUCT)
+        index.nprobe = int(self.params.get('nprobe', 16))
+        # Giữ quantizer sống cùng index (tránh bị GC bên Python)
+        self._quantizer = quantizer
+        return index
+
+    def _search_parameters(self, nprobe: Optional[int] = None, **_):
+        if nprobe is None:
+            return None
+        return self.faiss.SearchParametersIVF(nprobe=int(nprobe))
+
+
+INDEX_TYPES = {
+    BruteForceIndex.kind: BruteForceIndex,
+    HNSWIndex.kind: HNSWIndex,
+    IVFIndex.kind: IVFIndex,
+}
+
+
+def _write_info(directory: str, kind: str, count: int, params: Dict):
+    info = {'kind': kind, 'count': int(count), 'params': params}
+    path = os.path.join(directory, INDEX_INFO_FILE)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(info, f, ensure_ascii=False, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def create_index(kind: str = 'hnsw', **params):
+    """Tạo index theo tên, fallback brute-force nếu thiếu faiss"""
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type: {kind} (choose from {list(INDEX_TYPES)})")
+    try:
+        return INDEX_TYPES[kind](**params)
+    except ImportError as e:
+        logger.warning(f"{e}, falling back to brute-force search")
+        return BruteForceIndex(**params)
+
+
+def build_index(embeddings: np.ndarray, kind: str = 'hnsw', **params):
+    """Build index từ ma trận embeddings"""
+    index = create_index(kind, **params)
+    if len(embeddings) == 0:
+        return BruteForceIndex().build(np.zeros((0, 1), dtype=np.float32))
+    return index.build(embeddings)
+
+
+def save_staged(index, checkpoint_dir: str) -> str:
+    """
+    Ghi index vào ann_index.v<N>/ của version sắp publish (thư mục tạm rồi đổi tên một lần)
+    Index của version đang phục vụ không bị ghi đè, reader không bao giờ thấy faiss / json lệch nhau
+    """
+    directory = staged_path(checkpoint_dir, ANN_DIR)
+    tmp_dir = directory + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    index.save(tmp_dir)
+    # Bản staged cũ (build lại trước khi publish) chưa snapshot nào mở
+    remove_path(directory)
+    os.replace(tmp_dir, directory)
+    return directory
+
+
+def published_index_dir(checkpoint_dir: str, info: Dict = None) -> str:
+    """Thư mục index của version đã publish; checkpoint cũ lưu thẳng trong checkpoint_dir"""
+    directory = published_path(checkpoint_dir, ANN_DIR, info)
+    return directory if os.path.isdir(directory) else checkpoint_dir
+
+
+def load_index(directory: str, embeddings: np.ndarray):
+    """
+    Load index đã lưu cạnh embeddings.npy
+    Nếu không có / lỗi / lệch số lượng với embeddings thì dùng brute-force
+    """
+    info_path = os.path.join(directory, INDEX_INFO_FILE)
+    if os.path.exists(info_path):
+        try:
+            with open(info_path, 'r', encoding='utf-8') as f:
+                info = json.load(f)
+
+            if info['count'] != len(embeddings):
+                logger.warning(
+                    f"Index is stale ({info['count']} vs {len(embeddings)} embeddings), using brute-force"
+                )
+            else:
+                params = info.get('params', {})
+                # Index ghi trước khi có tham số storage đều là bản float32 đầy đủ
+                params.setdefault('storage', 'flat')
+                index = create_index(info['kind'], **params)
+                index.load_data(directory, embeddings)
+                logger.info(f"Loaded {index.kind} index with {len(index)} vectors")
+                return index
+        except Exception as e:
+            logger.warning(f"Error loading index: {e}, using brute-force")
+
+    return BruteForceIndex().build(embeddings)
@@ -0,0 +1,263 @@
+"""
+Benchmark Search (không cần mạng)
+- Ma trận embeddings tổng hợp (cụm Gaussian, đã chuẩn hóa) từ 10 nghìn tới 1 triệu+ dòng,
+  hoặc embeddings.npy có sẵn trong checkpoint
+- Chạy từng backend search: flat (brute-force), hnsw, ivf, float16, int8, sharded
+- Mỗi backend: build time, bộ nhớ, latency p50 / p95 / p99, QPS ở concurrency cố định, recall@k so với exact
+- Kết quả là JSON để so sánh giữa các lần thay đổi
+
+python benchmark_search.py --rows 10000,100000 --backends flat,hnsw,int8,sharded --output bench.json
+python benchmark_search.py --checkpoint ../data/checkpoints
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+import logging
+
+from ann_index import build_index, _import_faiss
+from embedding_store import EMBEDDINGS_FILE, EmbeddingStore, save_quantized
+from snapshot_files import published_path
+from shard_search import ShardCoordinator
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('flat', 'hnsw', 'ivf', 'float16', 'int8', 'sharded')
+DEFAULT_ROWS = (10000, 100000)
+DEFAULT_DIM = 768
+GENERATE_BLOCK = 65536
+
+
+def generate_embeddings(directory: str, rows: int, dim: int = DEFAULT_DIM, clusters: int = 256,
+                        seed: int = 0) -> str:
+    """
+    Ghi ma trận tổng hợp vào directory/embeddings.npy theo block (không giữ cả ma trận trong RAM)
+    Các vector quanh clusters tâm cụm để ANN có cấu trúc giống embeddings thật
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    path = os.path.join(directory, EMBEDDINGS_FILE)
+    out = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(rows, dim))
+    for start in range(0, rows, GENERATE_BLOCK):
+        end = min(start + GENERATE_BLOCK, rows)
+        block = centers[rng.integers(0, clusters, end - start)]
+        block += rng.standard_normal(block.shape).astype(np.float32) * 0.6
+        block /= np.linalg.norm(block, axis=1, keepdims=True)
+        out[start:end] = block
+    out.flush()
+    del out
+    return path
+
+
+def make_queries(store: EmbeddingStore, num_queries: int, seed: int = 0) -> np.ndarray:
+    """Query = row ngẫu nhiên + nhiễu nhỏ (giống recall_check)"""
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(len(store), size=min(num_queries, len(store)), replace=False))
+    queries = store[rows]
+    return queries + rng.normal(0, queries.std() * 0.1, queries.shape).astype(np.float32)
+
+
+def _rss_bytes(pid: int = None) -> int:
+    """RSS hiện tại của process (Linux /proc, nếu không có thì thử psutil)"""
+    try:
+        with open(f"/proc/{pid or 'self'}/statm", 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss
+    except Exception:
+        return None
+
+
+def _percentile(values: List[float], q: float) -> float:
+    return round(float(np.percentile(values, q)), 3) if values else 0.0
+
+
+class _Backend:
+    """Một backend đã build: search(query, top_k) -> ids, kèm thông tin kind / bytes / close"""
+
+    def __init__(self, search_fn, kind: str, nbytes: int = None, close_fn=None, pids: List[int] = None):
+        self.search = search_fn
+        self.kind = kind
+        self.nbytes = nbytes
+        self.close = close_fn or (lambda: None)
+        self.pids = pids or []
+
+
+def build_backend(name: str, directory: str, params: Dict) -> _Backend:
+    if name in ('flat', 'hnsw', 'ivf'):
+        embeddings = np.load(os.path.join(directory, EMBEDDINGS_FILE))
+        index = build_index(embeddings, name, **params.get(name, {}))
+        nbytes = embeddings.nbytes if index.kind == 'flat' else None
+        return _Backend(lambda q, k: index.search(q, k, **params.get('search', {}))[1], index.kind, nbytes)
+
+    if name in ('float16', 'int8'):
+        save_quantized(directory, modes=(name,))
+        store = EmbeddingStore.open(directory, name)
+        return _Backend(lambda q, k: store.search(q, k)[1], name, store.nbytes)
+
+    if name == 'sharded':
+        coordinator = ShardCoordinator(
+            directory, params.get('shards', 4), params.get('shard_index', 'flat'),
+            params.get(params.get('shard_index', 'flat'), {}), storage='mmap', timeout_ms=0
+        ).start()
+        return _Backend(
+            lambda q, k: coordinator.search(q, k, **params.get('search', {}))[1],
+            f"sharded-{coordinator.num_shards}x{coordinator.index_type}",
+            close_fn=coordinator.close,
+            pids=coordinator.pids
+        )
+
+    raise ValueError(f"Unknown backend: {name} (choose from {list(BACKENDS)})")
+
+
+def benchmark_backend(name: str, directory: str, queries: np.ndarray, truth: List[set], top_k: int,
+                      concurrency: int, params: Dict) -> Dict:
+    rss_before = _rss_bytes()
+    start = time.perf_counter()
+    backend = build_backend(name, directory, params)
+    build_seconds = time.perf_counter() - start
+    rss_after = _rss_bytes()
+
+    try:
+        # Warm-up (trang mmap, thread pool của BLAS / faiss)
+        for query in queries[:min(10, len(queries))]:
+            backend.search(query, top_k)
+
+        latencies = []
+        hits = 0
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            ids = backend.search(query, top_k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            hits += len(expected & set(np.asarray(ids).tolist()))
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            start = time.perf_counter()
+            list(executor.map(lambda q: backend.search(q, top_k), queries))
+            concurrent_seconds = time.perf_counter() - start
+
+        memory = {
+            'index_bytes': backend.nbytes,
+            'rss_delta_bytes': rss_after - rss_before if rss_before is not None and rss_after is not None else None
+        }
+        if backend.pids:
+            memory['worker_rss_bytes'] = sum(_rss_bytes(pid) or 0 for pid in backend.pids)
+    finally:
+        backend.close()
+
+    result = {
+        'kind': backend.kind,
+        'build_seconds': round(build_seconds, 3),
+        'memory': memory,
+        'latency_ms': {
+            'p50': _percentile(latencies, 50),
+            'p95': _percentile(latencies, 95),
+            'p99': _percentile(latencies, 99),
+            'mean': round(float(np.mean(latencies)), 3)
+        },
+        'qps': round(len(queries) / concurrent_seconds, 2) if concurrent_seconds > 0 else 0.0,
+        'concurrency': concurrency,
+        f'recall_at_{top_k}': round(hits / float(sum(len(expected) for expected in truth) or 1), 4)
+    }
+    logger.info(f"{name}: {result}")
+    return result
+
+
+def run_benchmark(directory: str, backends=BACKENDS, num_queries: int = 200, top_k: int = 10,
+                  concurrency: int = 8, params: Dict = None) -> Dict:
+    """Benchmark mọi backend trên directory/embeddings.npy, ground truth = exact search float32"""
+    params = params or {}
+    store = EmbeddingStore.open(directory, 'mmap')
+    queries = make_queries(store, num_queries)
+    start = time.perf_counter()
+    truth = [set(store.search(query, top_k)[1].tolist()) for query in queries]
+    exact_ms = (time.perf_counter() - start) * 1000 / max(len(queries), 1)
+
+    report = {
+        'rows': len(store),
+        'dim': store.shape[1],
+        'num_queries': len(queries),
+        'top_k': top_k,
+        'exact_ms_per_query': round(exact_ms, 3),
+        'backends': {}
+    }
+    for name in backends:
+        try:
+            report['backends'][name] = benchmark_backend(name, directory, queries, truth, top_k, concurrency, params)
+        except Exception as e:
+            logger.error(f"{name} failed: {e}")
+            report['backends'][name] = {'error': str(e)}
+    return report
+
+
+def environment() -> Dict:
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'faiss': _import_faiss() is not None,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+
+
+def _arg(name: str, default=None):
+    if name in sys.argv:
+        return sys.argv[sys.argv.index(name) + 1]
+    return default
+
+
+if __name__ == "__main__":
+    # python benchmark_search.py [--rows 10000,100000 | --checkpoint dir] [--dim 768] [--backends flat,hnsw,...]
+    #                            [--queries 200] [--top-k 10] [--concurrency 8] [--shards 4] [--output bench.json]
+    backends = _arg('--backends', ','.join(BACKENDS)).split(',')
+    num_queries = int(_arg('--queries', 200))
+    top_k = int(_arg('--top-k', 10))
+    concurrency = int(_arg('--concurrency', 8))
+    params = {
+        'shards': int(_arg('--shards', 4)),
+        'shard_index': _arg('--shard-index', 'flat'),
+        'hnsw': {'m': int(_arg('--hnsw-m', 32)), 'ef_construction': int(_arg('--ef-construction', 200))},
+        'ivf': {},
+        'search': {key: int(value) for key, value in (('ef_search', _arg('--ef-search')),
+                                                      ('nprobe', _arg('--nprobe'))) if value is not None}
+    }
+
+    results = {'environment': environment(), 'params': params, 'runs': []}
+    checkpoint = _arg('--checkpoint')
+    if checkpoint:
+        # Chạy trên bản copy để float16 / int8 không ghi đè file lượng tử hóa của checkpoint
+        work_dir = tempfile.mkdtemp(prefix='bench_')
+        shutil.copyfile(published_path(checkpoint, EMBEDDINGS_FILE), os.path.join(work_dir, EMBEDDINGS_FILE))
+        run = run_benchmark(work_dir, backends, num_queries, top_k, concurrency, params)
+        run['source'] = os.path.abspath(checkpoint)
+        results['runs'].append(run)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    else:
+        dim = int(_arg('--dim', DEFAULT_DIM))
+        for rows in [int(r) for r in _arg('--rows', ','.join(map(str, DEFAULT_ROWS))).split(',')]:
+            work_dir = tempfile.mkdtemp(prefix='bench_')
+            start = time.perf_counter()
+            generate_embeddings(work_dir, rows, dim)
+            logger.info(f"Generated {rows} x {dim} synthetic embeddings in {time.perf_counter() - start:.1f}s")
+            run = run_benchmark(work_dir, backends, num_queries, top_k, concurrency, params)
+            run['source'] = 'synthetic'
+            results['runs'].append(run)
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = json.dumps(results, ensure_ascii=False, indent=2)
+    if _arg('--output'):
+        with open(_arg('--output'), 'w', encoding='utf-8') as f:
+            f.write(output)
+    print(output)
@@ -0,0 +1,331 @@
+"""
+Book Catalog cho /api/books/list
+- Build một lần: filename, title, size, số dòng, preview của mọi sách, lưu gọn trong catalog.npz
+  (mảng số + một blob UTF-8 với bảng offset), load vào RAM khi khởi động
+- Refresh incremental theo mtime của thư mục dataset: chỉ đọc lại file mới / đổi size hoặc mtime
+- Có corpus pack (corpus_pack.py) thì sách trong pack lấy size / số dòng / preview từ pack,
+  thư mục dataset chỉ bổ sung các sách chưa được đóng gói
+- List là slice trong RAM; phân trang keyset (cursor) theo title / size / filename nên trang sâu
+  tốn như trang đầu và không lệch khi catalog thay đổi giữa hai request
+"""
+
+import os
+import json
+import time
+import base64
+import bisect
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CATALOG_FILE = 'catalog.npz'
+PREVIEW_CHARS = 300
+PREVIEW_BYTES = PREVIEW_CHARS * 4       # UTF-8 tối đa 4 byte / ký tự
+READ_CHUNK = 1024 * 1024
+SORT_KEYS = ('filename', 'title', 'size')
+DEFAULT_WORKERS = 8
+CHECK_INTERVAL = 1.0                    # giây giữa hai lần stat thư mục dataset
+
+
+def scan_book(dataset_path: str, filename: str) -> Optional[Tuple]:
+    """(size, mtime_ns, số dòng, preview) của một sách, đọc theo chunk; None nếu file lỗi"""
+    file_path = os.path.join(dataset_path, filename)
+    try:
+        with open(file_path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            head = f.read(PREVIEW_BYTES)
+            newlines = head.count(b'\n')
+            for chunk in iter(lambda: f.read(READ_CHUNK), b''):
+                newlines += chunk.count(b'\n')
+    except OSError as e:
+        logger.warning(f"Skipping {filename}: {e}")
+        return None
+    # Ký tự cuối có thể bị cắt giữa chừng: bỏ qua byte lẻ; số dòng giống content.split('\n')
+    preview = head.decode('utf-8', errors='ignore')[:PREVIEW_CHARS]
+    return stat.st_size, stat.st_mtime_ns, newlines + 1, preview
+
+
+def scan_packed_book(pack, filename: str) -> Tuple:
+    """Như scan_book nhưng từ corpus pack: số dòng lấy từ line index đóng gói sẵn"""
+    size, mtime_ns = pack.stat(filename)
+    preview = pack.read_bytes(filename, PREVIEW_BYTES).decode('utf-8', errors='ignore')[:PREVIEW_CHARS]
+    return size, mtime_ns, len(pack.line_index(filename)), preview
+
+
+def dir_mtime_ns(dataset_path: str) -> int:
+    """mtime của thư mục dataset, 0 nếu không có (chỉ dùng pack)"""
+    return os.stat(dataset_path).st_mtime_ns if os.path.isdir(dataset_path) else 0
+
+
+def _encode_strings(values: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    encoded = [value.encode('utf-8') for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def _decode_strings(blob: np.ndarray, offsets: np.ndarray) -> List[str]:
+    data = blob.tobytes()
+    return [data[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
+
+
+def encode_cursor(sort: str, key, filename: str) -> str:
+    """Cursor keyset: sort key đi kèm để cursor của sort khác bị từ chối thay vì so sánh lệch kiểu"""
+    return base64.urlsafe_b64encode(
+        json.dumps([sort, key, filename], ensure_ascii=False).encode('utf-8')
+    ).decode('ascii')
+
+
+def decode_cursor(cursor: str, sort: str) -> Tuple:
+    """(key, filename) của cursor; cursor hỏng / của sort khác / key sai kiểu -> ValueError"""
+    try:
+        cursor_sort, key, filename = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    if cursor_sort != sort:
+        raise ValueError(f"Cursor was created for sort={cursor_sort}, not sort={sort}")
+    key_type = int if sort == 'size' else str
+    if type(key) is not key_type or not isinstance(filename, str):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return key, filename
+
+
+class BookCatalog:
+    """
+    Catalog trong RAM: các list song song theo entry + thứ tự sắp xếp tính sẵn cho từng sort key
+    Object bất biến sau khi tạo; refresh() tạo catalog mới và thay reference (giống IndexSnapshot)
+    """
+
+    def __init__(self, filenames: List[str], sizes: np.ndarray, mtimes: np.ndarray, lines: np.ndarray,
+                 previews: List[str], info: Dict):
+        self.filenames = filenames
+        self.titles = [filename.replace('.txt', '') for filename in filenames]
+        self.sizes = np.asarray(sizes, dtype=np.int64)
+        self.mtimes = np.asarray(mtimes, dtype=np.int64)
+        self.lines = np.asarray(lines, dtype=np.int64)
+        self.previews = previews
+        self.info = info
+        self._rows = {filename: row for row, filename in enumerate(filenames)}
+
+        # Mỗi sort key: row theo thứ tự tăng dần + key tương ứng (tie-break bằng filename) để bisect
+        self._orders = {}
+        self._keys = {}
+        for sort in SORT_KEYS:
+            keys = [(self._sort_value(sort, row), filenames[row]) for row in range(len(filenames))]
+            order = sorted(range(len(filenames)), key=keys.__getitem__)
+            self._orders[sort] = order
+            self._keys[sort] = [keys[row] for row in order]
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def _sort_value(self, sort: str, row: int):
+        if sort == 'title':
+            return self.titles[row].casefold()
+        if sort == 'size':
+            return int(self.sizes[row])
+        return self.filenames[row]
+
+    def entry(self, row: int) -> Dict:
+        return {
+            'filename': self.filenames[row],
+            'title': self.titles[row],
+            'size': int(self.sizes[row]),
+            'total_lines': int(self.lines[row]),
+            'preview': self.previews[row]
+        }
+
+    def get(self, filename: str) -> Optional[Dict]:
+        row = self._rows.get(filename)
+        return self.entry(row) if row is not None else None
+
+    def list(self, sort: str = 'filename', order: str = 'asc', limit: int = 50,
+             cursor: str = None, offset: int = 0) -> Dict:
+        """
+        Một trang của catalog
+        cursor (next_cursor của trang trước): keyset, bắt đầu ngay sau entry cuối của trang trước
+        offset: phân trang kiểu page / per_page (vẫn là slice trong RAM)
+        """
+        if sort not in SORT_KEYS:
+            raise ValueError(f"Unknown sort: {sort} (choose from {list(SORT_KEYS)})")
+        if order not in ('asc', 'desc'):
+            raise ValueError(f"Unknown order: {order} (asc | desc)")
+        rows, keys = self._orders[sort], self._keys[sort]
+        total = len(rows)
+
+        if cursor:
+            key = decode_cursor(cursor, sort)
+            if order == 'asc':
+                start = bisect.bisect_right(keys, key)
+            else:
+                start = total - bisect.bisect_left(keys, key)
+        else:
+            start = max(offset, 0)
+        end = min(start + max(limit, 0), total)
+
+        if order == 'asc':
+            page_rows = rows[start:end]
+        else:
+            page_rows = rows[total - end:total - start][::-1]
+        last = page_rows[-1] if page_rows else None
+        return {
+            'books': [self.entry(row) for row in page_rows],
+            'total': total,
+            'sort': sort,
+            'order': order,
+            'next_cursor': encode_cursor(sort, self._sort_value(sort, last), self.filenames[last])
+            if last is not None and end < total else None
+        }
+
+    def save(self, path: str):
+        """Ghi catalog.npz (file tạm + os.replace)"""
+        names_blob, names_offsets = _encode_strings(self.filenames)
+        previews_blob, previews_offsets = _encode_strings(self.previews)
+        tmp_path = path + '.tmp.npz'
+        np.savez(
+            tmp_path,
+            info=np.frombuffer(json.dumps(self.info, ensure_ascii=False).encode('utf-8'), dtype=np.uint8),
+            names_blob=names_blob, names_offsets=names_offsets,
+            previews_blob=previews_blob, previews_offsets=previews_offsets,
+            sizes=self.sizes, mtimes=self.mtimes, lines=self.lines
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'BookCatalog':
+        with np.load(path) as data:
+            return cls(
+                _decode_strings(data['names_blob'], data['names_offsets']),
+                data['sizes'], data['mtimes'], data['lines'],
+                _decode_strings(data['previews_blob'], data['previews_offsets']),
+                json.loads(data['info'].tobytes().decode('utf-8'))
+            )
+
+
+def build_catalog(dataset_path: str, previous: BookCatalog = None, workers: int = DEFAULT_WORKERS,
+                  pack=None) -> BookCatalog:
+    """
+    Quét thư mục dataset (os.scandir, không mở file) rồi chỉ đọc các file mới hoặc đổi size / mtime;
+    entry không đổi lấy lại từ previous. Sách có trong pack được đọc từ pack (bản trong pack được ưu tiên)
+    """
+    start_time = time.time()
+    mtime_ns = dir_mtime_ns(dataset_path)
+    listing = sorted(
+        (entry.name, entry.stat()) for entry in os.scandir(dataset_path)
+        if entry.name.endswith('.txt') and entry.is_file() and (pack is None or entry.name not in pack)
+    ) if mtime_ns else []
+    packed = {filename: pack.stat(filename) for filename in pack.filenames} if pack is not None else {}
+    candidates = {filename: (stat.st_size, stat.st_mtime_ns) for filename, stat in listing}
+    candidates.update(packed)
+
+    reused = {}
+    to_scan = []
+    to_scan_packed = []
+    for filename, (size, mtime) in candidates.items():
+        row = previous._rows.get(filename) if previous is not None else None
+        if row is not None and previous.sizes[row] == size and previous.mtimes[row] == mtime:
+            reused[filename] = (size, mtime, int(previous.lines[row]), previous.previews[row])
+        elif filename in packed:
+            to_scan_packed.append(filename)
+        else:
+            to_scan.append(filename)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        scanned = dict(zip(to_scan, executor.map(lambda name: scan_book(dataset_path, name), to_scan)))
+    scanned.update((filename, scan_packed_book(pack, filename)) for filename in to_scan_packed)
+
+    filenames, sizes, mtimes, lines, previews = [], [], [], [], []
+    for filename in sorted(candidates):
+        entry = reused.get(filename) or scanned.get(filename)
+        if entry is None:
+            continue
+        filenames.append(filename)
+        sizes.append(entry[0])
+        mtimes.append(entry[1])
+        lines.append(entry[2])
+        previews.append(entry[3])
+
+    info = {
+        'dataset_path': os.path.abspath(dataset_path),
+        'dir_mtime_ns': mtime_ns,
+        'pack_built_at': pack.info['built_at'] if pack is not None else None,
+        'count': len(filenames),
+        'built_at': time.time()
+    }
+    removed = len(previous) - len(reused) if previous is not None else 0
+    logger.info(f"Catalog: {len(filenames)} books ({len(to_scan) + len(to_scan_packed)} scanned, "
+                f"{len(reused)} reused, {removed} removed) in {time.time() - start_time:.2f}s")
+    return BookCatalog(filenames, np.asarray(sizes, dtype=np.int64), np.asarray(mtimes, dtype=np.int64),
+                       np.asarray(lines, dtype=np.int64), previews, info)
+
+
+class CatalogManager:
+    """
+    Giữ catalog hiện tại cho backend: load catalog.npz nếu có, build nếu chưa,
+    current() kiểm tra mtime thư mục dataset (tối đa một lần mỗi check_interval giây) và refresh khi đổi
+    pack: CorpusPack đang dùng (đổi pack thì catalog.npz cũ được build lại)
+    """
+
+    def __init__(self, dataset_path: str, cache_dir: str, workers: int = DEFAULT_WORKERS,
+                 check_interval: float = CHECK_INTERVAL, pack=None):
+        self.dataset_path = dataset_path
+        self.pack = pack
+        self.path = os.path.join(cache_dir, CATALOG_FILE)
+        self.workers = workers
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._catalog = None
+        self._checked_at = 0.0
+        self.refreshes = 0
+
+    def _load_or_build(self) -> BookCatalog:
+        previous = None
+        if os.path.exists(self.path):
+            try:
+                previous = BookCatalog.load(self.path)
+                if previous.info.get('dataset_path') != os.path.abspath(self.dataset_path):
+                    previous = None
+                elif not self._changed(previous):
+                    return previous
+            except Exception as e:
+                logger.warning(f"Could not load {self.path} ({e}), rebuilding catalog")
+                previous = None
+        return self._build(previous)
+
+    def _changed(self, catalog: BookCatalog) -> bool:
+        pack_built_at = self.pack.info['built_at'] if self.pack is not None else None
+        return catalog.info.get('dir_mtime_ns') != dir_mtime_ns(self.dataset_path) or \
+            catalog.info.get('pack_built_at') != pack_built_at
+
+    def _build(self, previous: BookCatalog = None) -> BookCatalog:
+        catalog = build_catalog(self.dataset_path, previous, self.workers, self.pack)
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        catalog.save(self.path)
+        self.refreshes += 1
+        return catalog
+
+    def current(self) -> BookCatalog:
+        now = time.time()
+        catalog = self._catalog
+        if catalog is not None and now - self._checked_at < self.check_interval:
+            return catalog
+        with self._lock:
+            if self._catalog is None:
+                self._catalog = self._load_or_build()
+            elif now - self._checked_at >= self.check_interval:
+                if self._changed(self._catalog):
+                    self._catalog = self._build(self._catalog)
+            self._checked_at = now
+            return self._catalog
+
+    def refresh(self) -> BookCatalog:
+        """Quét lại toàn bộ (bắt cả file bị sửa tại chỗ, không làm đổi mtime thư mục)"""
+        with self._lock:
+            self._catalog = self._build(self._catalog)
+            self._checked_at = time.time()
+            return self._catalog
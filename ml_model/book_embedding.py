@@ -1,110 +1,314 @@
 import os
-import json
 import numpy as np
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Tuple
 import pickle
+import shutil
 import logging
+import threading
+import time
+from itertools import islice
+
+from ann_index import build_index, save_staged
+from embedding_store import (
+    EMBEDDINGS_FILE, save_quantized, recall_check, write_rows, append_rows, top_k_from_scores
+)
+from index_manifest import IndexManifest, book_entry
+from checkpoint_store import ShardedCheckpoint
+from corpus_ingest import IngestStats, iter_books, read_book_prefix, DEFAULT_PREFIX_BYTES
+from corpus_pack import open_pack
+from training_pipeline import TrainingPipeline, CheckpointWriter
+from training_telemetry import TrainingTelemetry, TELEMETRY_FILE, DEFAULT_INTERVAL as TELEMETRY_INTERVAL
+from multiproc_encoder import MultiProcessEncoder
+from query_cache import QueryEmbeddingCache, MicroBatcher, SearchResultCache, normalize_query
+from passage_index import PassageIndex, build_passage_index, invalidate_books
+from knn_graph import build_knn_graph, DEFAULT_K
+from lexical_index import LexicalIndex
+from onnx_encoder import ONNX_DIR, load_encoder, compare_backends
+from metadata_store import MetadataStore, METADATA_DB_FILE
+from snapshot_files import latest_path, published_path, staged_path
+from shard_search import ShardCoordinator, DEFAULT_SHARD_TIMEOUT_MS
+from index_snapshot import (
+    IndexSnapshot, SnapshotHolder, SnapshotWatcher, load_snapshot, publish_version, validate_snapshot,
+    LEXICAL_FIELDS
+)
+from length_batching import (
+    BucketedBatch, PaddingStats, bucketed_map, plan_batches, token_lengths,
+    DEFAULT_MAX_SEQ_LENGTH, WINDOW_BATCHES
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+SEARCH_MODES = ('dense', 'hybrid', 'lexical')
+HYBRID_CANDIDATES = 100
+RELOAD_PROBE_QUERY = 'sách hay'
+RESULT_CACHE_FILE = 'result_cache.sqlite'
+
+
+def _min_max(scores: np.ndarray) -> np.ndarray:
+    """Chuẩn hóa về [0, 1]; tập toàn điểm bằng nhau -> toàn 1"""
+    scores = np.asarray(scores, dtype=np.float32)
+    span = scores.max() - scores.min()
+    return (scores - scores.min()) / span if span > 0 else np.ones_like(scores)
+
+
 class VietnameseBookEmbedding:
     """
     Deep Learning model để xử lý và tìm kiếm sách Việt Nam
     Hỗ trợ pause/resume training với checkpoint
     """
     
-    def __init__(self, dataset_path: str, checkpoint_dir: str = "./checkpoints"):
+    def __init__(self, dataset_path: str, checkpoint_dir: str = "./checkpoints",
+                 index_type: str = "hnsw", index_params: Dict = None,
+                 storage: str = "memory", query_batch_wait_ms: float = 0.0,
+                 ingest_workers: int = 8, ingest_prefix_bytes: int = DEFAULT_PREFIX_BYTES,
+                 encode_workers: int = 1, encode_threads: int = None,
+                 lexical_tokenizer: str = "syllable", encoder_backend: str = "torch",
+                 search_shards: int = 0, shard_timeout_ms: float = DEFAULT_SHARD_TIMEOUT_MS,
+                 knn_k: int = DEFAULT_K, result_cache_size: int = 0, result_cache_shared: bool = False,
+                 telemetry_interval: float = TELEMETRY_INTERVAL, corpus_pack: str = None):
         self.dataset_path = dataset_path
+        # Corpus pack (corpus_pack.py): training đọc sách từ pack thay vì hàng nghìn file nhỏ
+        self.pack = open_pack(corpus_pack) if corpus_pack else None
         self.checkpoint_dir = checkpoint_dir
         self.model_name = "keepitreal/vietnamese-sbert"
         
+        # Encoder backend: torch | onnx | onnx-int8 (ONNX export nằm trong checkpoint_dir/onnx)
+        self.encoder_backend = encoder_backend
+        self.onnx_dir = os.path.join(checkpoint_dir, ONNX_DIR)
+        
+        # ANN index (hnsw / ivf / flat), build khi save_embeddings
+        self.index_type = index_type
+        self.index_params = index_params or {}
+        
+        # Storage: memory | mmap | float16 | int8 (xem embedding_store.py)
+        self.storage = storage
+        
+        # BM25 inverted index (lexical/): sinh ứng viên cho hybrid search
+        self.lexical_tokenizer = lexical_tokenizer
+        
+        # k-NN graph cho "sách tương tự" (knn.v<N>/), build sau save_embeddings, 0 = không build
+        self.knn_k = knn_k
+        
+        # Snapshot bất biến mà search đang đọc (embeddings, metadata, ANN / BM25 / passage index)
+        # Training / re-indexing không sửa snapshot này, chỉ thay reference khi version mới sẵn sàng
+        self._snapshots = SnapshotHolder(checkpoint_dir)
+        self._snapshot_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._watcher = None
+        self.last_reload = None
+        
+        # Sharded search: search_shards > 0 chia embeddings cho các shard process (shard_search.py)
+        self.search_shards = search_shards
+        self.shard_timeout_ms = shard_timeout_ms
+        self.shards = None
+        self._partial = threading.local()   # search hiện tại có shard không trả lời (không cache kết quả)
+        
+        # Cache query embeddings + gom query đồng thời (0 = encode trực tiếp)
+        self.query_cache = QueryEmbeddingCache()
+        self.query_batch_wait_ms = query_batch_wait_ms
+        self._query_batcher = MicroBatcher(
+            lambda texts: self.model.encode(texts, show_progress_bar=False),
+            max_wait_ms=query_batch_wait_ms
+        ) if query_batch_wait_ms > 0 else None
+        
         os.makedirs(checkpoint_dir, exist_ok=True)
         
+        # Cache kết quả search theo index version (0 = tắt); shared: thêm tầng SQLite dùng chung giữa các worker
+        self.result_cache = SearchResultCache(
+            result_cache_size,
+            shared_path=os.path.join(checkpoint_dir, RESULT_CACHE_FILE) if result_cache_shared else None
+        ) if result_cache_size > 0 else None
+        
         # Lazy load model (only when needed)
         self._model = None
         
-        # Data storage
+        # Dữ liệu của lần training đang chạy (search không đọc, xem self.snapshot)
         self.books = []
         self.embeddings = []
         self.metadata = []
+        # File chưa embed của checkpoint đang resume, train() stream lại từ dataset
+        self.resume_files = []
+        
+        # Ingestion song song: số worker và số byte tối đa đọc mỗi sách
+        self.ingest_workers = ingest_workers
+        self.ingest_prefix_bytes = ingest_prefix_bytes
+        self.ingest_stats = IngestStats()
+        
+        # Encode corpus bằng nhiều process (mỗi process một model, encode_threads thread mỗi process)
+        self.encode_workers = encode_workers
+        self.encode_threads = encode_threads
         
         # Training state
         self.current_index = 0
+        self.total_books = 0
+        self.pipeline = None
+        self.checkpoint_writer = None
+        self.padding_stats = None
         self.is_training = False
+        
+        # Telemetry của lần train gần nhất: timer / histogram từng stage, tokens/s, peak RSS
+        # Append vào checkpoint_dir/training_telemetry.jsonl tối đa một dòng mỗi telemetry_interval giây
+        self.telemetry = None
+        self.telemetry_interval = telemetry_interval
         self.training_progress = 0.0
+        
+        # Checkpoint append-only; _state_lock bảo vệ embeddings / current_index
+        # để pause từ thread khác luôn snapshot được trạng thái nhất quán
+        self.checkpoint = ShardedCheckpoint(checkpoint_dir)
+        self._state_lock = threading.Lock()
+        self._save_lock = threading.Lock()
     
     @property
     def model(self):
         """Lazy load model to avoid startup issues"""
         if self._model is None:
-            logger.info(f"Loading model: {self.model_name}")
-            from sentence_transformers import SentenceTransformer
-            self._model = SentenceTransformer(self.model_name)
+            logger.info(f"Loading model: {self.model_name} ({self.encoder_backend})")
+            self._model = load_encoder(self.model_name, self.encoder_backend, self.onnx_dir)
         return self._model
         
-    def load_books_metadata(self) -> List[Dict]:
-        """Load danh sách sách từ dataset với nội dung đầy đủ để training tốt hơn"""
-        books_data = []
+    def encode_query(self, query: str) -> np.ndarray:
+        """Encode query qua cache, miss thì encode (qua micro-batcher nếu bật)"""
+        query = normalize_query(query)
+        embedding = self.query_cache.get(self.model_name, query)
+        if embedding is not None:
+            return embedding
         
+        if self._query_batcher is not None:
+            embedding = self._query_batcher.encode(query)
+        else:
+            embedding = self.model.encode([query], show_progress_bar=False)[0]
+        
+        self.query_cache.put(self.model_name, query, embedding)
+        return embedding
+    
+    def get_query_stats(self) -> Dict:
+        """Thống kê cache và micro-batching của query encoder, cache kết quả search"""
+        return {
+            'cache': self.query_cache.stats(),
+            'batcher': self._query_batcher.stats() if self._query_batcher else None,
+            'result_cache': self.result_cache.stats() if self.result_cache else None
+        }
+    
+    def list_book_files(self) -> List[str]:
+        """Danh sách file .txt trong dataset (trong pack nếu có)"""
+        if self.pack is not None:
+            logger.info(f"Found {len(self.pack)} books in corpus pack")
+            return list(self.pack.filenames)
         if not os.path.exists(self.dataset_path):
             logger.error(f"Dataset path not found: {self.dataset_path}")
-            return books_data
-            
+            return []
         files = [f for f in os.listdir(self.dataset_path) if f.endswith('.txt')]
         logger.info(f"Found {len(files)} books in dataset")
+        return files
+    
+    def iter_books(self, filenames: List[str]):
+        """Stream record sách (đọc song song, chỉ đọc prefix) theo thứ tự filenames"""
+        self.ingest_stats = IngestStats()
+        return iter_books(
+            self.dataset_path, filenames,
+            workers=self.ingest_workers,
+            max_bytes=self.ingest_prefix_bytes,
+            stats=self.ingest_stats,
+            pack=self.pack
+        )
+    
+    def load_books_metadata(self) -> List[Dict]:
+        """Load danh sách sách từ dataset (preview, summary, first_lines) bằng ingestion song song"""
+        return list(self.iter_books(self.list_book_files()))
+    
+    def read_book(self, filename: str) -> Dict:
+        """
+        Đọc một sách và tạo record metadata (None nếu lỗi); luôn đọc file vì incremental update so với thư mục,
+        chỉ đọc từ pack khi sách không có trong dataset
+        """
+        in_dataset = os.path.exists(os.path.join(self.dataset_path, filename))
+        book, _ = read_book_prefix(self.dataset_path, filename, self.ingest_prefix_bytes,
+                                   None if in_dataset else self.pack)
+        return book
+    
+    @staticmethod
+    def build_text(book: Dict) -> str:
+        """Text đưa vào encoder cho một sách"""
+        # Combine title, summary và preview để AI hiểu sâu hơn về nội dung sách
+        # Điều này giúp AI có thể tìm sách dựa trên mô tả nội dung, không chỉ tên
+        text = f"Tên sách: {book['title']}. "
         
-        for filename in files:
-            file_path = os.path.join(self.dataset_path, filename)
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    
-                # Extract book info from filename and content
-                book_name = filename.replace('.txt', '')
-                
-                # Lấy nhiều nội dung hơn để training hiểu sách tốt hơn
-                # Lấy 3000 ký tự đầu (thay vì 500) để AI hiểu rõ hơn về nội dung sách
-                preview = content[:3000] if content else ""
-                
-                # Tạo summary từ các đoạn đầu sách
-                lines = content.split('\n')
-                meaningful_lines = [line.strip() for line in lines if len(line.strip()) > 20]
-                summary = ' '.join(meaningful_lines[:20])  # 20 dòng đầu có ý nghĩa
-                
-                books_data.append({
-                    'filename': filename,
-                    'title': book_name,
-                    'path': file_path,
-                    'preview': preview,
-                    'summary': summary[:1000],  # Summary ngắn gọn
-                    'content_length': len(content),
-                    'first_lines': content.split('\n')[:10] if content else []
-                })
-            except Exception as e:
-                logger.warning(f"Error reading {filename}: {e}")
-                
-        return books_data
+        if 'summary' in book and book['summary']:
+            text += f"Tóm tắt: {book['summary']}. "
+        
+        text += f"Nội dung: {book['preview']}"
+        return text
     
     def save_checkpoint(self):
-        """Lưu checkpoint để có thể resume sau"""
-        checkpoint = {
-            'current_index': self.current_index,
-            'books': self.books,
-            'embeddings': self.embeddings,
-            'metadata': self.metadata,
-            'training_progress': self.training_progress
-        }
-        
-        checkpoint_path = os.path.join(self.checkpoint_dir, 'latest_checkpoint.pkl')
-        with open(checkpoint_path, 'wb') as f:
-            pickle.dump(checkpoint, f)
+        """
+        Lưu checkpoint để có thể resume sau
+        Chỉ ghi các embeddings mới kể từ lần save trước (append-only)
+        """
+        with self._save_lock:
+            start = time.perf_counter()
+            with self._state_lock:
+                committed = self.checkpoint.committed
+                end = len(self.embeddings)
+                new_embeddings = list(self.embeddings[committed:end])
+                new_metadata = self.metadata[committed:end]
+                progress = self.training_progress
+            
+            if self.checkpoint.manifest is None:
+                if not self.books:
+                    return
+                self.checkpoint.reset([book['filename'] for book in self.books])
+            self.checkpoint.append(new_embeddings, new_metadata, progress)
         
-        logger.info(f"Checkpoint saved at index {self.current_index}")
+        if self.telemetry is not None:
+            self.telemetry.record_checkpoint(time.perf_counter() - start, len(new_embeddings))
+        logger.info(f"Checkpoint saved at index {end} (+{len(new_embeddings)} rows)")
+    
+    def peek_checkpoint(self) -> Optional[Dict]:
+        """Tiến độ của checkpoint hiện có, chỉ đọc manifest (không load embeddings / sách)"""
+        if not self.checkpoint.exists():
+            return None
+        try:
+            manifest = ShardedCheckpoint(self.checkpoint_dir).load()
+        except Exception as e:
+            logger.error(f"Error reading checkpoint: {e}")
+            return None
+        return {
+            'progress': manifest['training_progress'],
+            'current_index': manifest['committed'],
+            'total_books': manifest['total_books'],
+            'embeddings_count': manifest['committed']
+        }
     
     def load_checkpoint(self) -> bool:
         """Load checkpoint nếu có"""
+        if self.checkpoint.exists():
+            try:
+                manifest = self.checkpoint.load()
+                plan = self.checkpoint.load_plan()
+                done = self.checkpoint.load_metadata()
+                
+                # Sách chưa embed không đọc ở đây: train() stream lại từ dataset (song song)
+                done_files = {book['filename'] for book in done}
+                
+                with self._state_lock:
+                    self.embeddings = self.checkpoint.load_embeddings()
+                    self.books = done
+                    self.metadata = done.copy()
+                    self.resume_files = [f for f in plan if f not in done_files]
+                    self.total_books = len(done) + len(self.resume_files)
+                    self.current_index = manifest['committed']
+                    self.training_progress = manifest['training_progress']
+                
+                logger.info(f"Checkpoint loaded, resuming from index {self.current_index}")
+                return True
+            except Exception as e:
+                logger.error(f"Error loading checkpoint: {e}")
+                self.checkpoint.manifest = None
+                return False
+        
+        # Checkpoint pickle cũ: load một lần, lần save sau sẽ chuyển sang định dạng shard
         checkpoint_path = os.path.join(self.checkpoint_dir, 'latest_checkpoint.pkl')
         
         if not os.path.exists(checkpoint_path):
@@ -117,80 +321,267 @@ class VietnameseBookEmbedding:
             
             self.current_index = checkpoint['current_index']
             self.books = checkpoint['books']
+            self.resume_files = []
             self.embeddings = checkpoint['embeddings']
             self.metadata = checkpoint['metadata']
             self.training_progress = checkpoint['training_progress']
             
-            logger.info(f"Checkpoint loaded, resuming from index {self.current_index}")
+            logger.info(f"Legacy checkpoint loaded, resuming from index {self.current_index}")
             return True
         except Exception as e:
             logger.error(f"Error loading checkpoint: {e}")
             return False
     
-    def train(self, batch_size: int = 32, save_interval: int = 100):
+    def commit_batch(self, batch_embeddings, batch_end: int, total_books: int):
+        """Thêm embeddings của một batch và cập nhật tiến độ (atomic với save_checkpoint)"""
+        with self._state_lock:
+            self.embeddings.extend(batch_embeddings)
+            self.current_index = batch_end
+            self.training_progress = (self.current_index / total_books) * 100
+    
+    def tokenize_texts(self, texts: List[str]):
+        """Stage tokenize: texts -> features (fallback giữ nguyên texts nếu encoder không tách được)"""
+        if hasattr(self.model, 'tokenize') and hasattr(self.model, 'forward'):
+            return self.model.tokenize(texts)
+        return texts
+    
+    def _count_tokens(self, features):
+        """Ghi số token thật (attention mask) của features vào telemetry; texts chưa tách thì ước lượng"""
+        if isinstance(features, BucketedBatch):
+            for _, part in features.parts:
+                self._count_tokens(part)
+        elif isinstance(features, list):
+            self.telemetry.add_tokens(token_lengths(features).sum(), estimated=True)
+        elif 'attention_mask' in features:
+            self.telemetry.add_tokens(int(features['attention_mask'].sum()))
+    
+    def encode_features(self, features) -> np.ndarray:
+        """Stage encode: forward pass trên features đã tokenize"""
+        if isinstance(features, BucketedBatch):
+            # Encode từng batch theo độ dài rồi ghép về thứ tự của cửa sổ
+            out = None
+            for idx, part in features.parts:
+                embeddings = self.encode_features(part)
+                if out is None:
+                    out = np.empty((features.size, embeddings.shape[1]), dtype=np.float32)
+                out[idx] = embeddings
+            return out
+        if isinstance(features, list):
+            return np.asarray(
+                self.model.encode(features, batch_size=len(features), show_progress_bar=False), dtype=np.float32
+            )
+        if self.encoder_backend != 'torch':
+            return self.model.forward(features)['sentence_embedding']
+        
+        import torch
+        device = self.model.device
+        features = {key: value.to(device) for key, value in features.items()}
+        with torch.no_grad():
+            output = self.model.forward(features)
+        return output['sentence_embedding'].float().cpu().numpy()
+    
+    def _window_planner(self, batch_size: int, max_batch_tokens: int, use_model: bool):
+        """
+        Hàm chia một cửa sổ texts thành batch theo ngân sách token (length_batching.py)
+        Đếm token bằng tokenizer của encoder; khi encode ở process khác thì chỉ load tokenizer
+        """
+        if use_model:
+            tokenizer = getattr(self.model, 'tokenizer', None)
+            max_length = getattr(self.model, 'max_seq_length', None) or DEFAULT_MAX_SEQ_LENGTH
+        else:
+            try:
+                from transformers import AutoTokenizer
+                tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+            except Exception as e:
+                logger.warning(f"Tokenizer unavailable ({e}), estimating token lengths from characters")
+                tokenizer = None
+            max_length = DEFAULT_MAX_SEQ_LENGTH
+        
+        def plan(texts: List[str]):
+            lengths = token_lengths(texts, tokenizer, max_length)
+            batches = plan_batches(lengths, max_batch_tokens)
+            self.padding_stats.record(lengths, batches, batch_size)
+            if not use_model and self.telemetry is not None:
+                # Tokenize nằm trong encoder process: dùng độ dài vừa đếm
+                self.telemetry.add_tokens(lengths.sum(), estimated=tokenizer is None)
+            return batches
+        
+        return plan
+    
+    def _iter_text_batches(self, pending, batch_size: int):
+        """
+        Stage read: nạp sách từ stream ingestion và build text theo batch
+        Yield ((start, end), texts), bắt đầu từ current_index
+        """
+        start = self.current_index
+        while True:
+            missing = start + batch_size - len(self.books)
+            if missing > 0:
+                arrived = list(islice(pending, missing))
+                with self._state_lock:
+                    self.books.extend(arrived)
+                    self.metadata.extend(arrived)
+            end = min(start + batch_size, len(self.books))
+            if end <= start:
+                return
+            yield (start, end), [self.build_text(book) for book in self.books[start:end]]
+            start = end
+    
+    def train(self, batch_size: int = 32, save_interval: int = 100, queue_size: int = 4,
+              on_batch=None, max_batch_tokens: int = None) -> bool:
         """
         Train model trên toàn bộ dataset
         Có thể pause bất cứ lúc nào
+        - read/build text, tokenize, encode chạy song song (training_pipeline.py)
+        - encode_workers > 1: encode bằng nhiều process (multiproc_encoder.py)
+        - checkpoint được ghi trên writer thread nền
+        - on_batch(status): callback sau mỗi batch (progress bar, dashboard...)
+        - telemetry (training_telemetry.py): thời gian từng stage, tokens/s, peak RSS, thời gian ghi checkpoint
+        - max_batch_tokens: bật batching theo độ dài, đọc cửa sổ batch_size * WINDOW_BATCHES sách
+          rồi chia batch theo ngân sách token; commit theo cửa sổ, đúng thứ tự row
+        Trả về True nếu train xong toàn bộ dataset
         """
         self.is_training = True
+        self.telemetry = TrainingTelemetry(os.path.join(self.checkpoint_dir, TELEMETRY_FILE), self.telemetry_interval)
         
         # Load checkpoint nếu có
-        resumed = self.load_checkpoint()
+        with self.telemetry.stage('load_checkpoint'):
+            resumed = self.load_checkpoint()
         
-        if not resumed:
-            # Load all books metadata
-            logger.info("Loading books metadata...")
-            self.books = self.load_books_metadata()
-            self.metadata = self.books.copy()
-            self.current_index = 0
-            self.embeddings = []
+        if resumed:
+            pending = self.iter_books(self.resume_files)
+            total_books = len(self.books) + len(self.resume_files)
+        else:
+            # Stream metadata sách từ ingestion song song, encode ngay khi đủ batch
+            logger.info("Streaming books metadata...")
+            files = self.list_book_files()
+            with self._state_lock:
+                self.books = []
+                self.metadata = []
+                self.current_index = 0
+                self.embeddings = []
+            self.checkpoint.reset(files)
+            pending = self.iter_books(files)
+            total_books = len(files)
         
-        total_books = len(self.books)
+        self.total_books = total_books
         logger.info(f"Starting training from book {self.current_index}/{total_books}")
         
+        encoder = None
+        if self.encode_workers > 1:
+            encoder = MultiProcessEncoder(
+                self.model_name, self.encode_workers, self.encode_threads,
+                backend=self.encoder_backend, onnx_dir=self.onnx_dir
+            )
+        
+        def tokenize_fn(texts):
+            features = self.tokenize_texts(texts)
+            self._count_tokens(features)
+            return features
+        
+        def counted_map(windows):
+            # Encoder nhiều process tự tokenize: ước lượng token theo ký tự
+            def counted():
+                for tag, texts in windows:
+                    self.telemetry.add_tokens(token_lengths(texts).sum(), estimated=True)
+                    yield tag, texts
+            return encoder.map(counted())
+        
+        encode_map = counted_map if encoder else None
+        window_size = batch_size
+        self.padding_stats = None
+        if max_batch_tokens:
+            window_size = batch_size * WINDOW_BATCHES
+            self.padding_stats = PaddingStats()
+            plan = self._window_planner(batch_size, max_batch_tokens, use_model=encoder is None)
+            if encoder:
+                encode_map = bucketed_map(encoder.map, plan)
+            else:
+                def tokenize_fn(texts):
+                    features = BucketedBatch(
+                        len(texts), [(idx, self.tokenize_texts([texts[i] for i in idx])) for idx in plan(texts)]
+                    )
+                    self._count_tokens(features)
+                    return features
+        
+        self.pipeline = TrainingPipeline(
+            self._iter_text_batches(pending, window_size),
+            tokenize_fn,
+            self.encode_features,
+            queue_size=queue_size,
+            encode_map=encode_map,
+            telemetry=self.telemetry
+        )
+        self.checkpoint_writer = CheckpointWriter(self.save_checkpoint)
+        completed = False
+        
         try:
-            while self.current_index < total_books and self.is_training:
-                batch_end = min(self.current_index + batch_size, total_books)
-                batch_books = self.books[self.current_index:batch_end]
-                
-                # Create embeddings cho batch
-                texts = []
-                for book in batch_books:
-                    # Combine title, summary và preview để AI hiểu sâu hơn về nội dung sách
-                    # Điều này giúp AI có thể tìm sách dựa trên mô tả nội dung, không chỉ tên
-                    text = f"Tên sách: {book['title']}. "
-                    
-                    if 'summary' in book and book['summary']:
-                        text += f"Tóm tắt: {book['summary']}. "
-                    
-                    text += f"Nội dung: {book['preview']}"
-                    
-                    texts.append(text)
+            for (batch_start, batch_end), batch_embeddings in self.pipeline:
+                if not self.is_training:
+                    break
                 
-                logger.info(f"Processing batch {self.current_index}-{batch_end}/{total_books}")
-                batch_embeddings = self.model.encode(texts, show_progress_bar=False)
+                with self.telemetry.stage('commit'):
+                    self.commit_batch(batch_embeddings, batch_end, self.total_books)
+                self.telemetry.add_books(batch_end - batch_start)
+                logger.info(
+                    f"Processing batch {batch_start}-{batch_end}/{self.total_books} "
+                    f"[{self.pipeline.format_stats()}]"
+                )
                 
-                self.embeddings.extend(batch_embeddings)
-                self.current_index = batch_end
-                self.training_progress = (self.current_index / total_books) * 100
-                
-                # Save checkpoint định kỳ
-                if self.current_index % save_interval == 0:
-                    self.save_checkpoint()
+                # Save checkpoint định kỳ (writer thread nền), mỗi khi vượt qua một mốc save_interval
+                if self.current_index // save_interval > batch_start // save_interval:
+                    self.checkpoint_writer.request()
                     logger.info(f"Progress: {self.training_progress:.2f}%")
                 
+                if on_batch:
+                    on_batch(self.get_training_status())
+                self.telemetry.maybe_flush(self._telemetry_progress())
+            
+            self.pipeline.close()
+            self.checkpoint_writer.close()
+            
             # Save final checkpoint
             if self.is_training:
+                # Stream đã hết (file lỗi bị bỏ qua): chốt lại tổng số sách
+                self.total_books = len(self.books)
+                self.training_progress = 100.0
                 self.save_checkpoint()
                 logger.info("Training completed!")
-                self.save_embeddings()
+                if self.padding_stats:
+                    logger.info(f"Padding waste: {self.padding_stats.as_dict()}")
+                with self.telemetry.stage('save_embeddings'):
+                    self.save_embeddings()
+                    self.load_embeddings()
+                completed = True
             else:
                 logger.info("Training paused, checkpoint saved")
+            
+            self.telemetry.maybe_flush(self._telemetry_progress('completed' if completed else 'paused'), force=True)
+            logger.info(f"Telemetry: {self.telemetry.format_stats()}")
+            return completed
                 
         except Exception as e:
             logger.error(f"Error during training: {e}")
             self.save_checkpoint()
+            self.telemetry.maybe_flush(dict(self._telemetry_progress('failed'), error=str(e)), force=True)
             raise
+        finally:
+            self.pipeline.close()
+            self.checkpoint_writer.close()
+            if encoder:
+                encoder.close()
+            # Dừng các thread ingestion còn đang đọc (khi pause)
+            if hasattr(pending, 'close'):
+                pending.close()
+    
+    def _telemetry_progress(self, state: str = 'training') -> Dict:
+        """Tiến độ ghi kèm mỗi dòng telemetry JSONL"""
+        return {
+            'state': state,
+            'current_index': self.current_index,
+            'total_books': self.total_books,
+            'progress': round(self.training_progress, 2)
+        }
     
     def pause_training(self):
         """Dừng training và save checkpoint"""
@@ -199,68 +590,603 @@ class VietnameseBookEmbedding:
         self.save_checkpoint()
     
     def save_embeddings(self):
-        """Lưu embeddings cuối cùng"""
-        embeddings_path = os.path.join(self.checkpoint_dir, 'embeddings.npy')
-        metadata_path = os.path.join(self.checkpoint_dir, 'metadata.json')
+        """Lưu embeddings cuối cùng rồi publish version mới của index"""
+        # Ghi vào tên có version (embeddings.v<N>.npy): snapshot cũ (mmap) vẫn đọc file của nó tới khi được thay
+        embeddings_path = staged_path(self.checkpoint_dir, EMBEDDINGS_FILE)
         
-        np.save(embeddings_path, np.array(self.embeddings))
-        with open(metadata_path, 'w', encoding='utf-8') as f:
-            json.dump(self.metadata, f, ensure_ascii=False, indent=2)
+        embeddings_array = np.array(self.embeddings, dtype=np.float32)
+        tmp_path = os.path.join(self.checkpoint_dir, 'embeddings.tmp.npy')
+        np.save(tmp_path, embeddings_array)
+        os.replace(tmp_path, embeddings_path)
+        store = MetadataStore.write(self.checkpoint_dir, self.metadata)
         
         logger.info(f"Embeddings saved: {embeddings_path}")
-        logger.info(f"Metadata saved: {metadata_path}")
+        logger.info(f"Metadata saved: {store.path}")
+        store.close()
+        
+        self._save_derived(embeddings_array, self.metadata)
+        
+        # Manifest cho incremental re-indexing, ghi sau khi publish (publish lỗi thì manifest cũ vẫn đúng)
+        IndexManifest(self.checkpoint_dir).rebuild(self.dataset_path, self.metadata, self.pack).save()
     
-    def load_embeddings(self):
-        """Load embeddings đã train"""
-        embeddings_path = os.path.join(self.checkpoint_dir, 'embeddings.npy')
-        metadata_path = os.path.join(self.checkpoint_dir, 'metadata.json')
+    def _save_derived(self, embeddings: np.ndarray = None, metadata=None):
+        """
+        Dữ liệu dẫn xuất từ embeddings.npy / metadata: bản lượng tử hóa, ANN index, BM25 index, k-NN graph
+        metadata: iterable record theo thứ tự row (list hoặc MetadataStore.iter_records)
+        Ghi xong mọi file thì publish version mới (snapshot.json)
+        """
+        # Bản lượng tử hóa cho storage float16 / int8, kèm báo cáo recall so với float32
+        if self.storage in ('float16', 'int8'):
+            save_quantized(self.checkpoint_dir, modes=(self.storage,))
+            recall_check(self.checkpoint_dir, modes=(self.storage,), latest=True)
+        
+        # Build ANN index và lưu cạnh embeddings.npy
+        index = self.build_index(embeddings)
+        save_staged(index, self.checkpoint_dir)
+        logger.info(f"{index.kind} index saved ({len(index)} vectors)")
+        
+        if metadata is not None:
+            LexicalIndex.build(metadata, self.lexical_tokenizer).save(self.checkpoint_dir)
+        
+        if self.knn_k > 0:
+            self.build_knn(publish=False)
+        
+        return publish_version(self.checkpoint_dir, self.model_name)
+    
+    def build_knn(self, k: int = None, publish: bool = True) -> Dict:
+        """
+        Tính trước k láng giềng của mọi sách (knn_graph.py) từ embeddings.npy, theo block nên RAM có giới hạn
+        publish=True: publish version mới và load lại snapshot (khi chạy riêng, ví dụ train_offline.py --knn)
+        """
+        # Bản mới nhất (kể cả bản staged chưa publish khi được gọi từ _save_derived)
+        embeddings = np.load(latest_path(self.checkpoint_dir, EMBEDDINGS_FILE), mmap_mode='r')
+        metadata = MetadataStore.open(self.checkpoint_dir, latest=True)
+        try:
+            info = build_knn_graph(self.checkpoint_dir, embeddings, metadata.deleted, k or self.knn_k or DEFAULT_K)
+        finally:
+            metadata.close()
+        if publish:
+            publish_version(self.checkpoint_dir, self.model_name)
+            self.load_embeddings()
+        return info
+    
+    def train_incremental(self, batch_size: int = 32) -> Dict:
+        """
+        Chỉ embed các sách mới / đã sửa so với index_manifest.json
+        - modified: ghi đè đúng row cũ trong embeddings.npy
+        - deleted: đánh dấu tombstone, row được tái sử dụng cho sách mới
+        - added: điền vào row trống trước, còn lại append vào cuối file
+        Các row không đổi không bị ghi lại
+        """
+        embeddings_path = published_path(self.checkpoint_dir, EMBEDDINGS_FILE)
         
         if not os.path.exists(embeddings_path):
+            logger.info("No embeddings yet, running full training")
+            self.train(batch_size=batch_size)
+            return {'full_rebuild': True, 'added': len(self.metadata), 'modified': 0, 'deleted': 0}
+        
+        metadata = MetadataStore.open(self.checkpoint_dir)
+        
+        manifest = IndexManifest(self.checkpoint_dir)
+        if manifest.exists():
+            manifest.load()
+        else:
+            logger.info("No manifest found, building one from current metadata")
+            manifest.rebuild(self.dataset_path, metadata, self.pack)
+        
+        added, modified, deleted = manifest.diff(self.dataset_path, self.pack)
+        summary = {
+            'full_rebuild': False,
+            'added': len(added),
+            'modified': len(modified),
+            'deleted': len(deleted),
+            'unchanged': len(manifest.entries) - len(modified) - len(deleted)
+        }
+        logger.info(f"Incremental index: {summary}")
+        
+        if not (added or modified or deleted):
+            metadata.close()
+            manifest.save()
+            return summary
+        
+        # Chỉ các row thay đổi được ghi, nhưng trên bản sao có version mới (embeddings.v<N>.npy / metadata.v<N>.sqlite);
+        # snapshot đang phục vụ search vẫn mở file của nó, publish xong mới chuyển sang bản sao
+        db_path = metadata.path
+        metadata.close()
+        next_db_path = staged_path(self.checkpoint_dir, METADATA_DB_FILE)
+        next_embeddings_path = staged_path(self.checkpoint_dir, EMBEDDINGS_FILE)
+        shutil.copyfile(db_path, next_db_path)
+        shutil.copyfile(embeddings_path, next_embeddings_path)
+        metadata = MetadataStore(next_db_path)
+        
+        self.is_training = True
+        try:
+            dim = np.load(next_embeddings_path, mmap_mode='r').shape[1]
+            zero = np.zeros((1, dim), dtype=np.float32)
+        
+            changed_rows = []
+            # Tombstone các sách đã xóa
+            for filename in deleted:
+                row = manifest.entries.pop(filename)['row']
+                changed_rows.append(row)
+                metadata.put(row, {'filename': filename, 'title': metadata[row]['title'], 'deleted': True})
+                write_rows(next_embeddings_path, [row], zero)
+                manifest.free_rows.append(row)
+        
+            # Sách sửa giữ row cũ; sách mới (row None) được gán row khi đọc thành công
+            targets = [(filename, manifest.entries[filename]['row']) for filename in modified]
+            targets += [(filename, None) for filename in added]
+        
+            for start in range(0, len(targets), batch_size):
+                batch = []
+                next_row = len(metadata)
+                for filename, row in targets[start:start + batch_size]:
+                    book = self.read_book(filename)
+                    if book is None:
+                        continue
+                    if row is None:
+                        if manifest.free_rows:
+                            row = manifest.free_rows.pop(0)
+                        else:
+                            row = next_row
+                            next_row += 1
+                    batch.append((row, book))
+                if not batch:
+                    continue
+            
+                texts = [self.build_text(book) for _, book in batch]
+                batch_embeddings = np.asarray(self.model.encode(texts, show_progress_bar=False), dtype=np.float32)
+            
+                existing = [(i, row) for i, (row, _) in enumerate(batch) if row < len(metadata)]
+                appended = [(i, row) for i, (row, _) in enumerate(batch) if row >= len(metadata)]
+                write_rows(next_embeddings_path, [row for _, row in existing],
+                           batch_embeddings[[i for i, _ in existing]])
+                append_rows(next_embeddings_path, batch_embeddings[[i for i, _ in appended]])
+            
+                for row, book in batch:
+                    metadata.put(row, book)
+                    changed_rows.append(row)
+                    manifest.entries[book['filename']] = dict(book_entry(self.dataset_path, book['filename'], self.pack), row=row)
+            
+                logger.info(f"Incremental batch {start}-{start + len(batch)}/{len(targets)}")
+        
+            metadata.commit()
+            metadata.close()
+        except Exception:
+            metadata.close()
+            for path in (next_embeddings_path, next_db_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+        finally:
+            self.is_training = False
+        
+        # Passage gắn với sách theo row: row sửa / mới / tái dùng không được dùng passage cũ
+        if PassageIndex.exists(self.checkpoint_dir) and changed_rows:
+            invalid = invalidate_books(self.checkpoint_dir, changed_rows)
+            logger.warning(f"Passages of {invalid} books are stale and ignored, run build_passages() to refresh")
+        
+        # Quantized variants và ANN index dẫn xuất từ embeddings.npy nên build lại
+        metadata = MetadataStore(next_db_path)
+        try:
+            summary['index_version'] = self._save_derived(np.load(next_embeddings_path, mmap_mode='r'),
+                                                          metadata.iter_records(LEXICAL_FIELDS))
+        finally:
+            metadata.close()
+        # Manifest chỉ ghi sau khi version mới đã publish: publish lỗi thì lần sau diff lại đúng các sách này
+        manifest.save()
+        self.load_embeddings()
+        return summary
+    
+    def build_index(self, embeddings: np.ndarray = None):
+        """Build ANN index từ embeddings hiện tại"""
+        if embeddings is None:
+            embeddings = np.array(self.embeddings, dtype=np.float32)
+        logger.info(f"Building {self.index_type} index for {len(embeddings)} embeddings...")
+        return build_index(embeddings, self.index_type, **self.index_params)
+    
+    def build_passages(self, batch_size: int = 256) -> Dict:
+        """
+        Chia mọi sách thành passage chồng lấn và embed theo lô lớn (passage_index.py)
+        Dùng MultiProcessEncoder khi encode_workers > 1
+        """
+        metadata = MetadataStore.open(self.checkpoint_dir, latest=True)
+        
+        encoder = None
+        if self.encode_workers > 1:
+            encoder = MultiProcessEncoder(
+                self.model_name, self.encode_workers, self.encode_threads,
+                backend=self.encoder_backend, onnx_dir=self.onnx_dir
+            )
+            encode_map = encoder.map
+        else:
+            def encode_map(batches):
+                for tags, texts in batches:
+                    yield tags, self.model.encode(texts, batch_size=64, show_progress_bar=False)
+        
+        try:
+            info = build_passage_index(self.checkpoint_dir, self.dataset_path, metadata, encode_map,
+                                       batch_size=batch_size)
+        finally:
+            if encoder:
+                encoder.close()
+        
+        if info:
+            publish_version(self.checkpoint_dir, self.model_name)
+            self.load_embeddings()
+        return info
+    
+    def load_embeddings(self):
+        """
+        Load version mới nhất của index thành snapshot rồi thay reference một lần
+        Query đang chạy vẫn giữ snapshot cũ tới khi xong, query mới thấy snapshot mới
+        """
+        snapshot = self._load_snapshot()
+        if snapshot is None:
             logger.warning("No embeddings found, need to train first")
             return False
-            
-        self.embeddings = np.load(embeddings_path)
-        with open(metadata_path, 'r', encoding='utf-8') as f:
-            self.metadata = json.load(f)
         
-        logger.info(f"Loaded {len(self.embeddings)} embeddings")
+        self._snapshots.swap(snapshot)
+        self._sync_shards()
+        self._snapshots.remove_unused_files()
         return True
     
-    def search(self, query: str, top_k: int = 10) -> List[Dict]:
+    def _load_snapshot(self) -> IndexSnapshot:
+        # Sharded: ANN index nằm trong các shard process, backend không load bản toàn cục
+        return load_snapshot(self.checkpoint_dir, self.storage, self.lexical_tokenizer,
+                             load_ann=self.search_shards <= 0)
+    
+    def _sync_shards(self):
+        """Shard process load version mới nhất (khởi động lần đầu); lỗi -> search dùng index local"""
+        if self.search_shards <= 0:
+            return
+        try:
+            if self.shards is None:
+                self.shards = ShardCoordinator(
+                    self.checkpoint_dir, self.search_shards, self.index_type, self.index_params,
+                    self.storage, timeout_ms=self.shard_timeout_ms
+                ).start()
+            else:
+                self.shards.reload()
+        except Exception as e:
+            logger.error(f"Search shards unavailable, using local index: {e}")
+    
+    def close_shards(self):
+        if self.shards is not None:
+            self.shards.close()
+            self.shards = None
+    
+    def reload_index(self, probe_query: str = RELOAD_PROBE_QUERY) -> Dict:
+        """
+        Hot reload version mới nhất trong checkpoint_dir (ví dụ sau train_offline.py)
+        Load ở thread gọi trong khi search vẫn phục vụ snapshot cũ, kiểm tra shape / model name,
+        warm-up bằng probe query rồi mới swap; snapshot cũ được đóng khi hết query đang dùng
+        Shard process reload sau khi swap (trong lúc đó query dùng fallback local của snapshot)
+        """
+        with self._reload_lock:
+            start = time.perf_counter()
+            previous = self.snapshot
+            snapshot = None
+            try:
+                snapshot = self._load_snapshot()
+                if snapshot is None:
+                    raise ValueError("No embeddings found, need to train first")
+                validate_snapshot(snapshot, self.model_name, self.model.get_sentence_embedding_dimension())
+                # Warm-up: encoder, ANN index, BM25 và các trang mmap trước khi nhận traffic
+                for mode in ('dense', 'hybrid'):
+                    self._search(snapshot, probe_query, top_k=1, mode=mode)
+            except Exception as e:
+                logger.error(f"Index reload failed, keeping version "
+                             f"{previous.version if previous is not None else None}: {e}")
+                if snapshot is not None:
+                    snapshot.close()
+                self.last_reload = {
+                    'reloaded': False,
+                    'error': str(e),
+                    'version': previous.version if previous is not None else None,
+                    'at': time.time()
+                }
+                return self.last_reload
+            
+            self._snapshots.swap(snapshot)
+            # Shard chỉ chuyển version sau khi swap thành công: reload lỗi không để shard lệch snapshot đang phục vụ
+            self._sync_shards()
+            self.last_reload = {
+                'reloaded': True,
+                'version': snapshot.version,
+                'previous_version': previous.version if previous is not None else None,
+                'seconds': round(time.perf_counter() - start, 3),
+                'at': time.time()
+            }
+            logger.info(f"Index reloaded: {self.last_reload}")
+            return self.last_reload
+    
+    def watch_index(self, interval: float = 10.0, on_reload=None) -> SnapshotWatcher:
+        """
+        Tự reload_index() khi snapshot.json có version mới hơn version đang phục vụ
+        on_reload(result): callback sau mỗi lần reload (ví dụ emit Socket.IO)
+        """
+        def reload():
+            result = self.reload_index()
+            if on_reload:
+                on_reload(result)
+            return result
+        
+        if self._watcher is None:
+            self._watcher = SnapshotWatcher(
+                self.checkpoint_dir,
+                lambda: self.snapshot.version if self.snapshot is not None else 0,
+                reload,
+                interval=interval
+            ).start()
+        return self._watcher
+    
+    @property
+    def snapshot(self) -> IndexSnapshot:
+        return self._snapshots.current
+    
+    def get_index_stats(self) -> Dict:
+        """Snapshot đang phục vụ, số query đang dùng từng version và kết quả reload gần nhất"""
+        snapshot = self.snapshot
+        return dict(
+            self._snapshots.stats(),
+            snapshot=snapshot.info() if snapshot is not None else None,
+            last_reload=self.last_reload,
+            shards=self.shards.stats() if self.shards is not None else None
+        )
+    
+    def use_snapshot(self):
+        """
+        with model.use_snapshot() as snapshot: search(..., snapshot=snapshot)
+        Giữ một version cho cả request; version đó không bị đóng khi reload giữa chừng
+        """
+        self.get_snapshot()
+        return self._snapshots.acquire()
+    
+    def get_snapshot(self) -> IndexSnapshot:
+        """Snapshot hiện tại (load lần đầu nếu chưa có), None nếu chưa train"""
+        if self.snapshot is None:
+            with self._snapshot_lock:
+                if self.snapshot is None:
+                    logger.warning("No embeddings loaded, loading from checkpoint...")
+                    self.load_embeddings()
+        return self.snapshot
+    
+    def search(self, query: str, top_k: int = 10, ef_search: int = None,
+               nprobe: int = None, exact: bool = False, passages: bool = True,
+               mode: str = 'dense', hybrid_alpha: float = 0.5, fields: List[str] = None,
+               snapshot: IndexSnapshot = None) -> List[Dict]:
         """
         Tìm kiếm sách dựa trên query (có thể là tên sách hoặc nội dung)
+        - ef_search: độ rộng tìm kiếm HNSW (cao hơn = recall tốt hơn, chậm hơn)
+        - nprobe: số cluster IVF được quét
+        - exact: bỏ qua ANN index, dùng brute-force
+        - passages: gộp điểm passage (max theo sách) nếu có passage index; kết quả có best_line
+        - mode: dense | hybrid (BM25 sinh ứng viên, dense chỉ re-score ứng viên) | lexical (chỉ BM25)
+        - hybrid_alpha: trọng số điểm dense khi fuse (1 - alpha cho BM25)
+        - fields: chỉ trả về các field metadata này (luôn có filename), None = tất cả
+        - snapshot: snapshot để search (mặc định snapshot hiện tại); cả query chỉ đọc một version
         """
-        if len(self.embeddings) == 0:
-            logger.warning("No embeddings loaded, loading from checkpoint...")
-            if not self.load_embeddings():
-                return []
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode: {mode} (choose from {list(SEARCH_MODES)})")
+        
+        params = dict(top_k=top_k, ef_search=ef_search, nprobe=nprobe, exact=exact, passages=passages,
+                      mode=mode, hybrid_alpha=hybrid_alpha, fields=fields)
+        if snapshot is not None:
+            return self._cached_search(snapshot, query, params)
+        with self.use_snapshot() as snap:
+            return self._cached_search(snap, query, params)
+    
+    def _cached_search(self, snap: IndexSnapshot, query: str, params: Dict) -> List[Dict]:
+        """Tra result cache theo (version của snap, query, params) trước khi search"""
+        if self.result_cache is None or snap is None:
+            return self._search(snap, query, **params)
+        
+        key = SearchResultCache.make_key(query, params)
+        results = self.result_cache.get(snap.version, key)
+        if results is not None:
+            return results
+        
+        self._partial.flag = False
+        start = time.perf_counter()
+        results = self._search(snap, query, **params)
+        # Kết quả partial (shard timeout) không được cache cho cả version
+        if not self._partial.flag:
+            self.result_cache.put(snap.version, key, results, (time.perf_counter() - start) * 1000)
+        return results
+    
+    def _search(self, snap: IndexSnapshot, query: str, top_k: int = 10, ef_search: int = None,
+                nprobe: int = None, exact: bool = False, passages: bool = True,
+                mode: str = 'dense', hybrid_alpha: float = 0.5, fields: List[str] = None) -> List[Dict]:
+        if snap is None or len(snap) == 0:
+            return []
+        
+        if mode != 'dense' and snap.lexical_index is not None:
+            results = self._search_hybrid(snap, query, top_k, mode, hybrid_alpha, passages, fields)
+            # Query không khớp term nào -> dense
+            if results is not None:
+                return results
         
         # Encode query
-        query_embedding = self.model.encode([query])[0]
+        query_embedding = self.encode_query(query)
         
-        # Calculate similarity
-        embeddings_array = np.array(self.embeddings)
-        similarities = np.dot(embeddings_array, query_embedding)
+        # Lấy dư số row tombstone để sau khi lọc vẫn đủ top_k
+        fetch_k = top_k + snap.num_deleted
         
-        # Get top k results
-        top_indices = np.argsort(similarities)[-top_k:][::-1]
+        scores, top_indices = self._dense_search(snap, query_embedding, fetch_k, ef_search, nprobe, exact)
         
-        results = []
-        for idx in top_indices:
-            result = self.metadata[idx].copy()
-            result['similarity_score'] = float(similarities[idx])
-            results.append(result)
+        if passages and snap.passage_index is not None:
+            scores, top_indices, best_lines = self._merge_passage_scores(
+                snap, query_embedding, scores, top_indices, fetch_k
+            )
+        else:
+            best_lines = [None] * len(top_indices)
         
-        return results
+        hits = []
+        for score, idx, best_line in zip(scores, top_indices, best_lines):
+            if snap.metadata.deleted[idx]:
+                continue
+            if len(hits) >= top_k:
+                break
+            hits.append((int(idx), {'similarity_score': float(score), 'best_line': best_line}))
+        
+        return self._build_results(snap, hits, fields)
+    
+    def _dense_search(self, snap: IndexSnapshot, query_embedding: np.ndarray, fetch_k: int,
+                      ef_search: int = None, nprobe: int = None, exact: bool = False):
+        """Top fetch_k theo embedding sách: brute-force, scatter-gather qua shard, hoặc ANN index local"""
+        # Snapshot cũ chưa có ANN index -> brute-force
+        if exact or snap.index is None:
+            return build_index(snap.embeddings, 'flat').search(query_embedding, fetch_k)
+        
+        if self.shards is not None:
+            scores, top_indices, info = self.shards.search(
+                query_embedding, fetch_k, version=snap.version, ef_search=ef_search, nprobe=nprobe
+            )
+            # Shard timeout -> kết quả partial; không shard nào trả lời (hoặc đều lệch version) -> index local
+            if info['answered'] > 0:
+                if info['answered'] < self.shards.num_shards:
+                    logger.warning(f"Partial sharded search: {info}")
+                    self._partial.flag = True
+                return scores, top_indices
+        
+        return snap.index.search(query_embedding, fetch_k, ef_search=ef_search, nprobe=nprobe)
+    
+    @staticmethod
+    def _build_results(snap: IndexSnapshot, hits: List[Tuple[int, Dict]], fields: List[str] = None) -> List[Dict]:
+        """Đọc metadata (theo projection fields) chỉ cho các hit rồi gắn điểm vào"""
+        books = snap.metadata.fetch([idx for idx, _ in hits], fields)
+        for book, (_, scores) in zip(books, hits):
+            book.update(scores)
+        return books
+    
+    def _search_hybrid(self, snap: IndexSnapshot, query: str, top_k: int, mode: str, alpha: float,
+                       passages: bool, fields: List[str] = None):
+        """
+        BM25 lấy HYBRID_CANDIDATES ứng viên, dense chỉ tính dot product trên các ứng viên đó
+        Điểm fuse = alpha * dense + (1 - alpha) * bm25, cả hai min-max chuẩn hóa trong tập ứng viên
+        Trả về None nếu BM25 không có ứng viên nào
+        """
+        bm25_scores, candidates = snap.lexical_index.search(query, max(HYBRID_CANDIDATES, top_k * 5))
+        if len(candidates) == 0:
+            return None
+        
+        query_embedding = None
+        if mode == 'lexical':
+            scores = bm25_scores
+            dense_scores = [None] * len(candidates)
+        else:
+            query_embedding = self.encode_query(query)
+            rows = np.asarray([snap.embeddings[idx] for idx in candidates], dtype=np.float32)
+            dense_scores = rows @ np.asarray(query_embedding, dtype=np.float32)
+            scores = alpha * _min_max(dense_scores) + (1.0 - alpha) * _min_max(bm25_scores)
+        
+        hits = []
+        for i in np.argsort(-scores, kind='stable'):
+            idx = int(candidates[i])
+            if snap.metadata.deleted[idx]:
+                continue
+            if len(hits) >= top_k:
+                break
+            result = {
+                'similarity_score': float(scores[i]),
+                'bm25_score': float(bm25_scores[i]),
+                'dense_score': None if dense_scores[i] is None else float(dense_scores[i]),
+                'best_line': None
+            }
+            if passages and snap.passage_index is not None and query_embedding is not None:
+                _, row = snap.passage_index.best_passage(idx, query_embedding)
+                result['best_line'] = snap.passage_index.line_of(row) if row >= 0 else None
+            hits.append((idx, result))
+        
+        return self._build_results(snap, hits, fields)
+    
+    @staticmethod
+    def _merge_passage_scores(snap: IndexSnapshot, query_embedding: np.ndarray, scores, top_indices,
+                              fetch_k: int):
+        """
+        Điểm sách = max(điểm embedding của sách, điểm passage tốt nhất)
+        Ứng viên = top của book index ∪ top theo passage -> (scores, ids, best_lines) giảm dần
+        """
+        passage_scores, best_rows = snap.passage_index.book_scores(query_embedding)
+        _, passage_top = top_k_from_scores(passage_scores, fetch_k)
+        
+        candidates = {int(idx): float(score) for score, idx in zip(scores, top_indices)}
+        for idx in passage_top:
+            idx = int(idx)
+            if idx not in candidates and idx < len(snap) and np.isfinite(passage_scores[idx]):
+                candidates[idx] = float(np.dot(snap.embeddings[idx], query_embedding))
+        
+        merged = []
+        for idx, book_score in candidates.items():
+            # Sách thêm sau khi build passage index hoặc row đã đổi nội dung (invalid.npy): không dùng passage
+            has_passage = idx < len(best_rows) and best_rows[idx] >= 0
+            score = max(book_score, float(passage_scores[idx])) if has_passage else book_score
+            best_line = snap.passage_index.line_of(best_rows[idx]) if has_passage else None
+            merged.append((score, idx, best_line))
+        merged.sort(key=lambda item: -item[0])
+        
+        return [m[0] for m in merged], [m[1] for m in merged], [m[2] for m in merged]
+    
+    def similar_books(self, filename: str, top_k: int = 10, fields: List[str] = None,
+                      snapshot: IndexSnapshot = None):
+        """
+        Sách tương tự filename: tra k-NN graph tính sẵn (O(1), không quét ma trận)
+        Chưa có graph thì dùng ANN index với embedding của sách làm query
+        Trả về None nếu sách không có trong index
+        """
+        if snapshot is None:
+            with self.use_snapshot() as snap:
+                return self.similar_books(filename, top_k, fields, snap) if snap is not None else None
+        
+        row = snapshot.metadata.row_of(filename)
+        if row is None:
+            return None
+        
+        if snapshot.knn_graph is not None:
+            ids, scores = snapshot.knn_graph.neighbors(row)
+        else:
+            query_embedding = np.asarray(snapshot.embeddings[row], dtype=np.float32)
+            scores, ids = self._dense_search(snapshot, query_embedding, top_k + 1 + snapshot.num_deleted)
+        
+        hits = []
+        for score, idx in zip(scores, ids):
+            idx = int(idx)
+            if idx == row or snapshot.metadata.deleted[idx]:
+                continue
+            if len(hits) >= top_k:
+                break
+            hits.append((idx, {'similarity_score': float(score)}))
+        return self._build_results(snapshot, hits, fields)
+    
+    def check_encoder_parity(self, num_texts: int = 200) -> Dict:
+        """Cosine drift và latency / throughput của các backend ONNX so với PyTorch"""
+        metadata = MetadataStore.open(self.checkpoint_dir)
+        rows = [row for row in range(len(metadata)) if not metadata.deleted[row]][:num_texts]
+        books = metadata.fetch(rows, ('title', 'summary', 'preview'))
+        metadata.close()
+        return compare_backends(self.model_name, self.onnx_dir, [self.build_text(book) for book in books])
+    
+    def check_storage_recall(self, num_queries: int = 200, top_k: int = 10) -> Dict:
+        """Đo recall@k của float16 / int8 so với float32"""
+        return recall_check(self.checkpoint_dir, num_queries=num_queries, top_k=top_k)
     
     def get_training_status(self) -> Dict:
         """Lấy trạng thái training hiện tại"""
+        snap = self.snapshot
         return {
             'is_training': self.is_training,
             'progress': self.training_progress,
             'current_index': self.current_index,
-            'total_books': len(self.books) if self.books else 0,
-            'embeddings_count': len(self.embeddings)
+            'total_books': max(self.total_books, len(self.books)) if self.books else 0,
+            'embeddings_count': len(self.embeddings) or (len(snap) if snap is not None else 0),
+            'passages_count': snap.info()['passages'] if snap is not None else 0,
+            'index_version': snap.version if snap is not None else None,
+            'ingest': self.ingest_stats.as_dict(),
+            'pipeline': self.pipeline.stats() if self.pipeline else None,
+            'checkpoint_writer': self.checkpoint_writer.stats() if self.checkpoint_writer else None,
+            'padding': self.padding_stats.as_dict() if self.padding_stats else None,
+            'telemetry': self.telemetry.as_dict() if self.telemetry else None
         }
 
 
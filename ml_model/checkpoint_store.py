@@ -0,0 +1,153 @@
+"""
+Append-only Checkpoint cho training embeddings
+- shards/emb_XXXXX.npy: các shard embeddings kích thước cố định, chỉ append dòng mới
+- metadata_log.jsonl: metadata của các sách đã embed, chỉ append
+- plan.json: danh sách file cần train, ghi một lần khi bắt đầu
+- checkpoint_manifest.json: trạng thái đã commit, ghi file tạm rồi os.replace (atomic)
+Mỗi lần save chỉ ghi phần mới kể từ lần commit trước
+"""
+
+import os
+import copy
+import json
+import numpy as np
+from typing import Dict, List
+import logging
+
+from embedding_store import append_rows
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'checkpoint_manifest.json'
+PLAN_FILE = 'plan.json'
+METADATA_LOG_FILE = 'metadata_log.jsonl'
+SHARD_DIR = 'shards'
+DEFAULT_SHARD_SIZE = 1024
+
+
+class ShardedCheckpoint:
+    """Checkpoint append-only, resume chỉ cần đọc manifest nhỏ + mmap các shard"""
+
+    def __init__(self, checkpoint_dir: str, shard_size: int = DEFAULT_SHARD_SIZE):
+        self.checkpoint_dir = checkpoint_dir
+        self.shard_size = shard_size
+        self.manifest_path = os.path.join(checkpoint_dir, MANIFEST_FILE)
+        self.plan_path = os.path.join(checkpoint_dir, PLAN_FILE)
+        self.metadata_log_path = os.path.join(checkpoint_dir, METADATA_LOG_FILE)
+        self.shard_dir = os.path.join(checkpoint_dir, SHARD_DIR)
+        self.manifest = None
+
+    def exists(self) -> bool:
+        return os.path.exists(self.manifest_path)
+
+    def _shard_path(self, shard_id: int) -> str:
+        return os.path.join(self.shard_dir, f'emb_{shard_id:05d}.npy')
+
+    def _write_manifest(self):
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_path)
+
+    def reset(self, filenames: List[str]):
+        """Bắt đầu checkpoint mới: xóa shard cũ, ghi plan một lần"""
+        os.makedirs(self.shard_dir, exist_ok=True)
+        for name in os.listdir(self.shard_dir):
+            os.remove(os.path.join(self.shard_dir, name))
+        open(self.metadata_log_path, 'w').close()
+
+        with open(self.plan_path, 'w', encoding='utf-8') as f:
+            json.dump(filenames, f, ensure_ascii=False)
+
+        self.manifest = {
+            'version': 1,
+            'shard_size': self.shard_size,
+            'committed': 0,
+            'total_books': len(filenames),
+            'training_progress': 0.0,
+            'shards': [],
+            'metadata_log_bytes': 0
+        }
+        self._write_manifest()
+
+    def load(self) -> Dict:
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        self.shard_size = self.manifest['shard_size']
+        return self.manifest
+
+    def load_plan(self) -> List[str]:
+        with open(self.plan_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def load_embeddings(self) -> List[np.ndarray]:
+        """Các dòng embeddings đã commit, đọc qua mmap (không copy vào RAM)"""
+        rows = []
+        for shard in self.manifest['shards']:
+            matrix = np.load(self._shard_path(shard['id']), mmap_mode='r')
+            rows.extend(matrix[:shard['rows']])
+        return rows
+
+    def load_metadata(self) -> List[Dict]:
+        """Metadata đã commit; phần log ghi dở sau lần commit cuối bị bỏ qua"""
+        with open(self.metadata_log_path, 'rb') as f:
+            data = f.read(self.manifest['metadata_log_bytes'])
+        return [json.loads(line) for line in data.decode('utf-8').splitlines() if line]
+
+    def _truncate_uncommitted(self):
+        """Cắt phần đã ghi nhưng chưa commit (crash giữa chừng lần save trước)"""
+        with open(self.metadata_log_path, 'r+b') as f:
+            f.truncate(self.manifest['metadata_log_bytes'])
+
+        if self.manifest['shards']:
+            tail = self.manifest['shards'][-1]
+            path = self._shard_path(tail['id'])
+            matrix = np.load(path, mmap_mode='r')
+            if len(matrix) != tail['rows']:
+                committed = np.array(matrix[:tail['rows']])
+                del matrix
+                np.save(path, committed)
+
+    def append(self, embeddings: List[np.ndarray], metadata: List[Dict], training_progress: float):
+        """Ghi các dòng mới (kể từ lần commit trước) rồi commit manifest"""
+        if self.manifest is None:
+            raise RuntimeError("Checkpoint not initialized, call reset() or load() first")
+        if len(embeddings) != len(metadata):
+            raise ValueError(f"Got {len(embeddings)} embeddings for {len(metadata)} metadata rows")
+
+        self._truncate_uncommitted()
+
+        # Sửa trên bản copy, chỉ thay self.manifest khi đã ghi xong
+        manifest = copy.deepcopy(self.manifest)
+        rows = np.asarray(embeddings, dtype=np.float32)
+        offset = 0
+        while offset < len(rows):
+            shards = manifest['shards']
+            if not shards or shards[-1]['rows'] >= self.shard_size:
+                shards.append({'id': len(shards), 'rows': 0})
+                np.save(self._shard_path(shards[-1]['id']), np.zeros((0, rows.shape[1]), dtype=np.float32))
+
+            tail = shards[-1]
+            take = min(self.shard_size - tail['rows'], len(rows) - offset)
+            append_rows(self._shard_path(tail['id']), rows[offset:offset + take])
+            tail['rows'] += take
+            offset += take
+
+        with open(self.metadata_log_path, 'ab') as f:
+            for book in metadata:
+                f.write((json.dumps(book, ensure_ascii=False) + '\n').encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+            manifest['metadata_log_bytes'] = f.tell()
+
+        manifest['committed'] += len(rows)
+        manifest['training_progress'] = training_progress
+        self.manifest = manifest
+        self._write_manifest()
+
+    @property
+    def committed(self) -> int:
+        return 0 if self.manifest is None else self.manifest['committed']
@@ -0,0 +1,172 @@
+"""
+Parallel Corpus Ingestion cho training
+- Chỉ đọc một prefix giới hạn của mỗi file (đủ cho preview, summary, first_lines)
+- Đọc song song bằng thread pool (hoặc process pool), trả về record theo đúng thứ tự file
+  dưới dạng stream để encoder bắt đầu ngay, không chờ đọc xong toàn bộ dataset
+"""
+
+import os
+import time
+import codecs
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PREVIEW_CHARS = 3000        # preview dùng cho embedding
+SUMMARY_LINES = 20          # số dòng có ý nghĩa trong summary
+SUMMARY_CHARS = 1000        # độ dài tối đa của summary
+FIRST_LINES = 10            # số dòng đầu lưu trong metadata
+MIN_LINE_CHARS = 20         # dòng "có ý nghĩa" phải dài hơn ngưỡng này
+CHUNK_BYTES = 16 * 1024
+DEFAULT_PREFIX_BYTES = 256 * 1024
+
+
+def _has_enough(text: str) -> bool:
+    """Prefix đã đủ để tạo metadata giống hệt khi đọc cả file chưa"""
+    if len(text) < PREVIEW_CHARS:
+        return False
+    # Chỉ tính các dòng đã kết thúc bằng '\n' (dòng cuối có thể còn dở)
+    complete_lines = text.split('\n')[:-1]
+    if len(complete_lines) < FIRST_LINES:
+        return False
+    meaningful = [line.strip() for line in complete_lines if len(line.strip()) > MIN_LINE_CHARS]
+    return len(meaningful) >= SUMMARY_LINES or len(' '.join(meaningful)) >= SUMMARY_CHARS
+
+
+def build_book_record(filename: str, file_path: str, text: str, content_length: int) -> Dict:
+    """Tạo record metadata từ nội dung (hoặc prefix) của sách"""
+    lines = text.split('\n')
+    meaningful_lines = [line.strip() for line in lines if len(line.strip()) > MIN_LINE_CHARS]
+    summary = ' '.join(meaningful_lines[:SUMMARY_LINES])
+
+    return {
+        'filename': filename,
+        'title': filename.replace('.txt', ''),
+        'path': file_path,
+        'preview': text[:PREVIEW_CHARS],
+        'summary': summary[:SUMMARY_CHARS],
+        'content_length': content_length,
+        'first_lines': lines[:FIRST_LINES] if text else []
+    }
+
+
+def _read_prefix(read, size: int, max_bytes: int) -> Tuple[str, int, bool]:
+    """Đọc + decode theo chunk bằng read(position, length); (text, số byte đã đọc, đã đọc hết file chưa)"""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    parts = []
+    bytes_read = 0
+    complete = False
+    while bytes_read < max_bytes:
+        chunk = read(bytes_read, min(CHUNK_BYTES, max_bytes - bytes_read))
+        if not chunk:
+            complete = True
+            break
+        bytes_read += len(chunk)
+        parts.append(decoder.decode(chunk))
+        if _has_enough(''.join(parts)):
+            break
+    if complete or bytes_read >= size:
+        complete = True
+        parts.append(decoder.decode(b'', final=True))
+    return ''.join(parts), bytes_read, complete
+
+
+def read_book_prefix(dataset_path: str, filename: str,
+                     max_bytes: int = DEFAULT_PREFIX_BYTES, pack=None) -> Tuple[Optional[Dict], int]:
+    """
+    Đọc prefix của một sách theo chunk, dừng ngay khi đủ dữ liệu hoặc chạm max_bytes
+    Sách có trong pack (CorpusPack) được đọc từ pack, không mở file
+    Trả về (record, số byte đã đọc); record là None nếu file lỗi
+    """
+    file_path = os.path.join(dataset_path, filename)
+
+    try:
+        if pack is not None and filename in pack:
+            size = pack.stat(filename)[0]
+            text, bytes_read, complete = _read_prefix(
+                lambda position, length: pack.read_range(filename, position, position + length), size, max_bytes)
+        else:
+            with open(file_path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                text, bytes_read, complete = _read_prefix(lambda position, length: f.read(length), size, max_bytes)
+
+        if complete:
+            content_length = len(text)
+        else:
+            # Ước lượng số ký tự từ tỉ lệ ký tự/byte của phần đã đọc
+            content_length = int(size * len(text) / bytes_read) if bytes_read else 0
+
+        return build_book_record(filename, file_path, text, content_length), bytes_read
+    except Exception as e:
+        logger.warning(f"Error reading {filename}: {e}")
+        return None, 0
+
+
+class IngestStats:
+    """Thống kê ingestion: files/sec, bytes đã đọc, số file lỗi"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.files = 0
+        self.errors = 0
+        self.bytes_read = 0
+
+    def record(self, ok: bool, bytes_read: int):
+        with self._lock:
+            self.files += 1
+            self.bytes_read += bytes_read
+            if not ok:
+                self.errors += 1
+
+    def as_dict(self) -> Dict:
+        elapsed = max(time.time() - self.started_at, 1e-9)
+        return {
+            'files': self.files,
+            'errors': self.errors,
+            'bytes_read': self.bytes_read,
+            'elapsed_seconds': round(elapsed, 3),
+            'files_per_second': round(self.files / elapsed, 2),
+            'mb_per_second': round(self.bytes_read / elapsed / (1024 * 1024), 2)
+        }
+
+
+def iter_books(dataset_path: str, filenames: Iterable[str], workers: int = 8,
+               max_bytes: int = DEFAULT_PREFIX_BYTES, use_processes: bool = False,
+               stats: IngestStats = None, pack=None) -> Iterator[Dict]:
+    """
+    Stream record sách theo đúng thứ tự filenames, đọc song song với số worker cố định
+    pack: CorpusPack (đọc từ pack thay vì mở từng file; pickle được nên dùng được với process pool)
+    Số file đang đọc dở được giới hạn (workers * 4) nên RAM không tăng theo kích thước dataset
+    """
+    stats = stats or IngestStats()
+    executor_cls = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    executor = executor_cls(max_workers=max(1, workers))
+    in_flight = deque()
+    max_in_flight = max(1, workers) * 4
+
+    try:
+        for filename in filenames:
+            in_flight.append(executor.submit(read_book_prefix, dataset_path, filename, max_bytes, pack))
+            if len(in_flight) >= max_in_flight:
+                book, bytes_read = in_flight.popleft().result()
+                stats.record(book is not None, bytes_read)
+                if book is not None:
+                    yield book
+
+        while in_flight:
+            book, bytes_read = in_flight.popleft().result()
+            stats.record(book is not None, bytes_read)
+            if book is not None:
+                yield book
+    finally:
+        # Generator bị đóng giữa chừng (pause): hủy các file chưa đọc
+        for future in in_flight:
+            future.cancel()
+        executor.shutdown(wait=False)
+        logger.info(f"Ingestion: {stats.as_dict()}")
@@ -0,0 +1,286 @@
+"""
+Corpus Pack: cả dataset trong một container thay vì 10 nghìn file nhỏ
+- corpus.bin: nội dung các sách nối liền (mỗi sách một frame zstd nếu bật nén)
+- books.npy: (offset, số byte lưu, size gốc, mtime_ns) của từng sách
+- lines.npy + line_starts.npy: offset đầu dòng của từng sách (line index đóng gói sẵn)
+- pack.json: tên sách + thông tin, ghi sau cùng (có pack.json nghĩa là pack đã ghi đủ)
+Reader đọc qua mmap; sách không có trong pack thì các subsystem đọc thẳng từ thư mục dataset
+Mỗi lần đóng gói ghi thư mục mới <pack_dir>/v<N>/ rồi trỏ current.json sang nó (Windows không cho đổi tên / xóa
+thư mục đang được mmap); thư mục version cũ bị xóa khi không còn process nào mở, còn bị giữ thì xóa ở lần pack sau.
+Pack cũ ghi thẳng vào <pack_dir>/ (không có current.json) vẫn đọc được
+
+python corpus_pack.py <dataset_dir> <pack_dir> [--zstd [level]]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+import logging
+
+from line_index import LineIndex, line_starts, offsets_dtype
+from snapshot_files import remove_path
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PACK_INFO_FILE = 'pack.json'
+CURRENT_FILE = 'current.json'
+BLOB_FILE = 'corpus.bin'
+BOOKS_FILE = 'books.npy'
+LINES_FILE = 'lines.npy'
+LINE_STARTS_FILE = 'line_starts.npy'
+FORMAT_VERSION = 1
+DEFAULT_ZSTD_LEVEL = 3
+DECOMPRESSED_CACHE = 8          # số sách đã giải nén giữ trong RAM (pack nén)
+
+
+def _import_zstd():
+    """Import zstandard nếu có, trả về None nếu chưa cài"""
+    try:
+        import zstandard
+        return zstandard
+    except ImportError:
+        return None
+
+
+def _read_current(pack_dir: str) -> Dict:
+    """Nội dung current.json ({} nếu chưa có: chưa pack lần nào hoặc pack cũ không có version)"""
+    path = os.path.join(pack_dir, CURRENT_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def resolve_pack_dir(pack_dir: str) -> Optional[str]:
+    """Thư mục chứa pack.json của version hiện tại, None nếu pack chưa được build"""
+    current = _read_current(pack_dir)
+    directory = os.path.join(pack_dir, current['dir']) if current else pack_dir
+    return directory if os.path.exists(os.path.join(directory, PACK_INFO_FILE)) else None
+
+
+def _remove_old_versions(pack_dir: str, keep: str):
+    """Xóa thư mục version cũ và file của pack cũ không version; cái còn bị mmap thì để lần sau"""
+    for entry in os.listdir(pack_dir):
+        path = os.path.join(pack_dir, entry)
+        is_version = os.path.isdir(path) and entry.startswith('v') and entry[1:].isdigit()
+        is_legacy = entry in (PACK_INFO_FILE, BLOB_FILE, BOOKS_FILE, LINES_FILE, LINE_STARTS_FILE)
+        if (is_version and entry != keep) or is_legacy:
+            if not remove_path(path):
+                logger.info(f"Old corpus pack {path} still in use, will remove it on the next pack")
+
+
+def pack_corpus(dataset_path: str, pack_dir: str, compression: str = None,
+                level: int = DEFAULT_ZSTD_LEVEL) -> Dict:
+    """
+    Đóng gói mọi file .txt của dataset_path vào pack_dir (đọc từng sách một, RAM ~ một sách)
+    Ghi vào thư mục version mới rồi trỏ current.json sang nó, pack cũ vẫn đọc được (reader đang mở giữ nguyên bản cũ)
+    compression: None | 'zstd' (không có zstandard thì lưu không nén)
+    """
+    start_time = time.time()
+    compressor = None
+    if compression == 'zstd':
+        zstd = _import_zstd()
+        if zstd is None:
+            logger.warning("zstandard not installed, packing without compression")
+            compression = None
+        else:
+            compressor = zstd.ZstdCompressor(level=level)
+    elif compression is not None:
+        raise ValueError(f"Unknown compression: {compression} (None | 'zstd')")
+
+    filenames = sorted(f for f in os.listdir(dataset_path) if f.endswith('.txt'))
+    version = _read_current(pack_dir).get('version', 0) + 1
+    version_name = f'v{version}'
+    tmp_dir = os.path.join(pack_dir, version_name + '.tmp')
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    names, books, line_arrays, line_counts = [], [], [], []
+    offset = 0
+    raw_bytes = 0
+    with open(os.path.join(tmp_dir, BLOB_FILE), 'wb') as blob:
+        for i, filename in enumerate(filenames):
+            try:
+                with open(os.path.join(dataset_path, filename), 'rb') as f:
+                    mtime_ns = os.fstat(f.fileno()).st_mtime_ns
+                    data = f.read()
+            except OSError as e:
+                logger.warning(f"Skipping {filename}: {e}")
+                continue
+            stored = compressor.compress(data) if compressor else data
+            blob.write(stored)
+            names.append(filename)
+            books.append((offset, len(stored), len(data), mtime_ns))
+            starts = np.concatenate([np.zeros(1, dtype=np.int64), line_starts(data)])
+            line_arrays.append(starts)
+            line_counts.append(len(starts))
+            offset += len(stored)
+            raw_bytes += len(data)
+            if (i + 1) % 1000 == 0:
+                logger.info(f"Packed {i + 1}/{len(filenames)} books")
+
+    max_size = max((book[2] for book in books), default=0)
+    lines = np.concatenate(line_arrays) if line_arrays else np.zeros(0, dtype=np.int64)
+    starts_index = np.zeros(len(line_counts) + 1, dtype=np.int64)
+    np.cumsum(line_counts, out=starts_index[1:])
+    np.save(os.path.join(tmp_dir, BOOKS_FILE), np.asarray(books, dtype=np.int64).reshape(-1, 4))
+    np.save(os.path.join(tmp_dir, LINES_FILE), lines.astype(offsets_dtype(max_size)))
+    np.save(os.path.join(tmp_dir, LINE_STARTS_FILE), starts_index)
+
+    info = {
+        'format_version': FORMAT_VERSION,
+        'source': os.path.abspath(dataset_path),
+        'compression': compression,
+        'count': len(names),
+        'raw_bytes': raw_bytes,
+        'stored_bytes': offset,
+        'built_at': time.time(),
+        'build_seconds': round(time.time() - start_time, 3),
+        'names': names
+    }
+    with open(os.path.join(tmp_dir, PACK_INFO_FILE), 'w', encoding='utf-8') as f:
+        json.dump(info, f, ensure_ascii=False)
+
+    # Version mới chưa ai mở; current.json chỉ được đọc rồi đóng nên thay bằng os.replace được
+    version_dir = os.path.join(pack_dir, version_name)
+    shutil.rmtree(version_dir, ignore_errors=True)
+    os.replace(tmp_dir, version_dir)
+    current_path = os.path.join(pack_dir, CURRENT_FILE)
+    with open(current_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'version': version, 'dir': version_name}, f)
+    os.replace(current_path + '.tmp', current_path)
+    _remove_old_versions(pack_dir, version_name)
+    logger.info(f"Corpus pack saved: {len(names)} books, {raw_bytes / (1024 * 1024):.1f} MB -> "
+                f"{offset / (1024 * 1024):.1f} MB in {info['build_seconds']}s")
+    return {key: value for key, value in info.items() if key != 'names'}
+
+
+class PackedLineIndex(LineIndex):
+    """Line index của một sách trong pack: đọc byte từ pack thay vì mở file"""
+
+    def __init__(self, pack: 'CorpusPack', filename: str, offsets: np.ndarray, size: int, mtime_ns: int):
+        super().__init__(None, offsets, size, mtime_ns)
+        self.pack = pack
+        self.filename = filename
+
+    def read(self, begin: int, stop: int) -> bytes:
+        return self.pack.read_range(self.filename, begin, stop)
+
+
+class CorpusPack:
+    """
+    Reader của corpus pack: blob / bảng offset / line index đọc qua mmap
+    Pickle được (mở lại đúng thư mục version đang đọc) để dùng trong ProcessPoolExecutor
+    """
+
+    def __init__(self, pack_dir: str):
+        # pack_dir: thư mục pack (theo current.json) hoặc thẳng thư mục của một version
+        self.pack_dir = resolve_pack_dir(pack_dir) or pack_dir
+        pack_dir = self.pack_dir
+        with open(os.path.join(pack_dir, PACK_INFO_FILE), 'r', encoding='utf-8') as f:
+            self.info = json.load(f)
+        if self.info.get('format_version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported corpus pack version {self.info.get('format_version')}")
+        self.filenames = self.info.pop('names')
+        self._rows = {filename: row for row, filename in enumerate(self.filenames)}
+        self.books = np.load(os.path.join(pack_dir, BOOKS_FILE), mmap_mode='r')
+        self.lines = np.load(os.path.join(pack_dir, LINES_FILE), mmap_mode='r')
+        self.line_starts = np.load(os.path.join(pack_dir, LINE_STARTS_FILE), mmap_mode='r')
+        blob_path = os.path.join(pack_dir, BLOB_FILE)
+        # np.memmap không mở được file rỗng
+        self.blob = np.memmap(blob_path, dtype=np.uint8, mode='r') if os.path.getsize(blob_path) \
+            else np.zeros(0, dtype=np.uint8)
+
+        self.compression = self.info.get('compression')
+        self._decompressor = None
+        if self.compression == 'zstd':
+            zstd = _import_zstd()
+            if zstd is None:
+                raise ImportError("Corpus pack is zstd-compressed: pip install zstandard")
+            self._decompressor = zstd
+        self._lock = threading.Lock()
+        self._decompressed = OrderedDict()
+
+    def __reduce__(self):
+        return CorpusPack, (self.pack_dir,)
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def __contains__(self, filename: str) -> bool:
+        return filename in self._rows
+
+    def stat(self, filename: str) -> Tuple[int, int]:
+        """(size, mtime_ns) của file gốc lúc đóng gói"""
+        _, _, size, mtime_ns = self.books[self._rows[filename]]
+        return int(size), int(mtime_ns)
+
+    def _book_bytes(self, row: int) -> bytes:
+        offset, length, _, _ = (int(value) for value in self.books[row])
+        if self._decompressor is None:
+            return self.blob[offset:offset + length].tobytes()
+        with self._lock:
+            data = self._decompressed.get(row)
+            if data is not None:
+                self._decompressed.move_to_end(row)
+                return data
+        # ZstdDecompressor không thread-safe: mỗi lần giải nén tạo một object
+        data = self._decompressor.ZstdDecompressor().decompress(self.blob[offset:offset + length].tobytes())
+        with self._lock:
+            self._decompressed[row] = data
+            while len(self._decompressed) > DECOMPRESSED_CACHE:
+                self._decompressed.popitem(last=False)
+        return data
+
+    def read_range(self, filename: str, begin: int, stop: int) -> bytes:
+        """Byte [begin, stop) của nội dung gốc; pack không nén thì chỉ chạm đúng các trang mmap đó"""
+        row = self._rows[filename]
+        if self._decompressor is None:
+            offset, length = int(self.books[row][0]), int(self.books[row][1])
+            begin, stop = min(max(begin, 0), length), min(max(stop, 0), length)
+            return self.blob[offset + begin:offset + stop].tobytes()
+        return self._book_bytes(row)[begin:stop]
+
+    def read_bytes(self, filename: str, max_bytes: int = None) -> bytes:
+        size = self.stat(filename)[0]
+        return self.read_range(filename, 0, size if max_bytes is None else min(max_bytes, size))
+
+    def read_text(self, filename: str) -> str:
+        return self.read_bytes(filename).decode('utf-8')
+
+    def line_index(self, filename: str) -> PackedLineIndex:
+        row = self._rows[filename]
+        size, mtime_ns = self.stat(filename)
+        offsets = self.lines[int(self.line_starts[row]):int(self.line_starts[row + 1])]
+        return PackedLineIndex(self, filename, offsets, size, mtime_ns)
+
+
+def open_pack(pack_dir: str) -> Optional[CorpusPack]:
+    """Mở version hiện tại của pack nếu đã build, không thì None (dùng thư mục dataset)"""
+    directory = resolve_pack_dir(pack_dir) if pack_dir else None
+    if directory is None:
+        return None
+    pack = CorpusPack(directory)
+    logger.info(f"Corpus pack: {len(pack)} books from {directory} ({pack.compression or 'uncompressed'})")
+    return pack
+
+
+if __name__ == "__main__":
+    # python corpus_pack.py <dataset_dir> <pack_dir> [--zstd [level]]
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(1)
+    compression, level = None, DEFAULT_ZSTD_LEVEL
+    if '--zstd' in sys.argv:
+        compression = 'zstd'
+        position = sys.argv.index('--zstd') + 1
+        if position < len(sys.argv) and sys.argv[position].isdigit():
+            level = int(sys.argv[position])
+    print(json.dumps(pack_corpus(sys.argv[1], sys.argv[2], compression, level), ensure_ascii=False, indent=2))
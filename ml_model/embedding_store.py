@@ -0,0 +1,302 @@
+"""
+Embedding Store cho tìm kiếm out-of-core
+- memory: np.load toàn bộ float32 vào RAM (như cũ)
+- mmap: memory-map embeddings.npy (các worker fork dùng chung page cache)
+- float16 / int8: bản lượng tử hóa, int8 có scale theo từng chiều
+Scoring chạy theo từng block cố định nên RAM bị chặn theo block_size
+Đường dẫn embeddings theo version đã publish (snapshot_files.py); bản lượng tử hóa đi theo đúng file
+embeddings nó được tính từ: embeddings.v7.npy -> embeddings_fp16.v7.npy
+"""
+
+import os
+import json
+import numpy as np
+from typing import Dict, Iterable, Tuple
+import logging
+
+from snapshot_files import latest_path, parse_versioned, published_path, versioned_name
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+EMBEDDINGS_FILE = 'embeddings.npy'
+FLOAT16_FILE = 'embeddings_fp16.npy'
+INT8_FILE = 'embeddings_int8.npy'
+INT8_SCALES_FILE = 'embeddings_int8_scales.npy'
+RECALL_REPORT_FILE = 'storage_recall.json'
+# File dẫn xuất -> file gốc (dọn file version cũ: bản lượng tử hóa sống cùng embeddings của nó)
+QUANTIZED_FILES = {FLOAT16_FILE: EMBEDDINGS_FILE, INT8_FILE: EMBEDDINGS_FILE, INT8_SCALES_FILE: EMBEDDINGS_FILE}
+
+STORAGE_MODES = ('memory', 'mmap', 'float16', 'int8')
+DEFAULT_BLOCK_SIZE = 16384
+
+
+def top_k_from_scores(scores: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Lấy top_k (scores, ids) giảm dần, dùng argpartition thay vì argsort toàn bộ"""
+    n = len(scores)
+    if n == 0 or top_k <= 0:
+        return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+    if top_k < n:
+        ids = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        ids = np.arange(n)
+    ids = ids[np.argsort(-scores[ids], kind='stable')]
+    return scores[ids], ids
+
+
+def int8_scales(embeddings: np.ndarray, block_size: int = DEFAULT_BLOCK_SIZE) -> np.ndarray:
+    """Scale đối xứng theo từng chiều: max(|x|) / 127, tính theo block"""
+    max_abs = np.zeros(embeddings.shape[1], dtype=np.float32)
+    for start in range(0, len(embeddings), block_size):
+        block = np.asarray(embeddings[start:start + block_size], dtype=np.float32)
+        np.maximum(max_abs, np.abs(block).max(axis=0), out=max_abs)
+    scales = max_abs / 127.0
+    scales[scales == 0] = 1.0
+    return scales
+
+
+def quantize_int8(block: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    """Lượng tử hóa một block float32 sang int8 với scales cho trước"""
+    codes = np.rint(np.asarray(block, dtype=np.float32) / scales)
+    return np.clip(codes, -127, 127).astype(np.int8)
+
+
+def _tmp_path(path: str) -> str:
+    """embeddings.npy -> embeddings.tmp.npy (np.save tự thêm .npy nếu thiếu)"""
+    root, ext = os.path.splitext(path)
+    return root + '.tmp' + ext
+
+
+def quantized_path(embeddings_path: str, name: str) -> str:
+    """Đường dẫn bản lượng tử hóa (name) của một file embeddings cụ thể"""
+    directory, base = os.path.split(embeddings_path)
+    parsed = parse_versioned(base)
+    return os.path.join(directory, versioned_name(name, parsed[1]) if parsed else name)
+
+
+def save_quantized(directory: str, modes: Iterable[str] = ('float16', 'int8'),
+                   block_size: int = DEFAULT_BLOCK_SIZE, source_path: str = None):
+    """
+    Ghi các bản float16 / int8 từ embeddings (mặc định bản mới nhất, kể cả bản staged chưa publish)
+    Đọc qua mmap và ghi theo block để không cần giữ cả ma trận trong RAM
+    Ghi ra file tạm rồi os.replace; tên đích gắn với version của embeddings nên không reader nào đang mở nó
+    """
+    source_path = source_path or latest_path(directory, EMBEDDINGS_FILE)
+    source = np.load(source_path, mmap_mode='r')
+
+    if 'float16' in modes:
+        path = quantized_path(source_path, FLOAT16_FILE)
+        out = np.lib.format.open_memmap(_tmp_path(path), mode='w+', dtype=np.float16, shape=source.shape)
+        for start in range(0, len(source), block_size):
+            out[start:start + block_size] = source[start:start + block_size]
+        out.flush()
+        del out
+        os.replace(_tmp_path(path), path)
+        logger.info(f"Float16 embeddings saved ({len(source)} rows)")
+
+    if 'int8' in modes:
+        scales = int8_scales(source, block_size)
+        path = quantized_path(source_path, INT8_FILE)
+        out = np.lib.format.open_memmap(_tmp_path(path), mode='w+', dtype=np.int8, shape=source.shape)
+        for start in range(0, len(source), block_size):
+            out[start:start + block_size] = quantize_int8(source[start:start + block_size], scales)
+        out.flush()
+        del out
+        scales_path = quantized_path(source_path, INT8_SCALES_FILE)
+        np.save(_tmp_path(scales_path), scales)
+        os.replace(_tmp_path(scales_path), scales_path)
+        os.replace(_tmp_path(path), path)
+        logger.info(f"Int8 embeddings saved ({len(source)} rows)")
+
+
+def write_rows(path: str, row_ids: Iterable[int], rows: np.ndarray):
+    """Ghi đè một số dòng của file .npy tại chỗ (mmap r+), không động đến các dòng khác"""
+    row_ids = list(row_ids)
+    if not row_ids:
+        return
+    matrix = np.load(path, mmap_mode='r+')
+    matrix[row_ids] = np.asarray(rows, dtype=matrix.dtype)
+    matrix.flush()
+    del matrix
+
+
+def append_rows(path: str, rows: np.ndarray):
+    """
+    Nối thêm dòng vào cuối file .npy: chỉ sửa shape trong header và ghi phần dữ liệu mới
+    Header .npy được pad tới bội số 64 byte nên thường đủ chỗ cho shape mới;
+    nếu không đủ thì fallback ghi lại toàn bộ file
+    """
+    if len(rows) == 0:
+        return
+    with open(path, 'rb') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        data_start = f.tell()
+
+    rows = np.ascontiguousarray(rows, dtype=dtype)
+    if fortran_order or len(shape) != 2 or rows.shape[1] != shape[1]:
+        raise ValueError(f"Cannot append rows of shape {rows.shape} to {path} {shape}")
+
+    new_shape = (shape[0] + len(rows), shape[1])
+    header = "{'descr': %r, 'fortran_order': False, 'shape': %r, }" % (
+        np.lib.format.dtype_to_descr(dtype), new_shape
+    )
+    prefix_len = 10 if version == (1, 0) else 12
+    available = data_start - prefix_len
+
+    if len(header) + 1 > available:
+        existing = np.load(path)
+        np.save(path, np.concatenate([existing, rows]))
+        return
+
+    with open(path, 'r+b') as f:
+        f.seek(prefix_len)
+        f.write((header.ljust(available - 1) + '\n').encode('latin1'))
+        f.seek(0, os.SEEK_END)
+        f.write(rows.tobytes())
+
+
+class EmbeddingStore:
+    """
+    Ma trận embeddings (float32 / float16 / int8) + scoring theo block
+    Dùng được như array: len(), store[i], store[a:b] trả về float32
+    """
+
+    def __init__(self, matrix: np.ndarray, scales: np.ndarray = None,
+                 mode: str = 'memory', block_size: int = DEFAULT_BLOCK_SIZE):
+        self.matrix = matrix
+        self.scales = scales
+        self.mode = mode
+        self.block_size = block_size
+        self.paths = ()         # file đang được mmap (không được xóa khi còn dùng)
+
+    @classmethod
+    def open(cls, directory: str, mode: str = 'mmap', block_size: int = DEFAULT_BLOCK_SIZE,
+             info: Dict = None, latest: bool = False):
+        """
+        Mở store từ checkpoint dir theo storage mode
+        info: snapshot.json đã đọc (mở đúng version đó); latest=True: bản mới nhất kể cả bản staged chưa publish
+        """
+        if mode not in STORAGE_MODES:
+            raise ValueError(f"Unknown storage mode: {mode} (choose from {list(STORAGE_MODES)})")
+        source_path = latest_path(directory, EMBEDDINGS_FILE) if latest \
+            else published_path(directory, EMBEDDINGS_FILE, info)
+
+        if mode in ('float16', 'int8'):
+            path = quantized_path(source_path, FLOAT16_FILE if mode == 'float16' else INT8_FILE)
+            if not os.path.exists(path):
+                logger.info(f"No {mode} embeddings yet, quantizing from {os.path.basename(source_path)}...")
+                save_quantized(directory, modes=(mode,), block_size=block_size, source_path=source_path)
+            matrix = np.load(path, mmap_mode='r')
+            scales = np.load(quantized_path(source_path, INT8_SCALES_FILE)) if mode == 'int8' else None
+            store = cls(matrix, scales, mode, block_size)
+            store.paths = (path,)
+            return store
+
+        matrix = np.load(source_path, mmap_mode='r' if mode == 'mmap' else None)
+        store = cls(matrix, None, mode, block_size)
+        store.paths = (source_path,)
+        return store
+
+    def __len__(self):
+        return len(self.matrix)
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    @property
+    def nbytes(self) -> int:
+        """Dung lượng dữ liệu (trên đĩa nếu mmap, trong RAM nếu memory)"""
+        return int(self.matrix.nbytes) + (0 if self.scales is None else int(self.scales.nbytes))
+
+    def _dequantize(self, block: np.ndarray) -> np.ndarray:
+        block = np.asarray(block, dtype=np.float32)
+        if self.scales is not None:
+            block = block * self.scales
+        return block
+
+    def __getitem__(self, idx):
+        return self._dequantize(self.matrix[idx])
+
+    def __array__(self, dtype=None, copy=None):
+        # Chỉ dùng khi thật sự cần cả ma trận (ví dụ build faiss index)
+        array = self[:]
+        return array if dtype is None else array.astype(dtype)
+
+    def block_scores(self, start: int, end: int, query: np.ndarray) -> np.ndarray:
+        """Dot product của query với các dòng [start, end)"""
+        block = self.matrix[start:end]
+        if self.scales is not None:
+            # (codes * scales) @ q == codes @ (scales * q), không cần dequantize block
+            return np.asarray(block, dtype=np.float32) @ (self.scales * query)
+        if block.dtype != np.float32:
+            block = np.asarray(block, dtype=np.float32)
+        return block @ query
+
+    def search(self, query: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Exact search theo block, giữ top_k tích lũy giữa các block"""
+        query = np.asarray(query, dtype=np.float32)
+        best_scores = np.empty(0, dtype=np.float32)
+        best_ids = np.empty(0, dtype=np.int64)
+
+        for start in range(0, len(self), self.block_size):
+            end = min(start + self.block_size, len(self))
+            scores, ids = top_k_from_scores(self.block_scores(start, end, query), top_k)
+            merged_scores = np.concatenate([best_scores, scores])
+            merged_ids = np.concatenate([best_ids, ids + start])
+            keep_scores, keep = top_k_from_scores(merged_scores, top_k)
+            best_scores, best_ids = keep_scores, merged_ids[keep]
+
+        return best_scores, best_ids
+
+
+def recall_check(directory: str, modes: Iterable[str] = ('float16', 'int8'), num_queries: int = 200,
+                 top_k: int = 10, seed: int = 0, block_size: int = DEFAULT_BLOCK_SIZE,
+                 latest: bool = False) -> Dict:
+    """
+    So sánh recall@k của các bản lượng tử hóa với float32 (exact)
+    Query lấy ngẫu nhiên từ chính các embeddings (+ nhiễu nhỏ) để sát phân phối thật
+    latest=True: đo trên bản staged vừa ghi (trước khi publish)
+    """
+    reference = EmbeddingStore.open(directory, 'mmap', block_size, latest=latest)
+    if len(reference) == 0:
+        return {}
+
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(reference), size=min(num_queries, len(reference)), replace=False)
+    queries = reference[np.sort(rows)]
+    queries = queries + rng.normal(0, queries.std() * 0.1, queries.shape).astype(np.float32)
+
+    truth = [set(reference.search(q, top_k)[1].tolist()) for q in queries]
+
+    report = {
+        'num_queries': len(queries),
+        'top_k': top_k,
+        'rows': len(reference),
+        'float32_bytes': reference.nbytes,
+        'modes': {}
+    }
+    for mode in modes:
+        store = EmbeddingStore.open(directory, mode, block_size, latest=latest)
+        hits = sum(len(truth[i] & set(store.search(q, top_k)[1].tolist())) for i, q in enumerate(queries))
+        report['modes'][mode] = {
+            'recall_at_k': hits / float(len(queries) * min(top_k, len(reference))),
+            'bytes': store.nbytes
+        }
+        logger.info(f"{mode}: recall@{top_k} = {report['modes'][mode]['recall_at_k']:.4f}")
+
+    with open(os.path.join(directory, RECALL_REPORT_FILE), 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    return report
+
+
+if __name__ == "__main__":
+    import sys
+
+    checkpoint_dir = sys.argv[1] if len(sys.argv) > 1 else "../data/checkpoints"
+    print(json.dumps(recall_check(checkpoint_dir), indent=2))
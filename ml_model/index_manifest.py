@@ -0,0 +1,135 @@
+"""
+Index Manifest cho incremental re-indexing
+Lưu filename, size, mtime, content hash và row trong embeddings.npy của từng sách
+để chỉ embed lại các sách mới / đã sửa
+Sách chỉ còn trong corpus pack (dataset đã xóa / không có file đó) được so sánh theo bản trong pack
+"""
+
+import os
+import json
+import hashlib
+from typing import Dict, List, Set, Tuple
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'index_manifest.json'
+
+
+def file_hash(path: str, chunk_size: int = 1 << 20) -> str:
+    """SHA1 của nội dung file, đọc theo chunk"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_entry(path: str) -> Dict:
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha1': file_hash(path)}
+
+
+def _in_pack_only(dataset_path: str, filename: str, pack) -> bool:
+    """Sách chỉ còn trong corpus pack (file trong dataset luôn được ưu tiên vì pack có thể đã cũ)"""
+    return pack is not None and filename in pack and not os.path.exists(os.path.join(dataset_path, filename))
+
+
+def list_books(dataset_path: str, pack=None) -> Set[str]:
+    """Tên các sách hiện có: file .txt trong dataset cộng sách trong pack (dataset có thể không còn)"""
+    current = set(pack.filenames) if pack is not None else set()
+    if pack is None or os.path.isdir(dataset_path):
+        current.update(f for f in os.listdir(dataset_path) if f.endswith('.txt'))
+    return current
+
+
+def book_stat(dataset_path: str, filename: str, pack=None) -> Tuple[int, float]:
+    """(size, mtime) của sách, lấy từ pack nếu sách không có trong dataset"""
+    if _in_pack_only(dataset_path, filename, pack):
+        size, mtime_ns = pack.stat(filename)
+        return size, mtime_ns / 1e9
+    stat = os.stat(os.path.join(dataset_path, filename))
+    return stat.st_size, stat.st_mtime
+
+
+def book_hash(dataset_path: str, filename: str, pack=None) -> str:
+    if _in_pack_only(dataset_path, filename, pack):
+        return hashlib.sha1(pack.read_bytes(filename)).hexdigest()
+    return file_hash(os.path.join(dataset_path, filename))
+
+
+def book_entry(dataset_path: str, filename: str, pack=None) -> Dict:
+    if _in_pack_only(dataset_path, filename, pack):
+        size, mtime = book_stat(dataset_path, filename, pack)
+        return {'size': size, 'mtime': mtime, 'sha1': book_hash(dataset_path, filename, pack)}
+    return file_entry(os.path.join(dataset_path, filename))
+
+
+class IndexManifest:
+    """
+    entries: filename -> {row, size, mtime, sha1}
+    free_rows: các row đã bị xóa (tombstone), được tái sử dụng cho sách mới
+    """
+
+    def __init__(self, checkpoint_dir: str):
+        self.path = os.path.join(checkpoint_dir, MANIFEST_FILE)
+        self.entries = {}
+        self.free_rows = []
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def load(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        self.entries = data['entries']
+        self.free_rows = data.get('free_rows', [])
+        return self
+
+    def save(self):
+        # Ghi file tạm rồi rename để không bao giờ để lại manifest hỏng
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'entries': self.entries, 'free_rows': self.free_rows}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def rebuild(self, dataset_path: str, metadata: List[Dict], pack=None):
+        """Tạo manifest từ metadata hiện có (sau một lần train đầy đủ)"""
+        self.entries = {}
+        self.free_rows = []
+        current = list_books(dataset_path, pack)
+        for row, book in enumerate(metadata):
+            if book.get('deleted'):
+                self.free_rows.append(row)
+                continue
+            if book['filename'] in current:
+                self.entries[book['filename']] = dict(book_entry(dataset_path, book['filename'], pack), row=row)
+            else:
+                self.entries[book['filename']] = {'row': row, 'size': -1, 'mtime': 0, 'sha1': None}
+        logger.info(f"Manifest rebuilt with {len(self.entries)} books")
+        return self
+
+    def diff(self, dataset_path: str, pack=None) -> Tuple[List[str], List[str], List[str]]:
+        """
+        So sánh với dataset hiện tại (cộng corpus pack nếu có) -> (added, modified, deleted)
+        Chỉ hash lại file khi size / mtime thay đổi; hash trùng thì coi như không đổi
+        """
+        current = list_books(dataset_path, pack)
+        added = sorted(current - set(self.entries))
+        deleted = sorted(set(self.entries) - current)
+        modified = []
+
+        for filename in sorted(current & set(self.entries)):
+            entry = self.entries[filename]
+            size, mtime = book_stat(dataset_path, filename, pack)
+            if size == entry['size'] and mtime == entry['mtime']:
+                continue
+            sha1 = book_hash(dataset_path, filename, pack)
+            if sha1 == entry['sha1']:
+                # Chỉ touch file, nội dung không đổi
+                entry['mtime'] = mtime
+                continue
+            modified.append(filename)
+
+        return added, modified, deleted
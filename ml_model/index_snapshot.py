@@ -0,0 +1,307 @@
+"""
+Index Snapshot bất biến, có version
+Search chỉ đọc qua một reference tới snapshot hiện tại; training / re-indexing ghi file mới
+rồi load snapshot kế tiếp và thay reference một lần,
+nên query luôn thấy trọn vẹn một version, không bao giờ thấy dữ liệu đang build dở
+- Mọi file của snapshot (embeddings, bản lượng tử hóa, metadata SQLite, ANN / BM25 / passage index, k-NN graph)
+  ghi vào tên có version (snapshot_files.py) thay vì os.replace lên file đang mở (Windows không cho);
+  reader chỉ mở đúng các file snapshot.json trỏ tới nên không ghép lẫn file của hai version
+- SnapshotHolder đếm query đang dùng từng version, version cũ chỉ được đóng khi hết query,
+  sau đó file của các version không còn ai dùng được xóa
+- SnapshotWatcher theo dõi snapshot.json để hot reload khi process khác (train_offline.py) publish
+"""
+
+import os
+import json
+import time
+import threading
+import numpy as np
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+import logging
+
+from ann_index import LEGACY_FILES as ANN_LEGACY_FILES, BruteForceIndex, load_index, published_index_dir
+from embedding_store import EMBEDDINGS_FILE, QUANTIZED_FILES, EmbeddingStore
+from metadata_store import MetadataStore
+from lexical_index import LexicalIndex
+from passage_index import PASSAGE_DIR, PassageIndex
+from knn_graph import KnnGraph
+from snapshot_files import (
+    SNAPSHOT_FILE, published_path, read_snapshot_info, remove_unused_files, staged_files
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+LEXICAL_FIELDS = ('title', 'preview')
+
+
+def read_version(checkpoint_dir: str) -> int:
+    """Version đã publish gần nhất (0 nếu chưa publish lần nào)"""
+    return read_snapshot_info(checkpoint_dir).get('version', 0)
+
+
+def publish_version(checkpoint_dir: str, model_name: str = None) -> int:
+    """
+    Tăng version sau khi đã ghi xong mọi file của snapshot mới (ghi atomic)
+    File staged của version mới thay tên cũ trong 'files', file không ghi lại giữ bản của version trước
+    """
+    info = read_snapshot_info(checkpoint_dir)
+    version = info.get('version', 0) + 1
+    files = dict(info.get('files', {}))
+    files.update(staged_files(checkpoint_dir, version))
+    path = os.path.join(checkpoint_dir, SNAPSHOT_FILE)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': version, 'model_name': model_name, 'published_at': time.time(), 'files': files}, f)
+    os.replace(tmp_path, path)
+    logger.info(f"Published index version {version}")
+    return version
+
+
+class IndexSnapshot:
+    """
+    Dữ liệu search của một version: embeddings, metadata, ANN index, BM25 index, passage index
+    Không sửa sau khi tạo; version mới là một object mới
+    """
+
+    __slots__ = ('version', 'model_name', 'embeddings', 'metadata', 'index', 'lexical_index', 'passage_index',
+                 'knn_graph', 'num_deleted', 'loaded_at', 'files')
+
+    def __init__(self, version: int, embeddings, metadata: MetadataStore, index,
+                 lexical_index: LexicalIndex = None, passage_index: PassageIndex = None,
+                 model_name: str = None, knn_graph: KnnGraph = None, files=()):
+        set_attr = object.__setattr__
+        set_attr(self, 'version', version)
+        set_attr(self, 'model_name', model_name)
+        set_attr(self, 'embeddings', embeddings)
+        set_attr(self, 'metadata', metadata)
+        set_attr(self, 'index', index)
+        set_attr(self, 'lexical_index', lexical_index)
+        set_attr(self, 'passage_index', passage_index)
+        set_attr(self, 'knn_graph', knn_graph)
+        # Row tombstone của sách đã xóa (incremental re-indexing)
+        set_attr(self, 'num_deleted', metadata.num_deleted)
+        set_attr(self, 'loaded_at', time.time())
+        # Đường dẫn file / thư mục snapshot đang mở (không được xóa khi snapshot còn sống)
+        set_attr(self, 'files', frozenset(files))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"IndexSnapshot is immutable (tried to set {name})")
+
+    def __len__(self):
+        return len(self.embeddings)
+
+    @property
+    def dimension(self) -> int:
+        return self.embeddings.shape[1] if len(self.embeddings) else 0
+
+    def close(self):
+        """Đóng kết nối SQLite; mmap được giải phóng khi không còn reference"""
+        self.metadata.close()
+
+    def info(self):
+        return {
+            'version': self.version,
+            'model_name': self.model_name,
+            'embeddings': len(self.embeddings),
+            'deleted': self.num_deleted,
+            'index': self.index.kind if self.index is not None else None,
+            'passages': len(self.passage_index) if self.passage_index is not None else 0,
+            'knn_k': self.knn_graph.k if self.knn_graph is not None else 0,
+            'loaded_at': self.loaded_at
+        }
+
+
+def load_snapshot(checkpoint_dir: str, storage: str = 'memory',
+                  lexical_tokenizer: str = 'syllable', load_ann: bool = True) -> Optional[IndexSnapshot]:
+    """
+    Load snapshot từ checkpoint_dir (None nếu chưa train)
+    load_ann=False: không load ANN index (search do shard process phục vụ), fallback local là brute-force
+    """
+    # Đọc snapshot.json một lần: mọi file mở theo đúng mapping của version này
+    published = read_snapshot_info(checkpoint_dir)
+    embeddings_path = published_path(checkpoint_dir, EMBEDDINGS_FILE, published)
+    if not os.path.exists(embeddings_path):
+        return None
+
+    version = published.get('version', 0)
+    files = []
+    if storage == 'memory':
+        embeddings = np.load(embeddings_path)
+    else:
+        # mmap / float16 / int8: đọc từ đĩa theo block, không load cả ma trận
+        embeddings = EmbeddingStore.open(checkpoint_dir, storage, info=published)
+        files.extend(embeddings.paths)
+    # Chỉ filename / title / deleted nằm trong RAM, field khác đọc lazily cho top-k
+    metadata = MetadataStore.open(checkpoint_dir, info=published)
+    files.append(metadata.path)
+    if load_ann:
+        index = load_index(published_index_dir(checkpoint_dir, published), embeddings)
+    else:
+        # Brute-force dùng thẳng store mmap / lượng tử hóa, không giữ thêm bản vector nào trong RAM
+        index = BruteForceIndex().build(embeddings)
+
+    passage_index = None
+    if PassageIndex.exists(checkpoint_dir, published):
+        passage_index = PassageIndex.open(checkpoint_dir, info=published)
+        files.append(published_path(checkpoint_dir, PASSAGE_DIR, published))
+        logger.info(f"Loaded {len(passage_index)} passages")
+
+    if LexicalIndex.exists(checkpoint_dir, published):
+        lexical_index = LexicalIndex.load(checkpoint_dir, info=published)
+    else:
+        # Checkpoint cũ chưa có BM25 index: build trong RAM (được ghi ra ở lần train / re-index tiếp theo)
+        lexical_index = LexicalIndex.build(metadata.iter_records(LEXICAL_FIELDS), lexical_tokenizer)
+    if len(lexical_index) != len(embeddings):
+        # Doc id của BM25 là row của embeddings: lệch số row thì hybrid search trỏ ra ngoài ma trận
+        logger.warning(f"Lexical index has {len(lexical_index)} docs but embeddings have {len(embeddings)}, "
+                       f"using dense search only")
+        lexical_index = None
+
+    knn_graph = None
+    if KnnGraph.exists(checkpoint_dir, published):
+        knn_graph = KnnGraph.open(checkpoint_dir, info=published)
+        files.append(knn_graph.path)
+        if len(knn_graph) != len(embeddings):
+            logger.warning(f"k-NN graph has {len(knn_graph)} rows but embeddings have {len(embeddings)}, ignoring it")
+            knn_graph = None
+
+    logger.info(f"Loaded index version {version} ({len(embeddings)} embeddings)")
+    return IndexSnapshot(version, embeddings, metadata, index, lexical_index, passage_index,
+                         model_name=published.get('model_name'), knn_graph=knn_graph, files=files)
+
+
+def validate_snapshot(snapshot: IndexSnapshot, model_name: str, dimension: int = None):
+    """Kiểm tra snapshot trước khi phục vụ, lỗi -> ValueError (giữ nguyên snapshot cũ)"""
+    if len(snapshot.embeddings.shape) != 2:
+        raise ValueError(f"Embeddings must be 2-D, got shape {snapshot.embeddings.shape}")
+    if len(snapshot.metadata) != len(snapshot):
+        raise ValueError(f"Metadata has {len(snapshot.metadata)} rows but embeddings have {len(snapshot)}")
+    if snapshot.model_name is not None and snapshot.model_name != model_name:
+        raise ValueError(f"Index was built with {snapshot.model_name}, backend uses {model_name}")
+    if dimension is not None and len(snapshot) and snapshot.dimension != dimension:
+        raise ValueError(f"Embedding dimension {snapshot.dimension} does not match model dimension {dimension}")
+    if snapshot.index is not None and len(snapshot.index) != len(snapshot):
+        raise ValueError(f"ANN index has {len(snapshot.index)} vectors but embeddings have {len(snapshot)}")
+
+
+class SnapshotHolder:
+    """
+    Giữ snapshot hiện tại và đếm số query đang dùng từng version
+    swap() thay snapshot mới; version cũ được close() khi query cuối cùng dùng nó release,
+    rồi file của version không còn snapshot nào giữ được xóa (checkpoint_dir khác None)
+    """
+
+    def __init__(self, checkpoint_dir: str = None):
+        self.checkpoint_dir = checkpoint_dir
+        self._lock = threading.Lock()
+        self.current = None
+        self._refs = {}         # id(snapshot) -> số query đang dùng
+        self._retired = {}      # id(snapshot) -> snapshot cũ chờ hết query
+
+    @contextmanager
+    def acquire(self):
+        """with holder.acquire() as snapshot: ... (snapshot có thể là None nếu chưa load)"""
+        with self._lock:
+            snapshot = self.current
+            if snapshot is not None:
+                self._refs[id(snapshot)] = self._refs.get(id(snapshot), 0) + 1
+        try:
+            yield snapshot
+        finally:
+            if snapshot is not None:
+                self._release(snapshot)
+
+    def _release(self, snapshot: IndexSnapshot):
+        with self._lock:
+            key = id(snapshot)
+            self._refs[key] -= 1
+            if self._refs[key] > 0:
+                return
+            del self._refs[key]
+            retired = self._retired.pop(key, None)
+        if retired is not None:
+            retired.close()
+            logger.info(f"Retired index version {retired.version}")
+            del retired
+            self.remove_unused_files()
+
+    def swap(self, snapshot: IndexSnapshot) -> Optional[IndexSnapshot]:
+        """Thay snapshot hiện tại, trả về snapshot cũ"""
+        with self._lock:
+            previous, self.current = self.current, snapshot
+            if previous is None or previous is snapshot:
+                return previous
+            if self._refs.get(id(previous)):
+                self._retired[id(previous)] = previous
+                previous = None
+        if previous is not None:
+            previous.close()
+        return previous
+
+    def remove_unused_files(self):
+        """
+        Xóa file của các version không còn trong snapshot.json và không còn snapshot sống nào giữ
+        Gọi sau swap (khi snapshot cũ không có query) và khi snapshot cũ được release;
+        file còn bị giữ (Windows, process khác) được thử lại ở lần dọn sau
+        """
+        if self.checkpoint_dir is None:
+            return []
+        with self._lock:
+            in_use = set()
+            for snapshot in [self.current, *self._retired.values()]:
+                if snapshot is not None:
+                    in_use.update(snapshot.files)
+        try:
+            return remove_unused_files(self.checkpoint_dir, in_use, derived=dict(QUANTIZED_FILES, **ANN_LEGACY_FILES))
+        except OSError as e:
+            logger.warning(f"Cannot clean up old index files: {e}")
+            return []
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'version': self.current.version if self.current is not None else None,
+                'in_flight': sum(self._refs.values()),
+                'retiring_versions': sorted(snapshot.version for snapshot in self._retired.values())
+            }
+
+
+class SnapshotWatcher:
+    """
+    Thread nền kiểm tra snapshot.json mỗi interval giây
+    Khi version publish mới hơn version đang phục vụ thì gọi on_change() (ví dụ reload_index),
+    on_change trả về {'reloaded': bool, ...}
+    """
+
+    def __init__(self, checkpoint_dir: str, current_version: Callable[[], int],
+                 on_change: Callable[[], Dict], interval: float = 10.0):
+        self.checkpoint_dir = checkpoint_dir
+        self.current_version = current_version
+        self.on_change = on_change
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._failed_version = None     # version reload lỗi, không thử lại cho tới khi có version mới hơn
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='snapshot-watcher', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                published = read_version(self.checkpoint_dir)
+                if published > (self.current_version() or 0) and published != self._failed_version:
+                    logger.info(f"Index version {published} published, reloading...")
+                    result = self.on_change()
+                    self._failed_version = None if result.get('reloaded') else published
+            except Exception as e:
+                logger.error(f"Snapshot watcher error: {e}")
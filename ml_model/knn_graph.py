@@ -0,0 +1,147 @@
+"""
+k-NN Graph tính trước cho "sách tương tự"
+- Với mỗi sách, tìm k láng giềng gần nhất (inner product) bằng nhân ma trận theo block:
+  block row x block cột, giữ top-k chạy dần nên RAM chỉ ~ row_block x (k + col_block) float32
+- Lưu dạng mảng gọn: ids int32 (N x k) + scores float16 (N x k), tra cứu một sách là O(1)
+- Mỗi lần build ghi thư mục mới knn.v<N> (snapshot_files.py), thư mục snapshot đang mmap không bị đổi tên
+"""
+
+import os
+import json
+import shutil
+import time
+import numpy as np
+from typing import Dict, Tuple
+import logging
+
+from snapshot_files import latest_path, published_path, remove_path, staged_path
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+KNN_DIR = 'knn'
+INFO_FILE = 'knn.json'
+DEFAULT_K = 20
+ROW_BLOCK = 1024
+COL_BLOCK = 4096
+
+
+def _merge_top_k(best_scores: np.ndarray, best_ids: np.ndarray, scores: np.ndarray, ids: np.ndarray,
+                 k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Gộp top-k hiện tại với điểm của một block cột, mỗi row giữ k điểm cao nhất"""
+    all_scores = np.concatenate([best_scores, scores], axis=1)
+    all_ids = np.concatenate([best_ids, np.broadcast_to(ids, scores.shape)], axis=1)
+    if all_scores.shape[1] > k:
+        part = np.argpartition(-all_scores, k - 1, axis=1)[:, :k]
+        all_scores = np.take_along_axis(all_scores, part, axis=1)
+        all_ids = np.take_along_axis(all_ids, part, axis=1)
+    return all_scores, all_ids
+
+
+def build_knn_graph(checkpoint_dir: str, embeddings, deleted: np.ndarray = None, k: int = DEFAULT_K,
+                    row_block: int = ROW_BLOCK, col_block: int = COL_BLOCK) -> Dict:
+    """
+    Tính k láng giềng (không gồm chính nó, bỏ sách đã xóa) cho mọi row của embeddings
+    embeddings: np.ndarray / mmap / EmbeddingStore (slice trả về float32)
+    Ghi vào thư mục tạm rồi đổi tên thành bản staged của version sắp publish, graph đang phục vụ không bị đụng tới
+    """
+    start_time = time.time()
+    num_rows = len(embeddings)
+    k = max(1, min(k, num_rows - 1)) if num_rows > 1 else 1
+    deleted = np.zeros(num_rows, dtype=bool) if deleted is None else np.asarray(deleted, dtype=bool)
+
+    directory = staged_path(checkpoint_dir, KNN_DIR)
+    tmp_dir = directory + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    ids_out = np.lib.format.open_memmap(os.path.join(tmp_dir, 'ids.npy'), mode='w+', dtype=np.int32,
+                                        shape=(num_rows, k))
+    scores_out = np.lib.format.open_memmap(os.path.join(tmp_dir, 'scores.npy'), mode='w+', dtype=np.float16,
+                                           shape=(num_rows, k))
+
+    for row_start in range(0, num_rows, row_block):
+        row_end = min(row_start + row_block, num_rows)
+        rows = np.asarray(embeddings[row_start:row_end], dtype=np.float32)
+        best_scores = np.full((len(rows), 0), -np.inf, dtype=np.float32)
+        best_ids = np.empty((len(rows), 0), dtype=np.int64)
+
+        for col_start in range(0, num_rows, col_block):
+            col_end = min(col_start + col_block, num_rows)
+            cols = np.asarray(embeddings[col_start:col_end], dtype=np.float32)
+            scores = rows @ cols.T
+            scores[:, deleted[col_start:col_end]] = -np.inf
+            # Bỏ chính nó (đường chéo nằm trong block này)
+            overlap_start, overlap_end = max(row_start, col_start), min(row_end, col_end)
+            if overlap_start < overlap_end:
+                diag = np.arange(overlap_start, overlap_end)
+                scores[diag - row_start, diag - col_start] = -np.inf
+            best_scores, best_ids = _merge_top_k(
+                best_scores, best_ids, scores, np.arange(col_start, col_end, dtype=np.int64), k
+            )
+
+        order = np.argsort(-best_scores, axis=1, kind='stable')
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_ids = np.take_along_axis(best_ids, order, axis=1)
+        # Không đủ láng giềng hợp lệ (corpus nhỏ / nhiều sách xóa) -> id -1
+        best_ids[~np.isfinite(best_scores)] = -1
+        best_ids[deleted[row_start:row_end]] = -1
+        ids_out[row_start:row_end] = best_ids[:, :k]
+        scores_out[row_start:row_end] = np.nan_to_num(best_scores[:, :k], neginf=0.0)
+        logger.info(f"k-NN graph: {row_end}/{num_rows} rows")
+
+    ids_out.flush()
+    scores_out.flush()
+    del ids_out, scores_out
+
+    info = {
+        'k': k,
+        'count': num_rows,
+        'bytes': num_rows * k * 6,
+        'build_seconds': round(time.time() - start_time, 3)
+    }
+    # Info ghi sau cùng: có info nghĩa là graph đã ghi đủ
+    with open(os.path.join(tmp_dir, INFO_FILE), 'w', encoding='utf-8') as f:
+        json.dump(info, f, ensure_ascii=False, indent=2)
+
+    # Bản staged cũ (build lại trước khi publish) chưa snapshot nào mở
+    remove_path(directory)
+    os.replace(tmp_dir, directory)
+    logger.info(f"k-NN graph saved: {info}")
+    return info
+
+
+class KnnGraph:
+    """Đọc k-NN graph qua mmap: neighbors(row) là một lần đọc mảng, không tính toán"""
+
+    def __init__(self, ids: np.ndarray, scores: np.ndarray, info: Dict):
+        self.ids = ids
+        self.scores = scores
+        self.info = info
+        self.k = info['k']
+        self.path = None        # thư mục đang được mmap (không được xóa khi còn dùng)
+
+    @staticmethod
+    def exists(checkpoint_dir: str, info: Dict = None) -> bool:
+        return os.path.exists(os.path.join(published_path(checkpoint_dir, KNN_DIR, info), INFO_FILE))
+
+    @classmethod
+    def open(cls, checkpoint_dir: str, info: Dict = None, latest: bool = False):
+        """info: snapshot.json đã đọc (mở đúng version đó); latest=True: kể cả bản staged chưa publish"""
+        directory = latest_path(checkpoint_dir, KNN_DIR) if latest else published_path(checkpoint_dir, KNN_DIR, info)
+        with open(os.path.join(directory, INFO_FILE), 'r', encoding='utf-8') as f:
+            graph_info = json.load(f)
+        ids = np.load(os.path.join(directory, 'ids.npy'), mmap_mode='r')
+        scores = np.load(os.path.join(directory, 'scores.npy'), mmap_mode='r')
+        graph = cls(ids, scores, graph_info)
+        graph.path = directory
+        return graph
+
+    def __len__(self):
+        return len(self.ids)
+
+    def neighbors(self, row: int, top_k: int = None) -> Tuple[np.ndarray, np.ndarray]:
+        """(ids, scores) của các láng giềng của row, giảm dần theo điểm"""
+        ids = np.asarray(self.ids[row, :top_k or self.k], dtype=np.int64)
+        scores = np.asarray(self.scores[row, :top_k or self.k], dtype=np.float32)
+        valid = ids >= 0
+        return ids[valid], scores[valid]
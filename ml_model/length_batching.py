@@ -0,0 +1,140 @@
+"""
+Length-bucketed Dynamic Batching cho corpus embedding
+- Đọc một cửa sổ nhiều sách, đếm token, sắp theo độ dài rồi chia batch theo ngân sách token
+  (số text x độ dài dài nhất trong batch <= max_batch_tokens) thay vì số text cố định
+- Kết quả được ghép lại đúng thứ tự row của cửa sổ trước khi commit
+- PaddingStats so sánh padding waste của batch cố định (thứ tự dataset) với batch theo độ dài
+"""
+
+import threading
+from collections import deque
+from typing import Callable, Dict, Iterable, Iterator, List, Sequence
+import numpy as np
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BATCH_TOKENS = 8192
+DEFAULT_MAX_SEQ_LENGTH = 256
+WINDOW_BATCHES = 16         # cửa sổ sắp xếp = batch_size * WINDOW_BATCHES sách
+CHARS_PER_TOKEN = 4         # ước lượng khi không có tokenizer
+
+
+def token_lengths(texts: Sequence[str], tokenizer=None, max_length: int = DEFAULT_MAX_SEQ_LENGTH) -> np.ndarray:
+    """Số token (đã truncate như lúc encode) của từng text; không có tokenizer thì ước lượng theo ký tự"""
+    if tokenizer is None:
+        lengths = [len(text) // CHARS_PER_TOKEN + 2 for text in texts]
+    else:
+        encoded = tokenizer(list(texts), truncation=True, max_length=max_length)['input_ids']
+        lengths = [len(ids) for ids in encoded]
+    return np.minimum(np.asarray(lengths, dtype=np.int64), max_length)
+
+
+def plan_batches(lengths: np.ndarray, max_batch_tokens: int, max_batch_size: int = None) -> List[np.ndarray]:
+    """
+    Chia các text thành batch theo ngân sách token: sắp giảm dần theo độ dài,
+    thêm text vào batch khi (số text + 1) x độ dài dài nhất <= max_batch_tokens
+    Trả về danh sách index (theo thứ tự trong cửa sổ) của từng batch
+    """
+    order = np.argsort(-lengths, kind='stable')
+    batches = []
+    current = []
+    longest = 0
+    for idx in order:
+        longest_if_added = max(longest, int(lengths[idx]))
+        full = max_batch_size is not None and len(current) >= max_batch_size
+        if current and (full or (len(current) + 1) * longest_if_added > max_batch_tokens):
+            batches.append(np.asarray(current, dtype=np.int64))
+            current, longest_if_added = [], int(lengths[idx])
+        current.append(idx)
+        longest = longest_if_added
+    if current:
+        batches.append(np.asarray(current, dtype=np.int64))
+    return batches
+
+
+def padded_tokens(lengths: np.ndarray, batches: Iterable[np.ndarray]) -> int:
+    return int(sum(len(batch) * int(lengths[batch].max()) for batch in batches if len(batch)))
+
+
+class PaddingStats:
+    """Padding waste tích lũy: batch cố định theo thứ tự dataset (before) vs batch theo độ dài (after)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.real_tokens = 0
+        self.fixed_padded_tokens = 0
+        self.bucketed_padded_tokens = 0
+        self.fixed_batches = 0
+        self.bucketed_batches = 0
+
+    def record(self, lengths: np.ndarray, batches: List[np.ndarray], fixed_batch_size: int):
+        fixed = [np.arange(start, min(start + fixed_batch_size, len(lengths)))
+                 for start in range(0, len(lengths), fixed_batch_size)]
+        with self._lock:
+            self.real_tokens += int(lengths.sum())
+            self.fixed_padded_tokens += padded_tokens(lengths, fixed)
+            self.bucketed_padded_tokens += padded_tokens(lengths, batches)
+            self.fixed_batches += len(fixed)
+            self.bucketed_batches += len(batches)
+
+    @staticmethod
+    def _waste(padded: int, real: int) -> float:
+        return round(100.0 * (padded - real) / padded, 2) if padded else 0.0
+
+    def as_dict(self) -> Dict:
+        return {
+            'real_tokens': self.real_tokens,
+            'fixed': {
+                'batches': self.fixed_batches,
+                'padded_tokens': self.fixed_padded_tokens,
+                'padding_waste_pct': self._waste(self.fixed_padded_tokens, self.real_tokens)
+            },
+            'bucketed': {
+                'batches': self.bucketed_batches,
+                'padded_tokens': self.bucketed_padded_tokens,
+                'padding_waste_pct': self._waste(self.bucketed_padded_tokens, self.real_tokens)
+            }
+        }
+
+
+class BucketedBatch:
+    """Một cửa sổ đã chia batch: parts = [(index trong cửa sổ, features)], size = số text"""
+
+    def __init__(self, size: int, parts: List):
+        self.size = size
+        self.parts = parts
+
+
+def bucketed_map(encode_map: Callable[[Iterable], Iterator], plan_fn: Callable[[List[str]], List[np.ndarray]]):
+    """
+    Bọc một encode_map (ví dụ MultiProcessEncoder.map): chia mỗi cửa sổ (tag, texts) thành
+    các batch theo độ dài, encode, rồi ghép lại (tag, embeddings) theo đúng thứ tự text của cửa sổ
+    """
+    def run(windows: Iterable) -> Iterator:
+        planned = deque()
+
+        def sub_batches():
+            for tag, texts in windows:
+                batches = plan_fn(texts)
+                planned.append((tag, len(texts), len(batches)))
+                for idx in batches:
+                    yield idx, [texts[i] for i in idx]
+
+        out = None
+        remaining = 0
+        tag = None
+        for idx, embeddings in encode_map(sub_batches()):
+            if remaining == 0:
+                tag, size, remaining = planned.popleft()
+                out = None
+            embeddings = np.asarray(embeddings, dtype=np.float32)
+            if out is None:
+                out = np.empty((size, embeddings.shape[1]), dtype=np.float32)
+            out[idx] = embeddings
+            remaining -= 1
+            if remaining == 0:
+                yield tag, out
+
+    return run
@@ -0,0 +1,228 @@
+"""
+Lexical Index (BM25) cho tìm kiếm tiếng Việt
+- Tokenize theo âm tiết (mặc định, không cần thư viện) hoặc theo từ với pyvi / underthesea
+- Inverted index lưu dạng posting list nén: doc id delta-encode với độ rộng 1/2/4 byte
+  theo từng term + tf uint8, ghi liền trong lexical/postings.bin
+- Mỗi version ghi thư mục lexical.v<N>/ (snapshot_files.py), không ghi đè index của version đang phục vụ
+- Dùng làm bước sinh ứng viên rẻ cho hybrid search (dense chỉ re-score các ứng viên)
+"""
+
+import os
+import re
+import json
+import math
+import unicodedata
+import numpy as np
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+import logging
+
+from embedding_store import top_k_from_scores
+from snapshot_files import latest_path, published_path, remove_path, staged_path
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+LEXICAL_DIR = 'lexical'
+TOKENIZERS = ('syllable', 'pyvi', 'underthesea')
+TITLE_WEIGHT = 3            # title được lặp lại để tăng trọng số khi khớp tên sách
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_SYLLABLE_RE = re.compile(r'[^\W_]+')
+
+
+def _word_tokens(text: str, tokenizer: str) -> List[str]:
+    """Tách từ bằng pyvi / underthesea, fallback về âm tiết nếu chưa cài"""
+    try:
+        if tokenizer == 'pyvi':
+            from pyvi import ViTokenizer
+            words = ViTokenizer.tokenize(text).split()
+        else:
+            from underthesea import word_tokenize
+            words = [word.replace(' ', '_') for word in word_tokenize(text)]
+    except ImportError:
+        logger.warning(f"{tokenizer} is not installed, falling back to syllable tokens")
+        return _SYLLABLE_RE.findall(text)
+    return [word for word in words if any(c.isalnum() for c in word)]
+
+
+def tokenize(text: str, tokenizer: str = 'syllable') -> List[str]:
+    """Chuẩn hóa NFC + lowercase rồi tách token"""
+    text = unicodedata.normalize('NFC', text).lower()
+    if tokenizer == 'syllable':
+        return _SYLLABLE_RE.findall(text)
+    return _word_tokens(text, tokenizer)
+
+
+def book_text(book: Dict) -> str:
+    """Nội dung được index của một sách: title (lặp TITLE_WEIGHT lần) + preview"""
+    return ' '.join([book.get('title', '')] * TITLE_WEIGHT + [book.get('preview', '')])
+
+
+def _width(max_value: int) -> int:
+    if max_value < 1 << 8:
+        return 1
+    if max_value < 1 << 16:
+        return 2
+    return 4
+
+
+_WIDTH_DTYPES = {1: np.uint8, 2: '<u2', 4: '<u4'}
+
+
+class LexicalIndex:
+    """
+    BM25 trên inverted index nén
+    terms: term -> [offset trong postings.bin, df, độ rộng delta]
+    """
+
+    def __init__(self, terms: Dict, postings: np.ndarray, doc_lengths: np.ndarray, info: Dict):
+        self.terms = terms
+        self.postings = postings
+        self.doc_lengths = doc_lengths
+        self.info = info
+        self.tokenizer = info['tokenizer']
+        self.num_docs = info['num_docs']
+        self.avgdl = info['avgdl'] or 1.0
+        self.k1 = info.get('k1', BM25_K1)
+        self.b = info.get('b', BM25_B)
+
+    @classmethod
+    def build(cls, metadata: Iterable[Dict], tokenizer: str = 'syllable'):
+        """
+        Build index từ metadata theo thứ tự row (doc id = row), đọc một lượt nên nhận được stream
+        Sách đã xóa (tombstone) không được index
+        """
+        if tokenizer not in TOKENIZERS:
+            raise ValueError(f"Unknown tokenizer: {tokenizer} (choose from {list(TOKENIZERS)})")
+
+        vocab = {}
+        term_ids, doc_ids, tfs = array('i'), array('i'), array('i')
+        doc_lengths = array('i')
+
+        for doc_id, book in enumerate(metadata):
+            if book.get('deleted'):
+                doc_lengths.append(0)
+                continue
+            tokens = tokenize(book_text(book), tokenizer)
+            doc_lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                term_ids.append(vocab.setdefault(term, len(vocab)))
+                doc_ids.append(doc_id)
+                tfs.append(tf)
+
+        doc_lengths = np.frombuffer(doc_lengths, dtype=np.int32).copy()
+        term_ids = np.frombuffer(term_ids, dtype=np.int32)
+        doc_ids = np.frombuffer(doc_ids, dtype=np.int32)
+        tfs = np.minimum(np.frombuffer(tfs, dtype=np.int32), 255).astype(np.uint8)
+
+        # Gom posting theo term, trong mỗi term sắp theo doc id để delta-encode
+        order = np.lexsort((doc_ids, term_ids))
+        term_ids, doc_ids, tfs = term_ids[order], doc_ids[order], tfs[order]
+        bounds = np.searchsorted(term_ids, np.arange(len(vocab) + 1))
+
+        id_to_term = [None] * len(vocab)
+        for term, term_id in vocab.items():
+            id_to_term[term_id] = term
+
+        terms = {}
+        chunks = []
+        offset = 0
+        for term_id, term in enumerate(id_to_term):
+            start, end = bounds[term_id], bounds[term_id + 1]
+            deltas = np.diff(doc_ids[start:end], prepend=0)
+            width = _width(int(deltas.max()))
+            chunk = deltas.astype(_WIDTH_DTYPES[width]).tobytes() + tfs[start:end].tobytes()
+            terms[term] = [offset, int(end - start), width]
+            chunks.append(chunk)
+            offset += len(chunk)
+
+        indexed = doc_lengths[doc_lengths > 0]
+        info = {
+            'tokenizer': tokenizer,
+            'num_docs': len(doc_lengths),
+            'avgdl': float(indexed.mean()) if len(indexed) else 0.0,
+            'k1': BM25_K1,
+            'b': BM25_B,
+            'terms': len(terms),
+            'postings': int(len(doc_ids)),
+            'bytes': offset
+        }
+        postings = np.frombuffer(b''.join(chunks), dtype=np.uint8)
+        logger.info(
+            f"Lexical index built: {len(terms)} terms, {len(doc_ids)} postings, "
+            f"{offset / (1024 * 1024):.1f} MB"
+        )
+        return cls(terms, postings, doc_lengths, info)
+
+    def save(self, checkpoint_dir: str) -> str:
+        """
+        Ghi vào lexical.v<N>/ của version sắp publish: các file ghi trong thư mục tạm rồi đổi tên một lần,
+        reader không bao giờ thấy index ghi dở hay lẫn file của hai version
+        """
+        directory = staged_path(checkpoint_dir, LEXICAL_DIR)
+        tmp_dir = directory + '.tmp'
+        remove_path(tmp_dir)
+        os.makedirs(tmp_dir)
+        self.postings.tofile(os.path.join(tmp_dir, 'postings.bin'))
+        np.save(os.path.join(tmp_dir, 'doc_lengths.npy'), self.doc_lengths)
+        with open(os.path.join(tmp_dir, 'terms.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.terms, f, ensure_ascii=False)
+        with open(os.path.join(tmp_dir, 'info.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.info, f, ensure_ascii=False, indent=2)
+        # Bản staged cũ (build lại trước khi publish) chưa snapshot nào mở
+        remove_path(directory)
+        os.replace(tmp_dir, directory)
+        return directory
+
+    @staticmethod
+    def exists(checkpoint_dir: str, info: Dict = None) -> bool:
+        return os.path.exists(os.path.join(published_path(checkpoint_dir, LEXICAL_DIR, info), 'info.json'))
+
+    @classmethod
+    def load(cls, checkpoint_dir: str, info: Dict = None, latest: bool = False):
+        """info: snapshot.json đã đọc (mở đúng version đó); latest=True: kể cả bản staged chưa publish"""
+        directory = latest_path(checkpoint_dir, LEXICAL_DIR) if latest \
+            else published_path(checkpoint_dir, LEXICAL_DIR, info)
+        with open(os.path.join(directory, 'info.json'), 'r', encoding='utf-8') as f:
+            index_info = json.load(f)
+        with open(os.path.join(directory, 'terms.json'), 'r', encoding='utf-8') as f:
+            terms = json.load(f)
+        postings = np.fromfile(os.path.join(directory, 'postings.bin'), dtype=np.uint8)
+        doc_lengths = np.load(os.path.join(directory, 'doc_lengths.npy'))
+        return cls(terms, postings, doc_lengths, index_info)
+
+    def __len__(self):
+        return self.num_docs
+
+    def posting_list(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Giải nén posting list của một term -> (doc_ids, tfs)"""
+        entry = self.terms.get(term)
+        if entry is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint8)
+        offset, df, width = entry
+        deltas = np.frombuffer(self.postings, dtype=_WIDTH_DTYPES[width], count=df, offset=offset)
+        tfs = self.postings[offset + df * width:offset + df * width + df]
+        return np.cumsum(deltas, dtype=np.int64), tfs
+
+    def search(self, query: str, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """BM25 top_k -> (scores, doc_ids), chỉ gồm các doc khớp ít nhất một term"""
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        matched = False
+        for term, query_tf in Counter(tokenize(query, self.tokenizer)).items():
+            doc_ids, tfs = self.posting_list(term)
+            if len(doc_ids) == 0:
+                continue
+            matched = True
+            idf = math.log(1.0 + (self.num_docs - len(doc_ids) + 0.5) / (len(doc_ids) + 0.5))
+            tfs = tfs.astype(np.float32)
+            norm = self.k1 * (1.0 - self.b + self.b * self.doc_lengths[doc_ids] / self.avgdl)
+            scores[doc_ids] += query_tf * idf * tfs * (self.k1 + 1.0) / (tfs + norm)
+
+        if not matched:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+        top_scores, top_ids = top_k_from_scores(scores, top_k)
+        keep = top_scores > 0
+        return top_scores[keep], top_ids[keep]
@@ -0,0 +1,180 @@
+"""
+Line-offset Index cho đọc sách theo cửa sổ dòng
+- Mỗi sách một mảng offset byte đầu dòng (uint32, int64 nếu file >= 4 GB), build lazily lần đầu đọc
+  và lưu trong line_index/ (npz kèm size / mtime để phát hiện file đã đổi)
+- lines(start_line, count) seek thẳng tới offset rồi chỉ đọc phần byte của cửa sổ
+- Dòng được tách giống open(..., encoding='utf-8').read().split('\\n') (bỏ '\\r' của '\\r\\n')
+- Sách có trong corpus pack (corpus_pack.py) dùng line index đã đóng gói sẵn, không đọc file
+"""
+
+import os
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+LINE_INDEX_DIR = 'line_index'
+READ_CHUNK = 1024 * 1024
+DEFAULT_CACHE_SIZE = 256        # số sách giữ offset trong RAM
+
+
+def offsets_dtype(size: int):
+    return np.uint32 if size < 2 ** 32 else np.int64
+
+
+def line_starts(data: bytes, base: int = 0) -> np.ndarray:
+    """Offset (cộng base) của byte ngay sau mỗi '\\n' trong data"""
+    return np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == ord('\n')).astype(np.int64) + base + 1
+
+
+def build_line_offsets(path: str) -> Tuple[np.ndarray, int, int]:
+    """(offset byte đầu mỗi dòng, size, mtime_ns); số dòng = số '\\n' + 1"""
+    starts = [np.zeros(1, dtype=np.int64)]
+    with open(path, 'rb') as f:
+        stat = os.fstat(f.fileno())
+        base = 0
+        for chunk in iter(lambda: f.read(READ_CHUNK), b''):
+            starts.append(line_starts(chunk, base))
+            base += len(chunk)
+    offsets = np.concatenate(starts)
+    return offsets.astype(offsets_dtype(stat.st_size)), stat.st_size, stat.st_mtime_ns
+
+
+class LineIndex:
+    """Offset đầu dòng của một file: lines(start, count) đọc đúng phần byte cần thiết"""
+
+    def __init__(self, path: str, offsets: np.ndarray, size: int, mtime_ns: int):
+        self.path = path
+        self.offsets = offsets
+        self.size = size
+        self.mtime_ns = mtime_ns
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def byte_range(self, start: int, end: int) -> Tuple[int, int]:
+        """Byte [begin, stop) của các dòng [start, end), không gồm '\\n' cuối"""
+        begin = int(self.offsets[start])
+        stop = int(self.offsets[end]) - 1 if end < len(self.offsets) else self.size
+        return begin, stop
+
+    def read(self, begin: int, stop: int) -> bytes:
+        with open(self.path, 'rb') as f:
+            f.seek(begin)
+            return f.read(stop - begin)
+
+    def lines(self, start: int, count: int) -> List[str]:
+        start = min(max(start, 0), len(self))
+        end = min(start + max(count, 0), len(self))
+        if end <= start:
+            return []
+        lines = self.read(*self.byte_range(start, end)).decode('utf-8', errors='replace').split('\n')
+        return [line[:-1] if line.endswith('\r') else line for line in lines]
+
+
+class LineIndexStore:
+    """
+    Line index của mọi sách trong dataset: RAM (LRU) -> line_index/*.npz -> build từ file
+    Index đã lưu bị bỏ khi size / mtime của file sách khác lúc build
+    """
+
+    def __init__(self, dataset_path: str, cache_dir: str, cache_size: int = DEFAULT_CACHE_SIZE, pack=None):
+        self.dataset_path = dataset_path
+        self.pack = pack
+        self.index_dir = os.path.join(cache_dir, LINE_INDEX_DIR)
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self.builds = 0
+        self.disk_hits = 0
+        self.memory_hits = 0
+
+    def _index_path(self, filename: str) -> str:
+        # Hash tên file: tên sách có dấu / ký tự đặc biệt không ảnh hưởng đường dẫn
+        return os.path.join(self.index_dir, hashlib.sha1(filename.encode('utf-8')).hexdigest()[:20] + '.npz')
+
+    def book_path(self, filename: str) -> Optional[str]:
+        """Đường dẫn file sách, None nếu không có hoặc nằm ngoài dataset"""
+        root = os.path.realpath(self.dataset_path)
+        path = os.path.realpath(os.path.join(root, filename))
+        if not path.startswith(root + os.sep) or not os.path.isfile(path):
+            return None
+        return path
+
+    def stat(self, filename: str) -> Optional[Tuple[int, int]]:
+        """(size, mtime_ns) của sách (bản trong pack nếu có), None nếu không tồn tại"""
+        if self.pack is not None and filename in self.pack:
+            return self.pack.stat(filename)
+        path = self.book_path(filename)
+        if path is None:
+            return None
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime_ns
+
+    def get(self, filename: str, stat: Tuple[int, int] = None) -> Optional[LineIndex]:
+        if self.pack is not None and filename in self.pack:
+            return self.pack.line_index(filename)
+        path = self.book_path(filename)
+        if path is None:
+            return None
+        size, mtime_ns = stat or self.stat(filename)
+
+        with self._lock:
+            index = self._cache.get(filename)
+            if index is not None and index.size == size and index.mtime_ns == mtime_ns:
+                self._cache.move_to_end(filename)
+                self.memory_hits += 1
+                return index
+
+        index = self._load(filename, path, size, mtime_ns)
+        if index is None:
+            offsets, size, mtime_ns = build_line_offsets(path)
+            index = LineIndex(path, offsets, size, mtime_ns)
+            self._save(filename, index)
+            self.builds += 1
+        else:
+            self.disk_hits += 1
+
+        with self._lock:
+            self._cache[filename] = index
+            self._cache.move_to_end(filename)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return index
+
+    def _load(self, filename: str, path: str, size: int, mtime_ns: int) -> Optional[LineIndex]:
+        index_path = self._index_path(filename)
+        if not os.path.exists(index_path):
+            return None
+        try:
+            with np.load(index_path) as data:
+                if int(data['size']) != size or int(data['mtime_ns']) != mtime_ns:
+                    return None
+                return LineIndex(path, data['offsets'], size, mtime_ns)
+        except Exception as e:
+            logger.warning(f"Could not read line index of {filename}: {e}")
+            return None
+
+    def _save(self, filename: str, index: LineIndex):
+        os.makedirs(self.index_dir, exist_ok=True)
+        index_path = self._index_path(filename)
+        tmp_path = index_path + '.tmp.npz'
+        try:
+            np.savez(tmp_path, offsets=index.offsets, size=np.int64(index.size), mtime_ns=np.int64(index.mtime_ns))
+            os.replace(tmp_path, index_path)
+        except OSError as e:
+            logger.warning(f"Could not save line index of {filename}: {e}")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'cached_books': len(self._cache),
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'builds': self.builds
+            }
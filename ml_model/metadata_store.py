@@ -0,0 +1,213 @@
+"""
+Metadata Store (SQLite) cho kết quả search
+Thay metadata.json: chỉ filename / title / cờ deleted nằm trong RAM,
+các field lớn (preview, summary, first_lines...) chỉ được đọc cho top-k kết quả
+Bản mới ghi vào tên có version (metadata.v<N>.sqlite, xem snapshot_files.py), không ghi đè file đang mở
+"""
+
+import os
+import json
+import sqlite3
+import threading
+import numpy as np
+from typing import Dict, Iterable, Iterator, List, Sequence
+import logging
+
+from snapshot_files import latest_path, published_path, staged_path
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+METADATA_DB_FILE = 'metadata.sqlite'
+LEGACY_METADATA_FILE = 'metadata.json'
+FIELDS = ('filename', 'title', 'path', 'preview', 'summary', 'content_length', 'first_lines')
+_JSON_FIELDS = ('first_lines',)
+_COLUMNS = FIELDS + ('deleted',)
+
+
+def _to_row(row_id: int, book: Dict) -> tuple:
+    values = []
+    for field in FIELDS:
+        value = book.get(field)
+        if field in _JSON_FIELDS and value is not None:
+            value = json.dumps(value, ensure_ascii=False)
+        values.append(value)
+    return (row_id, *values, 1 if book.get('deleted') else 0)
+
+
+def _from_row(columns: Sequence[str], values: Sequence) -> Dict:
+    book = {}
+    for field, value in zip(columns, values):
+        if field == 'deleted':
+            if value:
+                book['deleted'] = True
+            continue
+        if field in _JSON_FIELDS and value is not None:
+            value = json.loads(value)
+        if value is not None:
+            book[field] = value
+    return book
+
+
+class MetadataStore:
+    """
+    Metadata theo row (cùng thứ tự với embeddings.npy)
+    store[i] trả về bản nhẹ {'filename', 'title', ('deleted')} từ RAM;
+    fetch(rows, fields) đọc các field còn lại từ SQLite
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        cursor = self._conn.execute('SELECT row, filename, title, deleted FROM books ORDER BY row')
+        self.filenames, self.titles, deleted = [], [], []
+        for row, filename, title, is_deleted in cursor:
+            if row != len(self.filenames):
+                raise ValueError(f"{path}: rows are not contiguous at {row}")
+            self.filenames.append(filename)
+            self.titles.append(title)
+            deleted.append(bool(is_deleted))
+        self.deleted = np.asarray(deleted, dtype=bool)
+        self._rows = {filename: row for row, filename in enumerate(self.filenames)}
+
+    @staticmethod
+    def _create(conn: sqlite3.Connection):
+        conn.execute(
+            'CREATE TABLE books (row INTEGER PRIMARY KEY, '
+            + ', '.join(f'{field} {"INTEGER" if field == "content_length" else "TEXT"}' for field in FIELDS)
+            + ', deleted INTEGER NOT NULL DEFAULT 0)'
+        )
+
+    @classmethod
+    def write(cls, checkpoint_dir: str, metadata: Iterable[Dict], path: str = None) -> 'MetadataStore':
+        """
+        Ghi toàn bộ metadata vào file tạm rồi os.replace (reader cũ không thấy file dở)
+        path mặc định là bản staged của version sắp publish
+        """
+        path = path or staged_path(checkpoint_dir, METADATA_DB_FILE)
+        tmp_path = path + '.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+        conn = sqlite3.connect(tmp_path)
+        try:
+            cls._create(conn)
+            placeholders = ', '.join('?' * (len(_COLUMNS) + 1))
+            conn.executemany(
+                f'INSERT INTO books (row, {", ".join(_COLUMNS)}) VALUES ({placeholders})',
+                (_to_row(row, book) for row, book in enumerate(metadata))
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(tmp_path, path)
+        return cls(path)
+
+    @staticmethod
+    def exists(checkpoint_dir: str, info: Dict = None) -> bool:
+        return (os.path.exists(published_path(checkpoint_dir, METADATA_DB_FILE, info))
+                or os.path.exists(os.path.join(checkpoint_dir, LEGACY_METADATA_FILE)))
+
+    @classmethod
+    def open(cls, checkpoint_dir: str, info: Dict = None, latest: bool = False) -> 'MetadataStore':
+        """
+        Mở store; checkpoint cũ chỉ có metadata.json thì chuyển đổi một lần
+        info: snapshot.json đã đọc (mở đúng version đó); latest=True: kể cả bản staged chưa publish
+        """
+        path = latest_path(checkpoint_dir, METADATA_DB_FILE) if latest \
+            else published_path(checkpoint_dir, METADATA_DB_FILE, info)
+        if not os.path.exists(path):
+            legacy_path = os.path.join(checkpoint_dir, LEGACY_METADATA_FILE)
+            logger.info(f"Converting {legacy_path} to {METADATA_DB_FILE}...")
+            with open(legacy_path, 'r', encoding='utf-8') as f:
+                return cls.write(checkpoint_dir, json.load(f), path=os.path.join(checkpoint_dir, METADATA_DB_FILE))
+        return cls(path)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def __getitem__(self, row: int) -> Dict:
+        book = {'filename': self.filenames[row], 'title': self.titles[row]}
+        if self.deleted[row]:
+            book['deleted'] = True
+        return book
+
+    def __iter__(self) -> Iterator[Dict]:
+        for row in range(len(self)):
+            yield self[row]
+
+    def row_of(self, filename: str):
+        """Row của một sách còn trong index (None nếu không có hoặc đã xóa)"""
+        row = self._rows.get(filename)
+        if row is None or self.deleted[row]:
+            return None
+        return row
+
+    @property
+    def num_deleted(self) -> int:
+        return int(self.deleted.sum())
+
+    def _columns(self, fields: Sequence[str] = None) -> List[str]:
+        if fields is None:
+            return list(_COLUMNS)
+        unknown = [field for field in fields if field not in FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown metadata fields: {unknown} (choose from {list(FIELDS)})")
+        # filename luôn có để client nhận diện sách
+        return ['filename'] + [field for field in fields if field != 'filename'] + ['deleted']
+
+    def fetch(self, rows: Sequence[int], fields: Sequence[str] = None) -> List[Dict]:
+        """Đọc các field (mặc định tất cả) cho danh sách row, giữ đúng thứ tự rows"""
+        rows = [int(row) for row in rows]
+        if not rows:
+            return []
+        columns = self._columns(fields)
+        light = {'filename', 'title', 'deleted'}
+        if set(columns) <= light:
+            # Chỉ cần field thường trú, không chạm SQLite
+            return [{key: value for key, value in self[row].items() if key in columns} for row in rows]
+
+        placeholders = ', '.join('?' * len(rows))
+        with self._lock:
+            cursor = self._conn.execute(
+                f'SELECT row, {", ".join(columns)} FROM books WHERE row IN ({placeholders})', rows
+            )
+            found = {values[0]: _from_row(columns, values[1:]) for values in cursor}
+        return [found[row] for row in rows]
+
+    def iter_records(self, fields: Sequence[str] = None, batch_size: int = 500) -> Iterator[Dict]:
+        """Duyệt toàn bộ record theo thứ tự row, đọc theo lô (dùng khi build index)"""
+        for start in range(0, len(self), batch_size):
+            yield from self.fetch(range(start, min(start + batch_size, len(self))), fields)
+
+    def put(self, row: int, book: Dict):
+        """Ghi đè row có sẵn hoặc append đúng row = len(store)"""
+        if row > len(self):
+            raise IndexError(f"Row {row} would leave a gap after {len(self)} rows")
+        placeholders = ', '.join('?' * (len(_COLUMNS) + 1))
+        with self._lock:
+            self._conn.execute(
+                f'INSERT OR REPLACE INTO books (row, {", ".join(_COLUMNS)}) VALUES ({placeholders})',
+                _to_row(row, book)
+            )
+        is_deleted = bool(book.get('deleted'))
+        if row < len(self) and self._rows.get(self.filenames[row]) == row:
+            del self._rows[self.filenames[row]]
+        self._rows[book.get('filename')] = row
+        if row == len(self):
+            self.filenames.append(book.get('filename'))
+            self.titles.append(book.get('title'))
+            self.deleted = np.append(self.deleted, is_deleted)
+        else:
+            self.filenames[row] = book.get('filename')
+            self.titles[row] = book.get('title')
+            self.deleted[row] = is_deleted
+
+    def commit(self):
+        with self._lock:
+            self._conn.commit()
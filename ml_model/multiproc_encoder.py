@@ -0,0 +1,159 @@
+"""
+Multi-process Encoder cho corpus embedding
+Mỗi worker process có một bản encoder riêng (SentenceTransformer hoặc ONNX) với số intra-op thread cố định;
+các batch được chia cho worker và kết quả trả về đúng thứ tự gửi vào
+"""
+
+import os
+import queue
+import multiprocessing as mp
+from typing import Iterable, Iterator, List, Tuple
+import logging
+
+from onnx_encoder import OnnxEncoder, export_onnx, load_encoder
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+RESULT_TIMEOUT = 5.0
+
+
+def _worker_main(worker_id: int, model_name: str, threads: int, backend: str, onnx_dir: str,
+                 in_queue, out_queue):
+    """Entry point của worker process (spawn): load model một lần rồi encode theo batch"""
+    # Phải set trước khi import torch để MKL/OpenMP không tạo thread cho mọi core
+    for var in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        os.environ[var] = str(threads)
+
+    try:
+        if backend == 'torch':
+            import torch
+            torch.set_num_threads(threads)
+            torch.set_num_interop_threads(1)
+        model = load_encoder(model_name, backend, onnx_dir, threads=threads, device='cpu')
+    except Exception as e:
+        out_queue.put((None, 'error', f"worker {worker_id} failed to start: {e}"))
+        return
+
+    out_queue.put((None, 'ready', worker_id))
+    while True:
+        item = in_queue.get()
+        if item is None:
+            return
+        seq, texts = item
+        try:
+            embeddings = model.encode(texts, batch_size=len(texts), show_progress_bar=False)
+            out_queue.put((seq, 'ok', embeddings))
+        except Exception as e:
+            out_queue.put((seq, 'error', str(e)))
+
+
+class MultiProcessEncoder:
+    """
+    Pool N process encode song song
+    - threads_per_worker: số intra-op thread của torch trong mỗi worker (mặc định chia đều core)
+    - map(): nhận iterator (tag, texts), trả về (tag, embeddings) theo thứ tự đầu vào
+    """
+
+    def __init__(self, model_name: str, num_workers: int, threads_per_worker: int = None,
+                 max_in_flight: int = None, backend: str = 'torch', onnx_dir: str = None):
+        self.model_name = model_name
+        self.backend = backend
+        self.onnx_dir = onnx_dir
+        self.num_workers = max(1, num_workers)
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // self.num_workers)
+        self.max_in_flight = max_in_flight or self.num_workers * 2
+        self._ctx = mp.get_context('spawn')
+        self._in_queue = None
+        self._out_queue = None
+        self._processes = []
+
+    def start(self):
+        """Khởi động worker và chờ tất cả load model xong"""
+        if self._processes:
+            return self
+        # Export ONNX một lần ở process cha, không để các worker export cùng lúc
+        quantized = self.backend == 'onnx-int8'
+        if self.backend != 'torch' and not OnnxEncoder.exists(self.onnx_dir, quantized):
+            export_onnx(self.model_name, self.onnx_dir, quantize=quantized)
+        self._in_queue = self._ctx.Queue()
+        self._out_queue = self._ctx.Queue()
+        for worker_id in range(self.num_workers):
+            process = self._ctx.Process(
+                target=_worker_main,
+                args=(worker_id, self.model_name, self.threads_per_worker, self.backend, self.onnx_dir,
+                      self._in_queue, self._out_queue),
+                name=f'encoder-{worker_id}',
+                daemon=True
+            )
+            process.start()
+            self._processes.append(process)
+
+        ready = 0
+        while ready < self.num_workers:
+            _, status, payload = self._get_result()
+            if status == 'error':
+                self.close()
+                raise RuntimeError(payload)
+            ready += 1
+        logger.info(
+            f"Started {self.num_workers} encoder workers x {self.threads_per_worker} threads "
+            f"({self.model_name}, {self.backend})"
+        )
+        return self
+
+    def _get_result(self) -> Tuple:
+        while True:
+            try:
+                return self._out_queue.get(timeout=RESULT_TIMEOUT)
+            except queue.Empty:
+                dead = [p.name for p in self._processes if not p.is_alive()]
+                if dead:
+                    raise RuntimeError(f"Encoder workers died: {dead}")
+
+    def map(self, batches: Iterable[Tuple[object, List[str]]]) -> Iterator[Tuple[object, object]]:
+        """Encode các batch song song; kết quả yield theo đúng thứ tự batch đầu vào"""
+        self.start()
+        batches = iter(batches)
+        tags = {}
+        done = {}
+        next_seq = 0
+        next_out = 0
+        exhausted = False
+
+        while True:
+            # Giữ tối đa max_in_flight batch đang được encode
+            while not exhausted and next_seq - next_out < self.max_in_flight:
+                try:
+                    tag, texts = next(batches)
+                except StopIteration:
+                    exhausted = True
+                    break
+                tags[next_seq] = tag
+                self._in_queue.put((next_seq, texts))
+                next_seq += 1
+
+            if next_out in done:
+                yield tags.pop(next_out), done.pop(next_out)
+                next_out += 1
+                continue
+
+            if exhausted and next_out == next_seq:
+                return
+
+            seq, status, payload = self._get_result()
+            if status == 'error':
+                raise RuntimeError(f"Encoder worker error: {payload}")
+            done[seq] = payload
+
+    def close(self):
+        """Dừng worker; các batch đang encode dở bị bỏ (chưa commit nên resume sẽ làm lại)"""
+        if not self._processes:
+            return
+        for _ in self._processes:
+            self._in_queue.put(None)
+        for process in self._processes:
+            process.join(timeout=RESULT_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
@@ -0,0 +1,254 @@
+"""
+Encoder backend ONNX Runtime cho CPU inference
+- export_onnx: export transformer của SentenceTransformer sang ONNX một lần (tùy chọn int8 dynamic quantization)
+- OnnxEncoder: cùng interface encode() với SentenceTransformer, pooling làm bằng numpy
+  nên khi chạy không cần import torch
+- compare_backends: đo cosine drift so với PyTorch và latency / throughput của từng backend
+"""
+
+import os
+import json
+import time
+import numpy as np
+from typing import Dict, List
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ENCODER_BACKENDS = ('torch', 'onnx', 'onnx-int8')
+ONNX_DIR = 'onnx'
+MODEL_FILE = 'model.onnx'
+MODEL_INT8_FILE = 'model_int8.onnx'
+EXPORT_INFO_FILE = 'export_info.json'
+REPORT_FILE = 'encoder_report.json'
+OPSET_VERSION = 14
+
+
+def export_onnx(model_name: str, output_dir: str, quantize: bool = True) -> Dict:
+    """
+    Export transformer (input_ids, attention_mask -> last_hidden_state) sang ONNX với batch / seq động
+    Cấu hình pooling, max_seq_length, normalize được lấy từ SentenceTransformer để encode giống hệt
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    os.makedirs(output_dir, exist_ok=True)
+    st_model = SentenceTransformer(model_name, device='cpu')
+    transformer = st_model[0].auto_model.eval()
+    tokenizer = st_model.tokenizer
+    pooling = st_model[1].get_pooling_mode_str() if len(st_model) > 1 else 'mean'
+    normalize = any(type(module).__name__ == 'Normalize' for module in st_model)
+
+    class _Wrapper(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask):
+            return self.model(input_ids=input_ids, attention_mask=attention_mask)[0]
+
+    sample = tokenizer(['xin chào'], return_tensors='pt')
+    model_path = os.path.join(output_dir, MODEL_FILE)
+    with torch.no_grad():
+        torch.onnx.export(
+            _Wrapper(transformer),
+            (sample['input_ids'], sample['attention_mask']),
+            model_path,
+            input_names=['input_ids', 'attention_mask'],
+            output_names=['last_hidden_state'],
+            dynamic_axes={
+                'input_ids': {0: 'batch', 1: 'sequence'},
+                'attention_mask': {0: 'batch', 1: 'sequence'},
+                'last_hidden_state': {0: 'batch', 1: 'sequence'}
+            },
+            opset_version=OPSET_VERSION,
+            do_constant_folding=True
+        )
+    tokenizer.save_pretrained(output_dir)
+    logger.info(f"Exported ONNX model: {model_path}")
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantize_dynamic(model_path, os.path.join(output_dir, MODEL_INT8_FILE), weight_type=QuantType.QInt8)
+        logger.info(f"Quantized ONNX model: {os.path.join(output_dir, MODEL_INT8_FILE)}")
+
+    info = {
+        'model_name': model_name,
+        'pooling': pooling,
+        'normalize': normalize,
+        'max_seq_length': st_model.max_seq_length,
+        'dimension': st_model.get_sentence_embedding_dimension(),
+        'opset': OPSET_VERSION,
+        'quantized': quantize
+    }
+    with open(os.path.join(output_dir, EXPORT_INFO_FILE), 'w', encoding='utf-8') as f:
+        json.dump(info, f, ensure_ascii=False, indent=2)
+    return info
+
+
+class OnnxEncoder:
+    """
+    Encoder ONNX Runtime, dùng thay SentenceTransformer (encode / tokenize / forward)
+    quantized=True dùng model_int8.onnx
+    """
+
+    def __init__(self, model_dir: str, quantized: bool = False, threads: int = None):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        with open(os.path.join(model_dir, EXPORT_INFO_FILE), 'r', encoding='utf-8') as f:
+            self.info = json.load(f)
+        self.model_dir = model_dir
+        self.quantized = quantized
+        self.max_seq_length = self.info['max_seq_length']
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        path = os.path.join(model_dir, MODEL_INT8_FILE if quantized else MODEL_FILE)
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+
+    @staticmethod
+    def exists(model_dir: str, quantized: bool = False) -> bool:
+        return (os.path.exists(os.path.join(model_dir, EXPORT_INFO_FILE))
+                and os.path.exists(os.path.join(model_dir, MODEL_INT8_FILE if quantized else MODEL_FILE)))
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.info['dimension']
+
+    def tokenize(self, texts: List[str]) -> Dict[str, np.ndarray]:
+        encoded = self.tokenizer(
+            texts, padding=True, truncation=True, max_length=self.max_seq_length, return_tensors='np'
+        )
+        return {
+            'input_ids': encoded['input_ids'].astype(np.int64),
+            'attention_mask': encoded['attention_mask'].astype(np.int64)
+        }
+
+    def _pool(self, hidden: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        pooling = self.info['pooling']
+        if pooling == 'cls':
+            embeddings = hidden[:, 0]
+        elif pooling == 'max':
+            embeddings = np.where(mask[:, :, None] > 0, hidden, -1e9).max(axis=1)
+        else:
+            weights = mask[:, :, None].astype(np.float32)
+            embeddings = (hidden * weights).sum(axis=1) / np.maximum(weights.sum(axis=1), 1e-9)
+        if self.info['normalize']:
+            embeddings = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        return embeddings.astype(np.float32)
+
+    def forward(self, features: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        hidden = self.session.run(None, features)[0]
+        return {'sentence_embedding': self._pool(hidden, features['attention_mask'])}
+
+    def encode(self, texts: List[str], batch_size: int = 32, show_progress_bar: bool = False,
+               **kwargs) -> np.ndarray:
+        """Encode như SentenceTransformer.encode: sắp theo độ dài để giảm padding, trả về đúng thứ tự"""
+        if isinstance(texts, str):
+            return self.encode([texts], batch_size)[0]
+        if not texts:
+            return np.zeros((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+
+        order = np.argsort([-len(text) for text in texts], kind='stable')
+        embeddings = np.empty((len(texts), self.get_sentence_embedding_dimension()), dtype=np.float32)
+        for start in range(0, len(texts), batch_size):
+            ids = order[start:start + batch_size]
+            features = self.tokenize([texts[i] for i in ids])
+            embeddings[ids] = self.forward(features)['sentence_embedding']
+        return embeddings
+
+
+def load_encoder(model_name: str, backend: str = 'torch', onnx_dir: str = None,
+                 threads: int = None, device: str = None):
+    """
+    Tạo encoder theo backend; backend ONNX tự export lần đầu nếu onnx_dir chưa có model
+    (export cần torch + sentence_transformers, các lần sau thì không)
+    """
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"Unknown encoder backend: {backend} (choose from {list(ENCODER_BACKENDS)})")
+
+    if backend == 'torch':
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(model_name, device=device)
+
+    quantized = backend == 'onnx-int8'
+    if not OnnxEncoder.exists(onnx_dir, quantized):
+        logger.info(f"No exported ONNX model in {onnx_dir}, exporting {model_name}...")
+        export_onnx(model_name, onnx_dir, quantize=quantized)
+    return OnnxEncoder(onnx_dir, quantized=quantized, threads=threads)
+
+
+def _cosine(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a = a / np.maximum(np.linalg.norm(a, axis=1, keepdims=True), 1e-12)
+    b = b / np.maximum(np.linalg.norm(b, axis=1, keepdims=True), 1e-12)
+    return (a * b).sum(axis=1)
+
+
+def compare_backends(model_name: str, onnx_dir: str, texts: List[str],
+                     backends=ENCODER_BACKENDS, num_queries: int = 50, batch_size: int = 32) -> Dict:
+    """
+    So sánh các backend với PyTorch (chuẩn):
+    - cosine drift (1 - cosine) trung bình / lớn nhất trên texts
+    - load_seconds, latency p50 / p95 khi encode 1 query, throughput khi encode cả texts theo batch
+    Ghi báo cáo vào onnx_dir/encoder_report.json
+    """
+    report = {'model_name': model_name, 'num_texts': len(texts), 'batch_size': batch_size, 'backends': {}}
+    reference = None
+
+    for backend in ('torch',) + tuple(b for b in backends if b != 'torch'):
+        start = time.perf_counter()
+        encoder = load_encoder(model_name, backend, onnx_dir)
+        load_seconds = time.perf_counter() - start
+
+        encoder.encode(texts[:batch_size], batch_size=batch_size)  # warm-up
+        start = time.perf_counter()
+        embeddings = np.asarray(encoder.encode(texts, batch_size=batch_size), dtype=np.float32)
+        batch_seconds = time.perf_counter() - start
+
+        latencies = []
+        for text in texts[:num_queries]:
+            start = time.perf_counter()
+            encoder.encode([text], batch_size=1)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        if reference is None:
+            reference = embeddings
+        drift = 1.0 - _cosine(reference, embeddings)
+        report['backends'][backend] = {
+            'load_seconds': round(load_seconds, 3),
+            'latency_ms_p50': round(float(np.percentile(latencies, 50)), 3),
+            'latency_ms_p95': round(float(np.percentile(latencies, 95)), 3),
+            'texts_per_second': round(len(texts) / batch_seconds, 2) if batch_seconds > 0 else 0.0,
+            'cosine_drift_mean': float(drift.mean()),
+            'cosine_drift_max': float(drift.max())
+        }
+        logger.info(f"{backend}: {report['backends'][backend]}")
+        del encoder
+
+    os.makedirs(onnx_dir, exist_ok=True)
+    with open(os.path.join(onnx_dir, REPORT_FILE), 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    import sys
+
+    from metadata_store import MetadataStore
+    from book_embedding import VietnameseBookEmbedding
+
+    # python onnx_encoder.py [checkpoint_dir]: export (fp32 + int8) rồi so sánh trên text của sách đã index
+    # (cùng dữ liệu với VietnameseBookEmbedding.check_encoder_parity, đọc từ metadata.sqlite)
+    checkpoint_dir = sys.argv[1] if len(sys.argv) > 1 else "../data/checkpoints"
+    model_dir = os.path.join(checkpoint_dir, ONNX_DIR)
+    export_onnx("keepitreal/vietnamese-sbert", model_dir, quantize=True)
+    metadata = MetadataStore.open(checkpoint_dir)
+    rows = [row for row in range(len(metadata)) if not metadata.deleted[row]][:500]
+    texts = [VietnameseBookEmbedding.build_text(book) for book in metadata.fetch(rows, ('title', 'summary', 'preview'))]
+    metadata.close()
+    print(json.dumps(compare_backends("keepitreal/vietnamese-sbert", model_dir, texts), indent=2))
@@ -0,0 +1,273 @@
+"""
+Passage Index cho tìm kiếm sâu trong nội dung sách
+Mỗi sách được chia thành các cửa sổ (passage) chồng lấn theo dòng; mỗi passage lưu:
+- passages/codes.npy: vector int8 (N x D), scale đối xứng theo từng passage
+- passages/scales.npy: float32 (N)
+- passages/book_ids.npy, passages/start_lines.npy: int32 (N)
+- passages/book_offsets.npy: int64 (số sách + 1), passage của sách b là [off[b], off[b+1])
+Passage được ghi theo thứ tự sách nên offset table thay cho dict / list object Python
+- passages/invalid.npy: row sách có passage đã cũ (incremental re-index sửa / thêm / tái dùng row),
+  các passage đó bị bỏ qua khi search cho tới lần build_passages() tiếp theo
+
+Bộ nhớ cho mỗi 1 triệu passage (D = 768): codes 768 MB + scales/book_ids/start_lines 12 MB
+= ~780 MB trên đĩa, mở bằng mmap nên RAM thường trú chỉ là page cache.
+RAM khi query chặn theo block: block_size x D float32 (8192 x 768 = 24 MB) + 2 mảng theo số sách.
+Tổng số passage bị chặn bởi max_passages_per_book x số sách (stride tự nới ra với sách dài).
+Mỗi lần build ghi thư mục mới passages.v<N> (snapshot_files.py), không đổi tên thư mục đang được mmap.
+"""
+
+import os
+import json
+import time
+import numpy as np
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+import logging
+
+from embedding_store import append_rows
+from snapshot_files import latest_path, published_path, remove_path, staged_path
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PASSAGE_DIR = 'passages'
+INFO_FILE = 'passages.json'
+INVALID_FILE = 'invalid.npy'
+WINDOW_CHARS = 1000
+STRIDE_CHARS = 500
+MAX_PASSAGES_PER_BOOK = 256
+DEFAULT_BLOCK_SIZE = 8192
+
+
+def split_passages(text: str, window_chars: int = WINDOW_CHARS, stride_chars: int = STRIDE_CHARS,
+                   max_passages: int = MAX_PASSAGES_PER_BOOK) -> List[Tuple[int, str]]:
+    """
+    Chia nội dung thành các cửa sổ ~window_chars ký tự, gồm nguyên dòng, bắt đầu cách nhau ~stride_chars
+    Trả về [(start_line, passage_text)]; sách dài được nới stride để không vượt max_passages
+    """
+    lines = text.split('\n')
+    starts = np.cumsum([0] + [len(line) + 1 for line in lines])
+    total = int(starts[-1])
+    stride = max(stride_chars, -(-total // max_passages))
+
+    passages = []
+    line = 0
+    while line < len(lines) and len(passages) < max_passages:
+        end = int(np.searchsorted(starts, starts[line] + window_chars, side='left'))
+        end = min(max(end, line + 1), len(lines))
+        passage = '\n'.join(lines[line:end]).strip()
+        if passage:
+            passages.append((line, passage))
+        if end >= len(lines):
+            break
+        line = max(int(np.searchsorted(starts, starts[line] + stride, side='left')), line + 1)
+    return passages
+
+
+def quantize_rows(block: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Lượng tử hóa int8 với scale theo từng dòng (ghi stream được, không cần thấy cả ma trận)"""
+    block = np.asarray(block, dtype=np.float32)
+    scales = np.abs(block).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(block / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def _read_text(path: str):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+    except Exception as e:
+        logger.warning(f"Error reading {path}: {e}")
+        return None
+
+
+def build_passage_index(checkpoint_dir: str, dataset_path: str, metadata: List[Dict],
+                        encode_map: Callable[[Iterable], Iterator], batch_size: int = 256,
+                        window_chars: int = WINDOW_CHARS, stride_chars: int = STRIDE_CHARS,
+                        max_passages_per_book: int = MAX_PASSAGES_PER_BOOK) -> Dict:
+    """
+    Chia và embed passage của mọi sách trong metadata (book_id = row trong metadata)
+    encode_map nhận iterator (tag, texts) và yield (tag, embeddings) theo thứ tự
+    (cùng interface với MultiProcessEncoder.map) nên encode được theo lô lớn / nhiều process
+    Ghi vào thư mục tạm rồi rename thành bản staged của version sắp publish,
+    thư mục của version đang phục vụ không bị đụng tới
+    """
+    directory = staged_path(checkpoint_dir, PASSAGE_DIR)
+    tmp_dir = directory + '.tmp'
+    os.makedirs(tmp_dir, exist_ok=True)
+    started = time.time()
+
+    book_ids, start_lines, scale_parts = [], [], []
+    counts = np.zeros(len(metadata), dtype=np.int64)
+    codes_path = os.path.join(tmp_dir, 'codes.npy')
+    state = {'created': False}
+
+    def batches():
+        pending_tags, pending_texts = [], []
+        for book_id, book in enumerate(metadata):
+            if book.get('deleted'):
+                continue
+            text = _read_text(os.path.join(dataset_path, book['filename']))
+            if text is None:
+                continue
+            for start_line, passage in split_passages(text, window_chars, stride_chars, max_passages_per_book):
+                pending_tags.append((book_id, start_line))
+                pending_texts.append(passage)
+                if len(pending_texts) >= batch_size:
+                    yield pending_tags, pending_texts
+                    pending_tags, pending_texts = [], []
+        if pending_texts:
+            yield pending_tags, pending_texts
+
+    for tags, embeddings in encode_map(batches()):
+        codes, scales = quantize_rows(embeddings)
+        if not state['created']:
+            np.save(codes_path, np.zeros((0, codes.shape[1]), dtype=np.int8))
+            state['created'] = True
+        append_rows(codes_path, codes)
+        scale_parts.append(scales)
+        for book_id, start_line in tags:
+            book_ids.append(book_id)
+            start_lines.append(start_line)
+            counts[book_id] += 1
+
+    if not state['created']:
+        logger.warning("No passages to index")
+        return {}
+
+    offsets = np.zeros(len(metadata) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    np.save(os.path.join(tmp_dir, 'scales.npy'), np.concatenate(scale_parts))
+    np.save(os.path.join(tmp_dir, 'book_ids.npy'), np.asarray(book_ids, dtype=np.int32))
+    np.save(os.path.join(tmp_dir, 'start_lines.npy'), np.asarray(start_lines, dtype=np.int32))
+    np.save(os.path.join(tmp_dir, 'book_offsets.npy'), offsets)
+
+    codes = np.load(codes_path, mmap_mode='r')
+    info = {
+        'passages': int(len(codes)),
+        'books': int((counts > 0).sum()),
+        'dim': int(codes.shape[1]),
+        'window_chars': window_chars,
+        'stride_chars': stride_chars,
+        'max_passages_per_book': max_passages_per_book,
+        'bytes': int(sum(os.path.getsize(os.path.join(tmp_dir, name)) for name in os.listdir(tmp_dir))),
+        'build_seconds': round(time.time() - started, 2)
+    }
+    del codes
+    with open(os.path.join(tmp_dir, INFO_FILE), 'w', encoding='utf-8') as f:
+        json.dump(info, f, ensure_ascii=False, indent=2)
+
+    # Bản staged cũ (build lại trước khi publish) chưa snapshot nào mở
+    remove_path(directory)
+    os.replace(tmp_dir, directory)
+
+    logger.info(f"Passage index saved: {info}")
+    return info
+
+
+def invalidate_books(checkpoint_dir: str, rows: Iterable[int]) -> int:
+    """
+    Đánh dấu passage của các row sách là cũ (nội dung sách đổi hoặc row được gán cho sách khác)
+    Ghi file tạm + os.replace; trả về tổng số row đang bị đánh dấu
+    """
+    directory = latest_path(checkpoint_dir, PASSAGE_DIR)
+    if not os.path.exists(os.path.join(directory, INFO_FILE)):
+        return 0
+    path = os.path.join(directory, INVALID_FILE)
+    invalid = set(np.load(path).tolist()) if os.path.exists(path) else set()
+    invalid.update(int(row) for row in rows)
+    tmp_path = os.path.join(directory, 'invalid.tmp.npy')
+    np.save(tmp_path, np.asarray(sorted(invalid), dtype=np.int64))
+    os.replace(tmp_path, path)
+    return len(invalid)
+
+
+class PassageIndex:
+    """Scoring passage int8 theo block và gộp điểm theo sách (max), kèm dòng của passage tốt nhất"""
+
+    def __init__(self, codes: np.ndarray, scales: np.ndarray, book_ids: np.ndarray,
+                 start_lines: np.ndarray, book_offsets: np.ndarray, info: Dict = None,
+                 block_size: int = DEFAULT_BLOCK_SIZE, invalid_books: np.ndarray = None):
+        self.codes = codes
+        self.scales = scales
+        self.book_ids = book_ids
+        self.start_lines = start_lines
+        self.book_offsets = book_offsets
+        self.info = info or {}
+        self.block_size = block_size
+        # Sách có passage cũ: coi như không có passage
+        self.invalid = np.zeros(self.num_books, dtype=bool)
+        if invalid_books is not None:
+            invalid_books = np.asarray(invalid_books, dtype=np.int64)
+            self.invalid[invalid_books[invalid_books < self.num_books]] = True
+
+    @staticmethod
+    def exists(checkpoint_dir: str, info: Dict = None) -> bool:
+        return os.path.exists(os.path.join(published_path(checkpoint_dir, PASSAGE_DIR, info), INFO_FILE))
+
+    @classmethod
+    def open(cls, checkpoint_dir: str, block_size: int = DEFAULT_BLOCK_SIZE, info: Dict = None):
+        """info: snapshot.json đã đọc (mở đúng version đó)"""
+        directory = published_path(checkpoint_dir, PASSAGE_DIR, info)
+        with open(os.path.join(directory, INFO_FILE), 'r', encoding='utf-8') as f:
+            info = json.load(f)
+        invalid_path = os.path.join(directory, INVALID_FILE)
+        return cls(
+            np.load(os.path.join(directory, 'codes.npy'), mmap_mode='r'),
+            np.load(os.path.join(directory, 'scales.npy'), mmap_mode='r'),
+            np.load(os.path.join(directory, 'book_ids.npy'), mmap_mode='r'),
+            np.load(os.path.join(directory, 'start_lines.npy'), mmap_mode='r'),
+            np.load(os.path.join(directory, 'book_offsets.npy')),
+            info,
+            block_size,
+            np.load(invalid_path) if os.path.exists(invalid_path) else None
+        )
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def num_books(self) -> int:
+        return len(self.book_offsets) - 1
+
+    def _scores(self, start: int, end: int, query: np.ndarray) -> np.ndarray:
+        return (np.asarray(self.codes[start:end], dtype=np.float32) @ query) * self.scales[start:end]
+
+    def book_scores(self, query: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Điểm mỗi sách = điểm passage cao nhất -> (scores, best_rows), độ dài = số sách
+        Sách không có passage có điểm -inf và best_row -1
+        """
+        query = np.asarray(query, dtype=np.float32)
+        scores = np.full(self.num_books, -np.inf, dtype=np.float32)
+        best_rows = np.full(self.num_books, -1, dtype=np.int64)
+
+        for start in range(0, len(self), self.block_size):
+            end = min(start + self.block_size, len(self))
+            block = self._scores(start, end, query)
+            ids = np.asarray(self.book_ids[start:end])
+            # Passage đã sắp theo sách: lấy passage điểm cao nhất của mỗi sách trong block
+            order = np.lexsort((-block, ids))
+            first = order[np.r_[True, ids[order][1:] != ids[order][:-1]]]
+            books = ids[first]
+            better = block[first] > scores[books]
+            scores[books[better]] = block[first][better]
+            best_rows[books[better]] = first[better] + start
+
+        scores[self.invalid] = -np.inf
+        best_rows[self.invalid] = -1
+        return scores, best_rows
+
+    def best_passage(self, book_id: int, query: np.ndarray) -> Tuple[float, int]:
+        """Passage tốt nhất của một sách (qua offset table) -> (score, row), (-inf, -1) nếu không có"""
+        if book_id >= self.num_books or self.invalid[book_id]:
+            return float('-inf'), -1
+        start, end = int(self.book_offsets[book_id]), int(self.book_offsets[book_id + 1])
+        if start == end:
+            return float('-inf'), -1
+        scores = self._scores(start, end, np.asarray(query, dtype=np.float32))
+        best = int(np.argmax(scores))
+        return float(scores[best]), start + best
+
+    def line_of(self, row: int) -> int:
+        return int(self.start_lines[row])
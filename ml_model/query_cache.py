@@ -0,0 +1,322 @@
+"""
+Query Embedding Cache + Micro-batching cho search path
+- QueryEmbeddingCache: LRU + TTL, key = (model name, query đã chuẩn hóa)
+- MicroBatcher: gom các query đến trong vài ms thành một lần encode
+- SearchResultCache: LRU kết quả search theo (index version, query, tham số), tùy chọn chia sẻ qua SQLite
+"""
+
+import json
+import time
+import queue
+import sqlite3
+import threading
+import unicodedata
+import numpy as np
+from collections import OrderedDict, Counter
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query: str) -> str:
+    """Chuẩn hóa Unicode (NFC) và khoảng trắng để các query giống nhau dùng chung cache"""
+    return ' '.join(unicodedata.normalize('NFC', query).split())
+
+
+class QueryEmbeddingCache:
+    """LRU cache có TTL cho query embeddings, thread-safe"""
+
+    def __init__(self, max_size: int = 2048, ttl_seconds: float = 3600):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, model_name: str, query: str) -> Optional[np.ndarray]:
+        key = (model_name, query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                embedding, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return embedding
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, model_name: str, query: str, embedding: np.ndarray):
+        key = (model_name, query)
+        with self._lock:
+            self._entries[key] = (embedding, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / total if total else 0.0
+            }
+
+
+class MicroBatcher:
+    """
+    Gom các lời gọi encode() đồng thời thành một batch
+    Thread nền lấy query đầu tiên, chờ tối đa max_wait_ms để gom thêm rồi encode một lần
+    """
+
+    def __init__(self, encode_fn: Callable[[List[str]], np.ndarray],
+                 max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        self.encode_fn = encode_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+        # Counters
+        self.batches = 0
+        self.queries = 0
+        self.largest_batch = 0
+        self.batch_sizes = Counter()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='query-batcher', daemon=True)
+                self._thread.start()
+
+    def encode(self, text: str) -> np.ndarray:
+        """Encode một query, block cho đến khi batch chứa nó được encode xong"""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((text, future))
+        return future.result()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_ms / 1000.0
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            texts = [text for text, _ in batch]
+            try:
+                embeddings = self.encode_fn(texts)
+                for (_, future), embedding in zip(batch, embeddings):
+                    if not future.done():
+                        future.set_result(embedding)
+            except Exception as e:
+                logger.error(f"Error encoding query batch: {e}")
+                # Future đã có kết quả (hoặc bị cancel) thì set_exception raise, làm chết thread batcher
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+            self.batches += 1
+            self.queries += len(batch)
+            self.largest_batch = max(self.largest_batch, len(batch))
+            self.batch_sizes[len(batch)] += 1
+
+    def stats(self) -> Dict:
+        return {
+            'batches': self.batches,
+            'queries': self.queries,
+            'avg_batch_size': self.queries / self.batches if self.batches else 0.0,
+            'max_batch_size': self.largest_batch,
+            'batch_size_histogram': {str(k): v for k, v in sorted(self.batch_sizes.items())},
+            'pending': self._queue.qsize(),
+            'max_wait_ms': self.max_wait_ms
+        }
+
+
+class SearchResultCache:
+    """
+    LRU cache kết quả search, thread-safe
+    - key gồm query đã chuẩn hóa và mọi tham số ảnh hưởng kết quả (top_k, mode, fields...)
+    - entry gắn với index version; cache chỉ tiến lên version mới hơn (bỏ entry cũ một lần),
+      request còn chạy trên snapshot cũ trong lúc reload được bỏ qua cache thay vì xóa entry của version mới
+    - shared_path: file SQLite dùng chung giữa các worker process trên cùng máy (tầng thứ hai sau RAM)
+    - saved_ms: tổng thời gian search mà các lần hit đã tiết kiệm (theo thời gian đo lúc miss)
+    """
+
+    def __init__(self, max_size: int = 1024, shared_path: str = None, shared_max_size: int = 10000):
+        self.max_size = max_size
+        self.shared_path = shared_path
+        self.shared_max_size = shared_max_size
+        self.version = None
+        self._entries = OrderedDict()
+        self._pruned_version = None     # version đã xóa entry cũ trong SQLite
+        self._shared_puts = 0
+        self.shared_trim_every = max(1, shared_max_size // 10)
+        self._lock = threading.Lock()
+        self._conn = None
+        if shared_path:
+            self._conn = sqlite3.connect(shared_path, timeout=1.0, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS results ('
+                'key TEXT PRIMARY KEY, version INTEGER, value TEXT, cost_ms REAL, created REAL)'
+            )
+            self._conn.commit()
+
+        # Counters
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.bypassed = 0
+        self.saved_ms = 0.0
+
+    @staticmethod
+    def make_key(query: str, params: Dict) -> str:
+        return json.dumps([normalize_query(query), params], sort_keys=True, ensure_ascii=False)
+
+    def _check_version(self, version: int) -> bool:
+        """
+        Gọi trong _lock: version mới hơn thì bỏ toàn bộ entry RAM và chuyển sang version đó
+        Trả về False với version cũ hơn (request trên snapshot cũ): không đọc / ghi cache
+        """
+        if version is None:
+            return False
+        if self.version is None or version > self.version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self.version = version
+        return version == self.version
+
+    def get(self, version: int, key: str) -> Optional[List[Dict]]:
+        with self._lock:
+            if not self._check_version(version):
+                self.bypassed += 1
+                return None
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                results, cost_ms = entry
+                self.hits += 1
+                self.saved_ms += cost_ms
+                return [dict(result) for result in results]
+
+        if self._conn is not None:
+            row = self._shared_get(version, key)
+            if row is not None:
+                results, cost_ms = json.loads(row[0]), row[1]
+                with self._lock:
+                    self.shared_hits += 1
+                    self.saved_ms += cost_ms
+                    self._put_local(version, key, results, cost_ms)
+                return [dict(result) for result in results]
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _put_local(self, version: int, key: str, results: List[Dict], cost_ms: float) -> bool:
+        if not self._check_version(version):
+            return False
+        self._entries[key] = ([dict(result) for result in results], cost_ms)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return True
+
+    def put(self, version: int, key: str, results: List[Dict], cost_ms: float):
+        with self._lock:
+            current = self._put_local(version, key, results, cost_ms)
+        if current and self._conn is not None:
+            self._shared_put(version, key, results, cost_ms)
+
+    def _shared_get(self, version: int, key: str):
+        try:
+            with self._lock:
+                return self._conn.execute(
+                    'SELECT value, cost_ms FROM results WHERE key = ? AND version = ?', (key, version)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Shared result cache read failed: {e}")
+            return None
+
+    def _shared_put(self, version: int, key: str, results: List[Dict], cost_ms: float):
+        try:
+            value = json.dumps(results, ensure_ascii=False)
+            with self._lock:
+                # Entry của version cũ hơn không bao giờ hit nữa -> xóa một lần mỗi khi lên version mới
+                # (chỉ version nhỏ hơn: worker reload sau không xóa entry của worker đã reload trước)
+                if self._pruned_version != version:
+                    self._conn.execute('DELETE FROM results WHERE version < ?', (version,))
+                    self._pruned_version = version
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO results (key, version, value, cost_ms, created) VALUES (?, ?, ?, ?, ?)',
+                    (key, version, value, cost_ms, time.time())
+                )
+                # Giữ khoảng shared_max_size entry mới nhất: cắt mỗi shared_trim_every lần ghi
+                # (giữa hai lần cắt có thể vượt tối đa shared_trim_every entry)
+                self._shared_puts += 1
+                if self._shared_puts % self.shared_trim_every == 0:
+                    self._conn.execute(
+                        'DELETE FROM results WHERE key IN '
+                        '(SELECT key FROM results ORDER BY created DESC LIMIT -1 OFFSET ?)',
+                        (self.shared_max_size,)
+                    )
+                self._conn.commit()
+        except sqlite3.Error as e:
+            # Worker khác đang ghi (database locked): bỏ qua, lần sau ghi lại
+            logger.warning(f"Shared result cache write failed: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._conn is not None:
+                self._conn.execute('DELETE FROM results')
+                self._conn.commit()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                'version': self.version,
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'shared': self.shared_path is not None,
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'bypassed': self.bypassed,
+                'hit_rate': (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+                'saved_ms': round(self.saved_ms, 3)
+            }
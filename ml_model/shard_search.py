@@ -0,0 +1,385 @@
+"""
+Sharded Scatter-Gather Search
+- Ma trận embeddings được chia theo dải row thành N shard, mỗi shard do một worker process phục vụ
+  qua socket (multiprocessing.connection, localhost hoặc máy khác cùng authkey)
+- ShardCoordinator gửi query song song tới mọi shard, mỗi shard có timeout riêng,
+  rồi gộp top-k của từng shard bằng heap
+- Shard trả về id toàn cục (start + id cục bộ) và version index đã load; shard khác version bị bỏ qua
+- ANN index của từng shard được lưu vào shard_indexes/v<version>/<id>-of-<n>/ sau lần build đầu,
+  khởi động lại / reload cùng version chỉ đọc file thay vì build lại từ vector gốc
+"""
+
+import os
+import re
+import heapq
+import shutil
+import queue
+import threading
+import time
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Client, Listener
+from typing import Dict, List, Sequence, Tuple
+import numpy as np
+import logging
+
+from ann_index import INDEX_INFO_FILE, _import_faiss, build_index, load_index
+from embedding_store import EmbeddingStore
+from index_snapshot import read_snapshot_info
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_SHARD_TIMEOUT_MS = 200.0
+START_TIMEOUT = 120.0
+SHARD_INDEX_DIR = 'shard_indexes'
+
+
+def shard_range(num_rows: int, shard_id: int, num_shards: int) -> Tuple[int, int]:
+    """Dải row [start, end) của shard, các shard chênh nhau tối đa 1 row"""
+    base, extra = divmod(num_rows, num_shards)
+    start = shard_id * base + min(shard_id, extra)
+    return start, start + base + (1 if shard_id < extra else 0)
+
+
+def shard_index_dir(checkpoint_dir: str, version: int, shard_id: int, num_shards: int) -> str:
+    """Thư mục chứa ANN index của một shard cho một version"""
+    return os.path.join(checkpoint_dir, SHARD_INDEX_DIR, f'v{version}', f'{shard_id}-of-{num_shards}')
+
+
+def _remove_stale_shard_indexes(checkpoint_dir: str, version: int, shard_id: int, num_shards: int):
+    """Xóa index của shard này ở các version cũ (faiss đọc index vào RAM nên file không bị giữ mở)"""
+    root = os.path.join(checkpoint_dir, SHARD_INDEX_DIR)
+    for name in os.listdir(root):
+        match = re.fullmatch(r'v(\d+)', name)
+        if match is None or int(match.group(1)) == version:
+            continue
+        shutil.rmtree(os.path.join(root, name, f'{shard_id}-of-{num_shards}'), ignore_errors=True)
+        try:
+            os.rmdir(os.path.join(root, name))
+        except OSError:
+            pass    # shard khác chưa dọn xong
+
+
+class _ShardState:
+    """Dữ liệu một shard: dải row, index trên dải đó và version đã load"""
+
+    def __init__(self, checkpoint_dir: str, shard_id: int, num_shards: int, index_type: str,
+                 index_params: Dict, storage: str):
+        # Đọc snapshot.json một lần để version và file embeddings khớp nhau
+        info = read_snapshot_info(checkpoint_dir)
+        version = info.get('version', 0)
+        store = EmbeddingStore.open(checkpoint_dir, 'mmap' if storage == 'memory' else storage, info=info)
+        self.start, self.end = shard_range(len(store), shard_id, num_shards)
+        rows = EmbeddingStore(store.matrix[self.start:self.end], store.scales, store.mode)
+        # flat dùng thẳng dải mmap / lượng tử hóa; faiss add theo block và rerank trên chính dải này
+        self.index = self._load_or_build(checkpoint_dir, version, shard_id, num_shards, rows,
+                                         index_type, index_params)
+        self.version = version
+
+    @staticmethod
+    def _load_or_build(checkpoint_dir: str, version: int, shard_id: int, num_shards: int, rows: EmbeddingStore,
+                       index_type: str, index_params: Dict):
+        if index_type == 'flat':
+            return build_index(rows, 'flat')
+        directory = shard_index_dir(checkpoint_dir, version, shard_id, num_shards)
+        if os.path.exists(os.path.join(directory, INDEX_INFO_FILE)):
+            index = load_index(directory, rows)
+            if index.kind == index_type:
+                return index
+
+        start = time.perf_counter()
+        index = build_index(rows, index_type, **index_params)
+        if index.kind == index_type:
+            os.makedirs(directory, exist_ok=True)
+            index.save(directory)
+            _remove_stale_shard_indexes(checkpoint_dir, version, shard_id, num_shards)
+            logger.info(f"Shard {shard_id}: built and saved {index_type} index for {len(rows)} vectors "
+                        f"in {time.perf_counter() - start:.1f}s")
+        return index
+
+    def search(self, query: np.ndarray, top_k: int, search_params: Dict):
+        scores, ids = self.index.search(query, top_k, **search_params)
+        return scores, ids + self.start
+
+
+def _shard_main(shard_id: int, num_shards: int, checkpoint_dir: str, address, authkey: bytes,
+                index_type: str, index_params: Dict, storage: str, threads: int, ready_queue):
+    """Entry point của shard worker (spawn): load dải row rồi phục vụ search trên socket"""
+    # numpy (và có thể cả faiss) đã được import khi spawn nạp module này nên env var không đổi được
+    # thread pool đã tạo: chỉ có tác dụng với thư viện load sau, giới hạn OpenMP của faiss trực tiếp
+    for var in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        os.environ[var] = str(threads)
+    faiss = _import_faiss()
+    if faiss is not None:
+        faiss.omp_set_num_threads(threads)
+
+    try:
+        state = _ShardState(checkpoint_dir, shard_id, num_shards, index_type, index_params, storage)
+        listener = Listener(address, authkey=authkey)
+    except Exception as e:
+        ready_queue.put((shard_id, 'error', f"shard {shard_id} failed to start: {e}"))
+        return
+    ready_queue.put((shard_id, 'ready', listener.address))
+
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def serve(conn):
+        nonlocal state
+        with conn:
+            while not stop.is_set():
+                try:
+                    command, payload = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    if command == 'search':
+                        query, top_k, search_params = payload
+                        current = state
+                        scores, ids = current.search(query, top_k, search_params)
+                        conn.send(('ok', (current.version, scores, ids)))
+                    elif command == 'reload':
+                        # Load xong bản mới rồi mới thay, query khác vẫn dùng bản cũ trong lúc load
+                        with lock:
+                            state = _ShardState(checkpoint_dir, shard_id, num_shards, index_type,
+                                                index_params, storage)
+                        conn.send(('ok', (state.version, state.start, state.end)))
+                    elif command == 'info':
+                        conn.send(('ok', {'version': state.version, 'start': state.start, 'end': state.end}))
+                    elif command == 'close':
+                        stop.set()
+                        conn.send(('ok', None))
+                        # Mở một kết nối tới chính mình để accept() thoát ra
+                        Client(listener.address, authkey=authkey).close()
+                        return
+                    else:
+                        conn.send(('error', f"Unknown command: {command}"))
+                except Exception as e:
+                    conn.send(('error', str(e)))
+
+    while not stop.is_set():
+        try:
+            conn = listener.accept()
+        except Exception:
+            continue
+        threading.Thread(target=serve, args=(conn,), name=f'shard-{shard_id}-conn', daemon=True).start()
+    listener.close()
+
+
+class _ShardClient:
+    """Pool kết nối tới một shard; kết nối bị timeout thì bỏ (không biết trạng thái)"""
+
+    def __init__(self, shard_id: int, address, authkey: bytes):
+        self.shard_id = shard_id
+        self.address = address
+        self.authkey = authkey
+        self._pool = queue.LifoQueue()
+
+    def request(self, command: str, payload=None, timeout: float = None):
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = Client(self.address, authkey=self.authkey)
+        try:
+            conn.send((command, payload))
+            if timeout is not None and not conn.poll(timeout):
+                conn.close()
+                raise TimeoutError(f"shard {self.shard_id} timed out after {timeout * 1000:.0f} ms")
+            status, result = conn.recv()
+        except TimeoutError:
+            raise
+        except Exception:
+            conn.close()
+            raise
+        self._pool.put(conn)
+        if status != 'ok':
+            raise RuntimeError(f"shard {self.shard_id}: {result}")
+        return result
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class ShardCoordinator:
+    """
+    Scatter-gather qua N shard
+    - addresses=None: tự spawn num_shards worker trên localhost (port do OS chọn)
+    - addresses=[(host, port), ...]: kết nối tới các shard đã chạy sẵn (cùng authkey)
+    - search(): gửi query tới mọi shard song song, shard quá timeout_ms hoặc lệch version bị bỏ qua
+    """
+
+    def __init__(self, checkpoint_dir: str, num_shards: int, index_type: str = 'hnsw',
+                 index_params: Dict = None, storage: str = 'mmap',
+                 timeout_ms: float = DEFAULT_SHARD_TIMEOUT_MS, threads_per_shard: int = None,
+                 addresses: Sequence = None, authkey: bytes = None):
+        self.checkpoint_dir = checkpoint_dir
+        self.num_shards = len(addresses) if addresses else max(1, num_shards)
+        self.index_type = index_type
+        self.index_params = index_params or {}
+        self.storage = storage
+        self.timeout_ms = timeout_ms
+        self.threads_per_shard = threads_per_shard or max(1, (os.cpu_count() or 1) // self.num_shards)
+        self.authkey = authkey or os.urandom(16)
+        self._addresses = list(addresses) if addresses else None
+        self._ctx = mp.get_context('spawn')
+        self._processes = []
+        self._clients = []
+        self._executor = None
+        self._lock = threading.Lock()
+
+        # Counters
+        self.queries = 0
+        self.answered = [0] * self.num_shards
+        self.timeouts = [0] * self.num_shards
+        self.stale = [0] * self.num_shards
+        self.errors = [0] * self.num_shards
+        self.latency_ms = [0.0] * self.num_shards
+
+    def start(self):
+        """Spawn shard worker (nếu chưa có addresses) và chờ tất cả load xong"""
+        if self._clients:
+            return self
+        addresses = self._addresses
+        if addresses is None:
+            ready_queue = self._ctx.Queue()
+            for shard_id in range(self.num_shards):
+                process = self._ctx.Process(
+                    target=_shard_main,
+                    args=(shard_id, self.num_shards, self.checkpoint_dir, ('127.0.0.1', 0), self.authkey,
+                          self.index_type, self.index_params, self.storage, self.threads_per_shard,
+                          ready_queue),
+                    name=f'shard-{shard_id}',
+                    daemon=True
+                )
+                process.start()
+                self._processes.append(process)
+
+            addresses = [None] * self.num_shards
+            deadline = time.monotonic() + START_TIMEOUT
+            for _ in range(self.num_shards):
+                try:
+                    shard_id, status, payload = ready_queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    self.close()
+                    raise RuntimeError(f"Shard workers did not start within {START_TIMEOUT:.0f}s")
+                if status == 'error':
+                    self.close()
+                    raise RuntimeError(payload)
+                addresses[shard_id] = payload
+
+        self._clients = [_ShardClient(shard_id, address, self.authkey) for shard_id, address in enumerate(addresses)]
+        self._executor = ThreadPoolExecutor(max_workers=self.num_shards * 4, thread_name_prefix='shard-query')
+        logger.info(f"Started {self.num_shards} search shards ({self.index_type}): {addresses}")
+        return self
+
+    def reload(self) -> List[Dict]:
+        """Mọi shard load lại dải row của version mới nhất trong checkpoint_dir"""
+        self.start()
+        results = list(self._executor.map(lambda client: client.request('reload'), self._clients))
+        versions = {version for version, _, _ in results}
+        logger.info(f"Shards reloaded, versions {sorted(versions)}")
+        return [{'version': version, 'start': start, 'end': end} for version, start, end in results]
+
+    def _query_shard(self, client: _ShardClient, query: np.ndarray, top_k: int, search_params: Dict,
+                     timeout: float):
+        start = time.perf_counter()
+        result = client.request('search', (query, top_k, search_params), timeout=timeout)
+        return result, (time.perf_counter() - start) * 1000
+
+    def search(self, query: np.ndarray, top_k: int, version: int = None,
+               **search_params) -> Tuple[np.ndarray, np.ndarray, Dict]:
+        """
+        Scatter query tới mọi shard, gather top-k -> (scores, ids, info)
+        info: số shard đã trả lời và danh sách shard timeout / lệch version / lỗi (kết quả khi đó là partial)
+        """
+        self.start()
+        query = np.asarray(query, dtype=np.float32)
+        params = {key: value for key, value in search_params.items() if value is not None}
+        timeout = self.timeout_ms / 1000.0 if self.timeout_ms else None
+        futures = [
+            self._executor.submit(self._query_shard, client, query, top_k, params, timeout)
+            for client in self._clients
+        ]
+
+        info = {'answered': 0, 'timed_out': [], 'stale': [], 'failed': []}
+        heap = []
+        for shard_id, future in enumerate(futures):
+            try:
+                (shard_version, scores, ids), latency = future.result()
+            except TimeoutError:
+                info['timed_out'].append(shard_id)
+                self.timeouts[shard_id] += 1
+                continue
+            except Exception as e:
+                logger.warning(f"Shard {shard_id} search failed: {e}")
+                info['failed'].append(shard_id)
+                self.errors[shard_id] += 1
+                continue
+            if version is not None and shard_version != version:
+                info['stale'].append(shard_id)
+                self.stale[shard_id] += 1
+                continue
+            info['answered'] += 1
+            self.answered[shard_id] += 1
+            self.latency_ms[shard_id] += latency
+            for score, idx in zip(scores, ids):
+                item = (float(score), -int(idx))
+                if len(heap) < top_k:
+                    heapq.heappush(heap, item)
+                elif item > heap[0]:
+                    heapq.heapreplace(heap, item)
+
+        with self._lock:
+            self.queries += 1
+        merged = sorted(heap, reverse=True)
+        scores = np.asarray([score for score, _ in merged], dtype=np.float32)
+        ids = np.asarray([-neg_idx for _, neg_idx in merged], dtype=np.int64)
+        return scores, ids, info
+
+    @property
+    def pids(self) -> List[int]:
+        """PID của các shard worker đã spawn (đo bộ nhớ)"""
+        return [process.pid for process in self._processes]
+
+    def stats(self) -> Dict:
+        return {
+            'num_shards': self.num_shards,
+            'index_type': self.index_type,
+            'timeout_ms': self.timeout_ms,
+            'queries': self.queries,
+            'shards': [
+                {
+                    'answered': self.answered[i],
+                    'timeouts': self.timeouts[i],
+                    'stale': self.stale[i],
+                    'errors': self.errors[i],
+                    'avg_latency_ms': round(self.latency_ms[i] / self.answered[i], 3) if self.answered[i] else 0.0
+                }
+                for i in range(self.num_shards)
+            ]
+        }
+
+    def close(self):
+        """Dừng các shard worker đã spawn (shard chạy sẵn theo addresses thì chỉ đóng kết nối)"""
+        if self._processes:
+            for client in self._clients:
+                try:
+                    client.request('close', timeout=START_TIMEOUT)
+                except Exception:
+                    pass
+            for process in self._processes:
+                process.join(timeout=5.0)
+                if process.is_alive():
+                    process.terminate()
+            self._processes = []
+        for client in self._clients:
+            client.close()
+        self._clients = []
+        if self._executor:
+            self._executor.shutdown(wait=False)
+            self._executor = None
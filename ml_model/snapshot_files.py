@@ -0,0 +1,127 @@
+"""
+File có version của index snapshot
+Windows không cho os.replace / xóa file (hoặc thư mục chứa file) đang được mmap / mở bởi snapshot đang phục vụ,
+nên dữ liệu mới không ghi đè lên tên cũ mà ghi vào tên có version:
+- writer ghi vào staged_path(): embeddings.npy -> embeddings.v<N>.npy, passages -> passages.v<N>
+  với N = version sắp publish (version hiện tại + 1)
+- publish_version (index_snapshot.py) gom mọi file staged của N vào snapshot.json['files']
+  (tên logic -> tên thật), tên logic không có bản mới giữ nguyên file của version trước
+- reader mở published_path(): tên thật theo snapshot.json, checkpoint cũ chưa có 'files' thì dùng tên logic
+- remove_unused_files(): xóa file / thư mục version cũ không còn được snapshot.json hay snapshot đang sống dùng;
+  file còn bị process khác giữ (Windows báo lỗi) được bỏ qua và xóa ở lần dọn sau
+Module này chỉ dùng thư viện chuẩn (embedding_store / metadata_store / passage_index đều import)
+"""
+
+import os
+import re
+import json
+import shutil
+from typing import Dict, Iterable, List
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FILE = 'snapshot.json'
+# <stem>.v<N><ext>; file tạm (.tmp) của writer không bao giờ được coi là bản staged
+_VERSIONED_RE = re.compile(r'^(?P<stem>[^.]+)\.v(?P<version>\d+)(?P<ext>(\.[^.]+)*)$')
+
+
+def read_snapshot_info(checkpoint_dir: str) -> Dict:
+    """Nội dung snapshot.json ({} nếu chưa publish lần nào)"""
+    path = os.path.join(checkpoint_dir, SNAPSHOT_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def versioned_name(name: str, version: int) -> str:
+    """embeddings.npy -> embeddings.v7.npy, passages -> passages.v7"""
+    stem, ext = os.path.splitext(name)
+    return f'{stem}.v{version}{ext}'
+
+
+def parse_versioned(name: str):
+    """Tên thật -> (tên logic, version), None nếu không phải file có version"""
+    match = _VERSIONED_RE.match(name)
+    if match is None or '.tmp' in name:
+        return None
+    return match.group('stem') + match.group('ext'), int(match.group('version'))
+
+
+def published_path(checkpoint_dir: str, name: str, info: Dict = None) -> str:
+    """Đường dẫn thật của tên logic trong version đã publish (info: snapshot.json đã đọc sẵn)"""
+    files = (read_snapshot_info(checkpoint_dir) if info is None else info).get('files', {})
+    return os.path.join(checkpoint_dir, files.get(name, name))
+
+
+def staged_path(checkpoint_dir: str, name: str) -> str:
+    """Đường dẫn ghi bản mới của tên logic cho version sắp publish"""
+    version = read_snapshot_info(checkpoint_dir).get('version', 0) + 1
+    return os.path.join(checkpoint_dir, versioned_name(name, version))
+
+
+def latest_path(checkpoint_dir: str, name: str) -> str:
+    """Bản staged nếu writer đã ghi cho version sắp publish, không thì bản đã publish"""
+    path = staged_path(checkpoint_dir, name)
+    return path if os.path.exists(path) else published_path(checkpoint_dir, name)
+
+
+def staged_files(checkpoint_dir: str, version: int) -> Dict[str, str]:
+    """Tên logic -> tên thật của mọi file / thư mục đã ghi cho version"""
+    files = {}
+    for entry in os.listdir(checkpoint_dir):
+        parsed = parse_versioned(entry)
+        if parsed is not None and parsed[1] == version:
+            files[parsed[0]] = entry
+    return files
+
+
+def remove_path(path: str) -> bool:
+    """Xóa file / thư mục, False nếu còn bị giữ (Windows: đang mmap / mở ở process khác)"""
+    try:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+        return True
+    except OSError as e:
+        logger.debug(f"Cannot remove {path} yet: {e}")
+        return False
+
+
+def remove_unused_files(checkpoint_dir: str, in_use: Iterable[str] = (),
+                        derived: Dict[str, str] = None) -> List[str]:
+    """
+    Xóa file có version (và file tên logic đã được thay bằng bản có version) không còn được dùng
+    in_use: đường dẫn đang được snapshot trong process này giữ
+    derived: tên logic -> tên logic gốc, file dẫn xuất (ví dụ bản lượng tử hóa) sống theo file gốc cùng version
+    File staged của version chưa publish không bao giờ bị xóa
+    """
+    info = read_snapshot_info(checkpoint_dir)
+    current = info.get('version', 0)
+    files = info.get('files', {})
+    keep = set(files.values()) | {os.path.basename(os.path.normpath(path)) for path in in_use}
+    derived = derived or {}
+
+    removed = []
+    for entry in os.listdir(checkpoint_dir):
+        parsed = parse_versioned(entry)
+        if parsed is not None:
+            name, version = parsed
+            if version > current or entry in keep:
+                continue
+            parent = derived.get(name)
+            if parent is not None and versioned_name(parent, version) in keep:
+                continue
+        else:
+            # Tên logic (checkpoint cũ) chỉ bị xóa khi snapshot.json đã trỏ nó (hoặc file gốc) sang bản có version
+            parent = derived.get(entry, entry)
+            if entry in keep or files.get(parent, parent) == parent:
+                continue
+        if remove_path(os.path.join(checkpoint_dir, entry)):
+            removed.append(entry)
+    if removed:
+        logger.info(f"Removed unused index files: {sorted(removed)}")
+    return removed
@@ -0,0 +1,9 @@
+"""
+Test của ml_model: các module import lẫn nhau theo tên (không phải package),
+nên thêm thư mục ml_model vào sys.path giống khi chạy backend / train_offline.py
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,84 @@
+import base64
+import json
+
+import numpy as np
+import pytest
+
+from book_catalog import BookCatalog, SORT_KEYS, build_catalog
+
+
+def _catalog(count=23):
+    rng = np.random.default_rng(0)
+    filenames = [f'sách {i:02d}.txt' for i in range(count)]
+    # Size trùng nhau để kiểm tra tie-break theo filename
+    sizes = rng.integers(0, 5, size=count) * 100
+    return BookCatalog(filenames, sizes, np.zeros(count), np.ones(count), [''] * count, {})
+
+
+def _walk(catalog, sort, order, limit):
+    pages, cursor = [], None
+    while True:
+        result = catalog.list(sort, order, limit=limit, cursor=cursor)
+        pages.append([book['filename'] for book in result['books']])
+        cursor = result['next_cursor']
+        if cursor is None:
+            return pages
+
+
+def _sorted_filenames(catalog, sort, order):
+    key = {
+        'filename': lambda book: (book['filename'], book['filename']),
+        'title': lambda book: (book['title'].casefold(), book['filename']),
+        'size': lambda book: (book['size'], book['filename']),
+    }[sort]
+    books = sorted((catalog.get(filename) for filename in catalog.filenames), key=key, reverse=order == 'desc')
+    return [book['filename'] for book in books]
+
+
+@pytest.mark.parametrize('sort', SORT_KEYS)
+@pytest.mark.parametrize('order', ['asc', 'desc'])
+def test_cursor_pages_cover_catalog_in_order(sort, order):
+    catalog = _catalog()
+    pages = _walk(catalog, sort, order, limit=5)
+    assert [len(page) for page in pages] == [5, 5, 5, 5, 3]
+    assert sum(pages, []) == _sorted_filenames(catalog, sort, order)
+
+
+@pytest.mark.parametrize('order', ['asc', 'desc'])
+def test_cursor_matches_offset_pagination(order):
+    catalog = _catalog()
+    keyset = _walk(catalog, 'size', order, limit=4)
+    offset = [[book['filename'] for book in catalog.list('size', order, limit=4, offset=start)['books']]
+              for start in range(0, len(catalog), 4)]
+    assert keyset == offset
+
+
+def test_cursor_from_another_sort_is_rejected():
+    catalog = _catalog()
+    cursor = catalog.list('title', limit=3)['next_cursor']
+    with pytest.raises(ValueError):
+        catalog.list('size', limit=3, cursor=cursor)
+    # Cursor cũ (chưa có sort key) hoặc key sai kiểu -> ValueError chứ không phải TypeError
+    legacy = base64.urlsafe_b64encode(json.dumps(['sách 01', 'sách 01.txt']).encode('utf-8')).decode('ascii')
+    wrong_type = base64.urlsafe_b64encode(json.dumps(['size', 'abc', 'sách 01.txt']).encode('utf-8')).decode('ascii')
+    for bad in (legacy, wrong_type, 'not-a-cursor'):
+        with pytest.raises(ValueError):
+            catalog.list('size', limit=3, cursor=bad)
+
+
+def test_build_catalog_and_round_trip(tmp_path):
+    dataset = tmp_path / 'dataset'
+    dataset.mkdir()
+    for name, text in (('b.txt', 'Dòng 1\nDòng 2'), ('a.txt', 'Một dòng'), ('skip.md', 'x')):
+        (dataset / name).write_text(text, encoding='utf-8')
+
+    catalog = build_catalog(str(dataset))
+    assert sorted(catalog.filenames) == ['a.txt', 'b.txt']
+    assert catalog.get('b.txt')['total_lines'] == 2
+    assert catalog.get('missing.txt') is None
+
+    path = str(tmp_path / 'catalog.npz')
+    catalog.save(path)
+    loaded = BookCatalog.load(path)
+    assert [loaded.entry(row) for row in range(len(loaded))] == [catalog.entry(row) for row in range(len(catalog))]
+    assert _walk(loaded, 'filename', 'desc', limit=1) == [['b.txt'], ['a.txt']]
@@ -0,0 +1,90 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import checkpoint_store
+from checkpoint_store import ShardedCheckpoint
+from embedding_store import append_rows
+
+
+def _rows(start, count, dim=4):
+    return [np.full(dim, start + i, dtype=np.float32) for i in range(count)]
+
+
+def _books(start, count):
+    return [{'filename': f'book{start + i}.txt', 'title': f'Sách {start + i}'} for i in range(count)]
+
+
+def test_append_commits_across_shards_and_resumes(tmp_path):
+    checkpoint = ShardedCheckpoint(str(tmp_path), shard_size=4)
+    checkpoint.reset([f'book{i}.txt' for i in range(10)])
+    checkpoint.append(_rows(0, 3), _books(0, 3), 0.3)
+    checkpoint.append(_rows(3, 6), _books(3, 6), 0.9)
+
+    resumed = ShardedCheckpoint(str(tmp_path))
+    assert resumed.exists()
+    manifest = resumed.load()
+    assert resumed.committed == 9
+    assert resumed.shard_size == 4
+    assert [shard['rows'] for shard in manifest['shards']] == [4, 4, 1]
+    assert manifest['training_progress'] == 0.9
+    assert resumed.load_plan() == [f'book{i}.txt' for i in range(10)]
+    np.testing.assert_array_equal(np.asarray(resumed.load_embeddings()), np.asarray(_rows(0, 9)))
+    assert resumed.load_metadata() == _books(0, 9)
+    assert not os.path.exists(resumed.manifest_path + '.tmp')
+
+
+def test_resume_ignores_and_truncates_uncommitted_tail(tmp_path):
+    checkpoint = ShardedCheckpoint(str(tmp_path), shard_size=8)
+    checkpoint.reset(['a.txt'])
+    checkpoint.append(_rows(0, 2), _books(0, 2), 0.2)
+
+    # Crash giữa lần save sau: dòng embeddings và metadata đã ghi nhưng manifest chưa commit
+    append_rows(checkpoint._shard_path(0), np.asarray(_rows(100, 3)))
+    with open(checkpoint.metadata_log_path, 'ab') as f:
+        f.write(b'{"filename": "half')
+
+    resumed = ShardedCheckpoint(str(tmp_path))
+    resumed.load()
+    assert len(resumed.load_embeddings()) == 2
+    assert resumed.load_metadata() == _books(0, 2)
+
+    resumed.append(_rows(2, 1), _books(2, 1), 0.3)
+    assert np.load(resumed._shard_path(0), mmap_mode='r').shape == (3, 4)
+    np.testing.assert_array_equal(np.asarray(resumed.load_embeddings()), np.asarray(_rows(0, 3)))
+    assert resumed.load_metadata() == _books(0, 3)
+
+
+def test_failed_append_keeps_previous_commit(tmp_path, monkeypatch):
+    checkpoint = ShardedCheckpoint(str(tmp_path), shard_size=4)
+    checkpoint.reset(['a.txt'])
+    checkpoint.append(_rows(0, 2), _books(0, 2), 0.5)
+    with open(checkpoint.manifest_path, 'r', encoding='utf-8') as f:
+        committed_manifest = json.load(f)
+
+    def failing_append(path, rows):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(checkpoint_store, 'append_rows', failing_append)
+    with pytest.raises(OSError):
+        checkpoint.append(_rows(2, 2), _books(2, 2), 1.0)
+
+    # Manifest trong RAM và trên đĩa vẫn là lần commit trước
+    assert checkpoint.committed == 2
+    with open(checkpoint.manifest_path, 'r', encoding='utf-8') as f:
+        assert json.load(f) == committed_manifest
+    resumed = ShardedCheckpoint(str(tmp_path))
+    resumed.load()
+    assert resumed.committed == 2
+    assert resumed.load_metadata() == _books(0, 2)
+
+
+def test_append_rejects_mismatched_metadata(tmp_path):
+    checkpoint = ShardedCheckpoint(str(tmp_path))
+    with pytest.raises(RuntimeError):
+        checkpoint.append(_rows(0, 1), _books(0, 1), 0.0)
+    checkpoint.reset(['a.txt'])
+    with pytest.raises(ValueError):
+        checkpoint.append(_rows(0, 2), _books(0, 1), 0.0)
@@ -0,0 +1,44 @@
+import os
+
+from corpus_pack import CURRENT_FILE, CorpusPack, open_pack, pack_corpus
+
+
+def _write_books(dataset, books):
+    os.makedirs(dataset, exist_ok=True)
+    for name, text in books.items():
+        with open(os.path.join(dataset, name), 'w', encoding='utf-8') as f:
+            f.write(text)
+
+
+def test_repack_writes_new_version_and_keeps_open_reader(tmp_path):
+    dataset, pack_dir = str(tmp_path / 'dataset'), str(tmp_path / 'pack')
+    _write_books(dataset, {'a.txt': 'dòng 1\ndòng 2', 'b.txt': 'sách b'})
+    pack_corpus(dataset, pack_dir)
+    live = open_pack(pack_dir)
+    assert live.pack_dir == os.path.join(pack_dir, 'v1')
+
+    _write_books(dataset, {'c.txt': 'sách c'})
+    pack_corpus(dataset, pack_dir)
+    assert sorted(os.listdir(pack_dir)) == [CURRENT_FILE, 'v2']
+    assert open_pack(pack_dir).filenames == ['a.txt', 'b.txt', 'c.txt']
+    # Reader đang mở vẫn đọc được bản cũ qua mmap
+    assert live.read_text('a.txt') == 'dòng 1\ndòng 2'
+    assert 'c.txt' not in live
+
+
+def test_legacy_flat_pack_is_still_readable_and_replaced(tmp_path):
+    dataset, pack_dir = str(tmp_path / 'dataset'), str(tmp_path / 'pack')
+    _write_books(dataset, {'a.txt': 'nội dung'})
+    pack_corpus(dataset, pack_dir)
+    # Bố cục cũ: file pack nằm thẳng trong pack_dir, không có current.json
+    version_dir = os.path.join(pack_dir, 'v1')
+    for name in os.listdir(version_dir):
+        os.replace(os.path.join(version_dir, name), os.path.join(pack_dir, name))
+    os.rmdir(version_dir)
+    os.remove(os.path.join(pack_dir, CURRENT_FILE))
+
+    legacy = open_pack(pack_dir)
+    assert legacy.pack_dir == pack_dir and legacy.read_text('a.txt') == 'nội dung'
+    pack_corpus(dataset, pack_dir)
+    assert sorted(os.listdir(pack_dir)) == [CURRENT_FILE, 'v1']
+    assert CorpusPack(pack_dir).read_text('a.txt') == 'nội dung'
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from embedding_store import EmbeddingStore, append_rows, write_rows
+
+
+def test_append_rows_rewrites_header_in_place(tmp_path):
+    path = str(tmp_path / 'embeddings.npy')
+    first = np.random.default_rng(0).standard_normal((3, 8)).astype(np.float32)
+    np.save(path, first)
+    with open(path, 'rb') as f:
+        np.lib.format.read_magic(f)
+        np.lib.format.read_array_header_1_0(f)
+        data_start = f.tell()
+
+    second = np.random.default_rng(1).standard_normal((120, 8)).astype(np.float32)
+    append_rows(path, second)
+    append_rows(path, second[:1])
+
+    matrix = np.load(path, mmap_mode='r')
+    assert matrix.shape == (124, 8)
+    assert matrix.dtype == np.float32
+    np.testing.assert_array_equal(matrix, np.concatenate([first, second, second[:1]]))
+    # Dữ liệu cũ không bị dời: header mới vừa chỗ của header cũ
+    assert matrix.offset == data_start
+
+
+def test_append_rows_converts_dtype_and_skips_empty(tmp_path):
+    path = str(tmp_path / 'embeddings.npy')
+    np.save(path, np.zeros((2, 4), dtype=np.float16))
+    append_rows(path, np.empty((0, 4), dtype=np.float32))
+    append_rows(path, np.ones((2, 4), dtype=np.float64))
+
+    matrix = np.load(path, mmap_mode='r')
+    assert matrix.dtype == np.float16
+    np.testing.assert_array_equal(matrix, np.concatenate([np.zeros((2, 4)), np.ones((2, 4))]))
+
+
+def test_append_rows_rejects_wrong_width(tmp_path):
+    path = str(tmp_path / 'embeddings.npy')
+    np.save(path, np.zeros((2, 4), dtype=np.float32))
+    with pytest.raises(ValueError):
+        append_rows(path, np.zeros((1, 5), dtype=np.float32))
+
+
+def test_write_rows_then_store_search(tmp_path):
+    path = str(tmp_path / 'embeddings.npy')
+    np.save(path, np.zeros((5, 3), dtype=np.float32))
+    write_rows(path, [1, 3], np.asarray([[1, 0, 0], [0, 2, 0]], dtype=np.float32))
+
+    store = EmbeddingStore(np.load(path, mmap_mode='r'), block_size=2)
+    scores, ids = store.search(np.asarray([0, 1, 0], dtype=np.float32), 1)
+    assert ids.tolist() == [3]
+    assert scores.tolist() == [2.0]
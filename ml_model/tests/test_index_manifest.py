@@ -0,0 +1,154 @@
+import os
+import zlib
+
+import numpy as np
+import pytest
+
+from index_manifest import IndexManifest
+
+
+class HashEncoder:
+    """Encoder cố định theo nội dung text (không tải model) cho test training"""
+
+    def encode(self, texts, show_progress_bar=False, batch_size=32, **kwargs):
+        return np.asarray([np.random.default_rng(zlib.crc32(text.encode('utf-8'))).standard_normal(8)
+                           for text in texts], dtype=np.float32)
+
+    def get_sentence_embedding_dimension(self):
+        return 8
+
+
+def _write_book(dataset, name, text):
+    with open(os.path.join(dataset, name), 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+def _make_dataset(dataset, count):
+    os.makedirs(dataset)
+    for i in range(count):
+        _write_book(dataset, f'book{i}.txt', f'Sách {i}\n' + '\n'.join(f'Dòng {j} của sách {i}' for j in range(20)))
+
+
+def test_rebuild_collects_free_rows_and_round_trips(tmp_path):
+    dataset = str(tmp_path / 'dataset')
+    _make_dataset(dataset, 3)
+    metadata = [
+        {'filename': 'book0.txt'},
+        {'filename': 'gone.txt', 'deleted': True},
+        {'filename': 'book1.txt'},
+        {'filename': 'book2.txt'},
+    ]
+    manifest = IndexManifest(str(tmp_path)).rebuild(dataset, metadata)
+    manifest.save()
+
+    loaded = IndexManifest(str(tmp_path)).load()
+    assert loaded.free_rows == [1]
+    assert {name: entry['row'] for name, entry in loaded.entries.items()} == \
+        {'book0.txt': 0, 'book1.txt': 2, 'book2.txt': 3}
+    assert not os.path.exists(loaded.path + '.tmp')
+
+
+def test_diff_hashes_only_changed_files(tmp_path):
+    dataset = str(tmp_path / 'dataset')
+    _make_dataset(dataset, 3)
+    manifest = IndexManifest(str(tmp_path)).rebuild(
+        dataset, [{'filename': f'book{i}.txt'} for i in range(3)]
+    )
+
+    # book0: chỉ touch (mtime đổi, nội dung giữ nguyên); book1: sửa; book2: xóa; new: thêm
+    stat = os.stat(os.path.join(dataset, 'book0.txt'))
+    os.utime(os.path.join(dataset, 'book0.txt'), (stat.st_atime, stat.st_mtime + 10))
+    _write_book(dataset, 'book1.txt', 'nội dung mới')
+    os.remove(os.path.join(dataset, 'book2.txt'))
+    _write_book(dataset, 'new.txt', 'sách mới')
+
+    added, modified, deleted = manifest.diff(dataset)
+    assert (added, modified, deleted) == (['new.txt'], ['book1.txt'], ['book2.txt'])
+    assert manifest.entries['book0.txt']['mtime'] == stat.st_mtime + 10
+
+
+def test_diff_reads_books_from_pack_when_dataset_is_gone(tmp_path):
+    import shutil
+    from corpus_pack import open_pack, pack_corpus
+
+    dataset, pack_dir = str(tmp_path / 'dataset'), str(tmp_path / 'pack')
+    _make_dataset(dataset, 3)
+    pack_corpus(dataset, pack_dir)
+    pack = open_pack(pack_dir)
+    manifest = IndexManifest(str(tmp_path)).rebuild(
+        dataset, [{'filename': f'book{i}.txt'} for i in range(3)], pack
+    )
+    shutil.rmtree(dataset)
+
+    # Corpus chỉ còn trong pack: không đổi gì; book1 ghi lại vào dataset thì bản trong dataset được ưu tiên
+    assert manifest.diff(dataset, pack) == ([], [], [])
+    os.makedirs(dataset)
+    _write_book(dataset, 'book1.txt', 'nội dung mới')
+    assert manifest.diff(dataset, pack) == ([], ['book1.txt'], [])
+
+
+def test_incremental_reuses_free_rows(tmp_path):
+    from book_embedding import VietnameseBookEmbedding
+    from metadata_store import MetadataStore
+    from snapshot_files import published_path
+
+    dataset = str(tmp_path / 'dataset')
+    checkpoint_dir = str(tmp_path / 'checkpoints')
+    _make_dataset(dataset, 6)
+    model = VietnameseBookEmbedding(dataset, checkpoint_dir, index_type='flat', storage='memory')
+    model._model = HashEncoder()
+    model.train(batch_size=4)
+    deleted_row = IndexManifest(checkpoint_dir).load().entries['book2.txt']['row']
+
+    os.remove(os.path.join(dataset, 'book2.txt'))
+    summary = model.train_incremental()
+    assert summary['deleted'] == 1
+    assert IndexManifest(checkpoint_dir).load().free_rows == [deleted_row]
+
+    _write_book(dataset, 'zzz.txt', 'Sách mới\n' + 'nội dung\n' * 20)
+    summary = model.train_incremental()
+    assert summary['added'] == 1
+
+    manifest = IndexManifest(checkpoint_dir).load()
+    assert manifest.entries['zzz.txt']['row'] == deleted_row
+    assert manifest.free_rows == []
+    embeddings = np.load(published_path(checkpoint_dir, 'embeddings.npy'))
+    assert len(embeddings) == 6
+    # Bản của các version trước được xóa sau khi snapshot mới thay thế
+    assert [name for name in os.listdir(checkpoint_dir) if name.startswith('embeddings')] \
+        == [os.path.basename(published_path(checkpoint_dir, 'embeddings.npy'))]
+    metadata = MetadataStore.open(checkpoint_dir)
+    try:
+        assert metadata[deleted_row]['filename'] == 'zzz.txt'
+        assert not metadata.deleted[deleted_row]
+    finally:
+        metadata.close()
+    with model.use_snapshot() as snapshot:
+        assert len(snapshot) == 6
+
+
+def test_failed_publish_keeps_manifest_for_next_run(tmp_path, monkeypatch):
+    import book_embedding
+    from book_embedding import VietnameseBookEmbedding
+
+    dataset = str(tmp_path / 'dataset')
+    checkpoint_dir = str(tmp_path / 'checkpoints')
+    _make_dataset(dataset, 4)
+    model = VietnameseBookEmbedding(dataset, checkpoint_dir, index_type='flat', storage='memory')
+    model._model = HashEncoder()
+    model.train(batch_size=4)
+
+    _write_book(dataset, 'zzz.txt', 'Sách mới\n' + 'nội dung\n' * 20)
+
+    def failing_publish(*args, **kwargs):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(book_embedding, 'publish_version', failing_publish)
+    with pytest.raises(OSError):
+        model.train_incremental()
+    assert 'zzz.txt' not in IndexManifest(checkpoint_dir).load().entries
+
+    monkeypatch.undo()
+    summary = model.train_incremental()
+    assert summary['added'] == 1
+    assert 'zzz.txt' in IndexManifest(checkpoint_dir).load().entries
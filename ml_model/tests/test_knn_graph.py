@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from embedding_store import EmbeddingStore
+from knn_graph import KnnGraph, build_knn_graph
+
+
+def _brute_force_neighbors(embeddings, deleted, k):
+    scores = embeddings @ embeddings.T
+    np.fill_diagonal(scores, -np.inf)
+    scores[:, deleted] = -np.inf
+    ids = np.argsort(-scores, axis=1, kind='stable')[:, :k]
+    return ids, np.take_along_axis(scores, ids, axis=1)
+
+
+@pytest.mark.parametrize('row_block, col_block', [(7, 5), (16, 64), (1024, 4096)])
+def test_blocked_knn_matches_brute_force(tmp_path, row_block, col_block):
+    embeddings = np.random.default_rng(0).standard_normal((53, 12)).astype(np.float32)
+    deleted = np.zeros(len(embeddings), dtype=bool)
+    deleted[[4, 30]] = True
+
+    info = build_knn_graph(str(tmp_path), embeddings, deleted, k=6, row_block=row_block, col_block=col_block)
+    assert info['k'] == 6 and info['count'] == 53
+
+    graph = KnnGraph.open(str(tmp_path), latest=True)
+    expected_ids, expected_scores = _brute_force_neighbors(embeddings, deleted, 6)
+    for row in range(len(embeddings)):
+        ids, scores = graph.neighbors(row)
+        if deleted[row]:
+            assert len(ids) == 0
+            continue
+        # float16 có thể đảo thứ tự hai điểm gần bằng nhau: so sánh tập láng giềng và điểm
+        assert set(ids.tolist()) == set(expected_ids[row].tolist())
+        np.testing.assert_allclose(scores, expected_scores[row], rtol=1e-2, atol=1e-2)
+        assert row not in ids.tolist()
+        assert not deleted[ids].any()
+
+
+def test_knn_on_embedding_store_and_small_corpus(tmp_path):
+    embeddings = np.eye(4, dtype=np.float32) + 0.1
+    store = EmbeddingStore(embeddings, block_size=2)
+    info = build_knn_graph(str(tmp_path), store, k=10)
+    # k bị giới hạn bởi số sách - 1
+    assert info['k'] == 3
+
+    deleted = np.asarray([False, True, True, True])
+    build_knn_graph(str(tmp_path), store, deleted, k=3)
+    graph = KnnGraph.open(str(tmp_path), latest=True)
+    ids, _ = graph.neighbors(0)
+    assert len(ids) == 0
+    assert graph.ids[0].tolist() == [-1, -1, -1]
+    assert graph.neighbors(0, top_k=1)[0].size == 0
+
+
+def test_rebuild_goes_to_new_versioned_dir(tmp_path):
+    from index_snapshot import publish_version
+
+    checkpoint_dir = str(tmp_path)
+    embeddings = np.random.default_rng(1).standard_normal((10, 4)).astype(np.float32)
+    build_knn_graph(checkpoint_dir, embeddings, k=3)
+    assert not KnnGraph.exists(checkpoint_dir)
+    publish_version(checkpoint_dir)
+    live = KnnGraph.open(checkpoint_dir)
+
+    # Build lại không đổi tên / ghi đè thư mục graph đang được mmap
+    build_knn_graph(checkpoint_dir, embeddings, k=2)
+    assert KnnGraph.open(checkpoint_dir).path == live.path
+    assert KnnGraph.open(checkpoint_dir, latest=True).k == 2
+    publish_version(checkpoint_dir)
+    assert KnnGraph.open(checkpoint_dir).k == 2
+    assert live.k == 3 and len(live.neighbors(0)[0]) == 3
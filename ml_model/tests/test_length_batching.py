@@ -0,0 +1,67 @@
+import numpy as np
+
+from length_batching import PaddingStats, bucketed_map, padded_tokens, plan_batches, token_lengths
+
+
+def _encode_map(batches):
+    """encode_map giả lập MultiProcessEncoder.map: (idx, texts) -> (idx, embeddings) theo thứ tự"""
+    for idx, texts in batches:
+        yield idx, np.asarray([[len(text), ord(text[0])] for text in texts], dtype=np.float32)
+
+
+def test_plan_batches_respects_token_budget_and_covers_every_text():
+    lengths = np.random.default_rng(0).integers(1, 200, size=300)
+    batches = plan_batches(lengths, max_batch_tokens=1024, max_batch_size=16)
+
+    covered = np.concatenate(batches)
+    assert sorted(covered.tolist()) == list(range(len(lengths)))
+    for batch in batches:
+        assert len(batch) <= 16
+        assert len(batch) * lengths[batch].max() <= 1024
+    # Sắp theo độ dài nên padding ít hơn batch cố định theo thứ tự dataset
+    fixed = [np.arange(start, min(start + 16, len(lengths))) for start in range(0, len(lengths), 16)]
+    assert padded_tokens(lengths, batches) < padded_tokens(lengths, fixed)
+
+
+def test_text_longer_than_budget_gets_its_own_batch():
+    batches = plan_batches(np.asarray([10, 500, 10]), max_batch_tokens=100)
+    assert [batch.tolist() for batch in batches] == [[1], [0, 2]]
+
+
+def test_bucketed_map_restores_window_order():
+    rng = np.random.default_rng(1)
+    windows = []
+    for tag in range(4):
+        texts = [chr(ord('a') + int(i)) * int(length) for i, length in enumerate(rng.integers(1, 60, size=37))]
+        windows.append((tag, texts))
+
+    def plan(texts):
+        return plan_batches(token_lengths(texts), max_batch_tokens=64)
+
+    results = list(bucketed_map(_encode_map, plan)(iter(windows)))
+    assert [tag for tag, _ in results] == [0, 1, 2, 3]
+    for (_, texts), (_, embeddings) in zip(windows, results):
+        expected = np.asarray([[len(text), ord(text[0])] for text in texts], dtype=np.float32)
+        np.testing.assert_array_equal(embeddings, expected)
+
+
+def test_token_lengths_truncate_to_max_length():
+    lengths = token_lengths(['a' * 8, 'a' * 4000], max_length=256)
+    assert lengths.tolist() == [4, 256]
+
+    def tokenizer(texts, truncation, max_length):
+        return {'input_ids': [list(range(min(len(text.split()), max_length))) for text in texts]}
+
+    assert token_lengths(['một hai ba', 'x ' * 600], tokenizer, max_length=128).tolist() == [3, 128]
+
+
+def test_padding_stats_reports_waste_reduction():
+    lengths = np.asarray([100, 5, 100, 5, 100, 5, 100, 5])
+    stats = PaddingStats()
+    stats.record(lengths, plan_batches(lengths, max_batch_tokens=400), fixed_batch_size=2)
+    report = stats.as_dict()
+    assert report['real_tokens'] == 420
+    assert report['fixed']['padded_tokens'] == 800
+    assert report['bucketed']['padded_tokens'] == 420
+    assert report['bucketed']['padding_waste_pct'] == 0.0
+    assert report['fixed']['padding_waste_pct'] == 47.5
@@ -0,0 +1,95 @@
+import math
+
+import numpy as np
+import pytest
+
+from index_snapshot import publish_version
+from lexical_index import BM25_B, BM25_K1, LexicalIndex, book_text, tokenize
+
+
+def _reference_bm25(docs, query):
+    """BM25 tính trực tiếp trên token của từng doc (không qua posting list nén)"""
+    tokenized = [tokenize(book_text(doc)) if not doc.get('deleted') else [] for doc in docs]
+    lengths = [len(tokens) for tokens in tokenized]
+    indexed = [length for length in lengths if length]
+    avgdl = sum(indexed) / len(indexed)
+    scores = np.zeros(len(docs))
+    for term in set(tokenize(query)):
+        query_tf = tokenize(query).count(term)
+        df = sum(term in tokens for tokens in tokenized)
+        if df == 0:
+            continue
+        idf = math.log(1.0 + (len(docs) - df + 0.5) / (df + 0.5))
+        for doc_id, tokens in enumerate(tokenized):
+            tf = tokens.count(term)
+            if tf:
+                norm = BM25_K1 * (1.0 - BM25_B + BM25_B * lengths[doc_id] / avgdl)
+                scores[doc_id] += query_tf * idf * tf * (BM25_K1 + 1.0) / (tf + norm)
+    return scores
+
+
+DOCS = [
+    {'title': 'Truyện Kiều', 'preview': 'Trăm năm trong cõi người ta, chữ tài chữ mệnh khéo là ghét nhau'},
+    {'title': 'Số Đỏ', 'preview': 'Xuân Tóc Đỏ và những chuyện cười của xã hội'},
+    {'title': 'Đã xóa', 'preview': 'Truyện Kiều bản cũ', 'deleted': True},
+    {'title': 'Dế Mèn phiêu lưu ký', 'preview': 'Dế Mèn đi phiêu lưu khắp nơi, gặp Dế Trũi'},
+    {'title': 'Tắt Đèn', 'preview': 'Chị Dậu và những ngày sưu thuế, truyện về người nông dân'},
+]
+
+
+def test_bm25_matches_reference_scoring():
+    index = LexicalIndex.build(DOCS)
+    for query in ('truyện kiều', 'dế mèn phiêu lưu', 'NGƯỜI', 'đỏ đỏ'):
+        expected = _reference_bm25(DOCS, query)
+        scores, doc_ids = index.search(query, top_k=len(DOCS))
+        assert set(doc_ids.tolist()) == set(np.flatnonzero(expected > 0).tolist())
+        np.testing.assert_allclose(scores, expected[doc_ids], rtol=1e-5)
+        assert list(scores) == sorted(scores, reverse=True)
+
+
+def test_deleted_docs_and_unknown_terms_are_not_returned():
+    index = LexicalIndex.build(DOCS)
+    _, doc_ids = index.search('truyện kiều', top_k=10)
+    assert 2 not in doc_ids.tolist()
+    assert index.doc_lengths[2] == 0
+    scores, doc_ids = index.search('không có từ này', top_k=10)
+    assert len(scores) == 0 and len(doc_ids) == 0
+
+
+@pytest.mark.parametrize('gap, width', [(3, 1), (300, 2), (70000, 4)])
+def test_postings_are_delta_encoded_with_minimal_width(gap, width):
+    num_docs = 3 * gap + 1
+    docs = [{'title': '', 'preview': 'chung'} for _ in range(num_docs)]
+    term_docs = [0, gap, 2 * gap, 3 * gap]
+    for doc_id in term_docs:
+        docs[doc_id] = {'title': '', 'preview': 'hiếm hiếm hiếm'}
+
+    index = LexicalIndex.build(docs)
+    offset, df, stored_width = index.terms['hiếm']
+    assert (df, stored_width) == (len(term_docs), width)
+    # Phần delta: df số nguyên độ rộng width, tiếp theo là df tf uint8
+    deltas = np.frombuffer(index.postings, dtype={1: np.uint8, 2: '<u2', 4: '<u4'}[width], count=df, offset=offset)
+    assert deltas.tolist() == [0, gap, gap, gap]
+
+    doc_ids, tfs = index.posting_list('hiếm')
+    assert doc_ids.tolist() == term_docs
+    assert tfs.tolist() == [3] * len(term_docs)
+
+
+def test_save_load_round_trip(tmp_path):
+    index = LexicalIndex.build(DOCS)
+    index.save(str(tmp_path))
+    # Bản staged chỉ được đọc sau khi publish
+    assert not LexicalIndex.exists(str(tmp_path))
+    assert publish_version(str(tmp_path)) == 1
+    assert LexicalIndex.exists(str(tmp_path))
+
+    loaded = LexicalIndex.load(str(tmp_path))
+    assert len(loaded) == len(DOCS)
+    for term in index.terms:
+        for expected, actual in zip(index.posting_list(term), loaded.posting_list(term)):
+            np.testing.assert_array_equal(expected, actual)
+    expected_scores, expected_ids = index.search('dế mèn', 3)
+    scores, doc_ids = loaded.search('dế mèn', 3)
+    np.testing.assert_array_equal(doc_ids, expected_ids)
+    np.testing.assert_allclose(scores, expected_scores)
@@ -0,0 +1,95 @@
+import os
+
+import numpy as np
+
+from embedding_store import QUANTIZED_FILES, EmbeddingStore
+from index_snapshot import publish_version
+from snapshot_files import (
+    parse_versioned, published_path, read_snapshot_info, remove_unused_files, staged_path, versioned_name
+)
+
+
+def _stage_embeddings(checkpoint_dir, matrix):
+    path = staged_path(checkpoint_dir, 'embeddings.npy')
+    np.save(path, matrix)
+    return path
+
+
+def test_versioned_names_round_trip():
+    assert versioned_name('embeddings.npy', 7) == 'embeddings.v7.npy'
+    assert versioned_name('passages', 7) == 'passages.v7'
+    assert parse_versioned('embeddings.v7.npy') == ('embeddings.npy', 7)
+    assert parse_versioned('passages.v7') == ('passages', 7)
+    assert parse_versioned('embeddings.npy') is None
+    assert parse_versioned('passages.v7.tmp') is None
+
+
+def test_publish_maps_staged_files_and_keeps_older_ones(tmp_path):
+    checkpoint_dir = str(tmp_path)
+    _stage_embeddings(checkpoint_dir, np.ones((2, 4), dtype=np.float32))
+    os.makedirs(staged_path(checkpoint_dir, 'passages'))
+    assert publish_version(checkpoint_dir) == 1
+    assert read_snapshot_info(checkpoint_dir)['files'] == {'embeddings.npy': 'embeddings.v1.npy',
+                                                           'passages': 'passages.v1'}
+
+    # Version 2 chỉ ghi lại embeddings: passages vẫn trỏ về bản của version 1
+    _stage_embeddings(checkpoint_dir, np.zeros((3, 4), dtype=np.float32))
+    assert publish_version(checkpoint_dir) == 2
+    assert read_snapshot_info(checkpoint_dir)['files'] == {'embeddings.npy': 'embeddings.v2.npy',
+                                                           'passages': 'passages.v1'}
+    assert len(np.load(published_path(checkpoint_dir, 'embeddings.npy'))) == 3
+
+
+def test_remove_unused_files_keeps_in_use_and_staged(tmp_path):
+    checkpoint_dir = str(tmp_path)
+    np.save(os.path.join(checkpoint_dir, 'embeddings.npy'), np.ones((2, 4), dtype=np.float32))
+    legacy = EmbeddingStore.open(checkpoint_dir, 'float16')
+    _stage_embeddings(checkpoint_dir, np.ones((2, 4), dtype=np.float32))
+    publish_version(checkpoint_dir)
+    old = EmbeddingStore.open(checkpoint_dir, 'float16')
+    _stage_embeddings(checkpoint_dir, np.ones((2, 4), dtype=np.float32))
+    publish_version(checkpoint_dir)
+    staged = _stage_embeddings(checkpoint_dir, np.ones((2, 4), dtype=np.float32))
+
+    # Snapshot cũ chỉ mmap bản float16 của version 1: file đó được giữ, file gốc của nó thì không
+    assert os.path.basename(legacy.paths[0]) == 'embeddings_fp16.npy'
+    removed = remove_unused_files(checkpoint_dir, old.paths, derived=QUANTIZED_FILES)
+    assert sorted(removed) == ['embeddings.npy', 'embeddings.v1.npy', 'embeddings_fp16.npy']
+    assert sorted(os.listdir(checkpoint_dir)) == ['embeddings.v2.npy', 'embeddings.v3.npy',
+                                                  'embeddings_fp16.v1.npy', 'snapshot.json']
+
+    removed = remove_unused_files(checkpoint_dir, derived=QUANTIZED_FILES)
+    assert removed == ['embeddings_fp16.v1.npy']
+    assert os.path.exists(staged)
+
+
+def _books(count):
+    return [{'filename': f'book{i}.txt', 'title': f'Sách {i}', 'preview': f'nội dung số {i}'} for i in range(count)]
+
+
+def test_load_snapshot_ignores_unpublished_and_mismatched_lexical_index(tmp_path):
+    from index_snapshot import load_snapshot
+    from lexical_index import LexicalIndex
+    from metadata_store import MetadataStore
+
+    checkpoint_dir = str(tmp_path)
+    _stage_embeddings(checkpoint_dir, np.ones((6, 4), dtype=np.float32))
+    MetadataStore.write(checkpoint_dir, _books(6)).close()
+    LexicalIndex.build(_books(6)).save(checkpoint_dir)
+    publish_version(checkpoint_dir)
+
+    # Training đang ghi version 2: snapshot load trong lúc đó vẫn ghép đúng index của version 1
+    LexicalIndex.build(_books(8)).save(checkpoint_dir)
+    snapshot = load_snapshot(checkpoint_dir, load_ann=False)
+    try:
+        assert len(snapshot.lexical_index) == len(snapshot) == 6
+    finally:
+        snapshot.close()
+
+    # Version publish với BM25 lệch số row: chỉ dùng dense search
+    publish_version(checkpoint_dir)
+    snapshot = load_snapshot(checkpoint_dir, load_ann=False)
+    try:
+        assert snapshot.lexical_index is None and len(snapshot) == 6
+    finally:
+        snapshot.close()
@@ -0,0 +1,34 @@
+import json
+import os
+import time
+
+from training_jobs import PAUSED, RUNNING, JobRegistry
+
+
+def _write_registry(path, jobs):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'jobs': jobs}, f)
+
+
+def _running_job(job_id, kind, pid, started_at):
+    return {'id': job_id, 'kind': kind, 'params': {}, 'state': RUNNING, 'created_at': started_at,
+            'started_at': started_at, 'finished_at': None, 'pid': pid, 'limits': None, 'progress': None,
+            'result': None, 'error': None}
+
+
+def test_recover_keeps_jobs_whose_process_is_alive(tmp_path):
+    path = str(tmp_path / 'training_jobs.json')
+    now = time.time()
+    # Process hiện tại đóng vai process job của server trước còn sống; pid 2**22 + 1 không tồn tại
+    _write_registry(path, [_running_job('alive', 'train', os.getpid(), now),
+                           _running_job('gone', 'train', 2 ** 22 + 1, now)])
+
+    registry = JobRegistry(path)
+    alive, gone = registry.get('alive'), registry.get('gone')
+    assert alive['state'] == RUNNING and alive['orphaned']
+    assert gone['state'] == PAUSED and gone['pid'] is None
+    assert registry.recover()
+
+    registry.update('alive', pid=2 ** 22 + 1)
+    assert not registry.recover()
+    assert registry.get('alive')['state'] == PAUSED
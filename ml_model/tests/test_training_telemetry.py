@@ -0,0 +1,27 @@
+import json
+import os
+
+from training_telemetry import TrainingTelemetry
+
+
+def test_log_rotates_and_keeps_backups(tmp_path):
+    log_path = str(tmp_path / 'training_telemetry.jsonl')
+    telemetry = TrainingTelemetry(log_path, max_bytes=1500, backups=2)
+    for _ in range(40):
+        telemetry.maybe_flush(force=True)
+
+    assert sorted(os.listdir(tmp_path)) == ['training_telemetry.jsonl', 'training_telemetry.jsonl.1',
+                                            'training_telemetry.jsonl.2']
+    for name in os.listdir(tmp_path):
+        size = os.path.getsize(tmp_path / name)
+        # Kiểm tra trước khi append: mỗi file vượt max_bytes nhiều nhất một dòng
+        assert size < 1500 * 2
+        with open(tmp_path / name, 'r', encoding='utf-8') as f:
+            assert all(json.loads(line)['timestamp'] for line in f)
+
+
+def test_peak_rss_includes_children_field():
+    snapshot = TrainingTelemetry().as_dict()
+    assert snapshot['peak_rss_children_bytes'] >= 0
+    if snapshot['peak_rss_self_bytes'] is not None:
+        assert snapshot['peak_rss_bytes'] == snapshot['peak_rss_self_bytes'] + snapshot['peak_rss_children_bytes']
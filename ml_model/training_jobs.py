@@ -0,0 +1,502 @@
+"""
+Training Job Manager cho backend
+- Mỗi job (train / incremental / tts) chạy trong một process riêng (spawn), không tranh GIL và thread
+  torch với process web server: giới hạn số core (CPU affinity), số thread OpenMP / MKL / torch, nice
+- Registry job (queued / running / paused / done / failed) lưu trong training_jobs.json, đọc lại khi
+  khởi động: job running mà process (pid trong registry) đã mất được đánh dấu paused (train, resume từ
+  checkpoint) hoặc failed; process còn sống (server trước bị kill) vẫn là running cho tới khi nó thoát
+- Server tắt (atexit, kể cả Flask debug reload): job train được pause để lưu checkpoint, quá SHUTDOWN_GRACE giây
+  hoặc job không pause được thì terminate, không chặn shutdown tới khi training xong
+- Pause cooperative: process cha set Event, job train gọi pause_training() sau batch hiện tại
+  (checkpoint được lưu), resume = xếp lại hàng đợi và train tiếp từ checkpoint
+- Tiến độ gửi về qua multiprocessing.Queue, on_event(job, event, payload) chuyển tiếp (Socket.IO)
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import signal
+import uuid
+import queue
+import threading
+import multiprocessing as mp
+# Import sớm: atexit join process con của multiprocessing phải được đăng ký trước TrainingJobManager.shutdown
+# (atexit chạy ngược thứ tự đăng ký) để shutdown dừng job trước khi bị join
+import multiprocessing.util
+from typing import Callable, Dict, List, Optional
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+JOBS_FILE = 'training_jobs.json'
+QUEUED = 'queued'
+RUNNING = 'running'
+PAUSED = 'paused'
+DONE = 'done'
+FAILED = 'failed'
+ACTIVE_STATES = (QUEUED, RUNNING)
+JOB_KINDS = ('train', 'incremental', 'tts')
+PAUSABLE_KINDS = ('train',)
+MAX_FINISHED_JOBS = 100         # số job đã xong giữ lại trong registry
+EVENT_POLL = 0.5                # giây giữa hai lần kiểm tra process con còn sống
+DEFAULT_NICE = 10
+DEFAULT_STATUS_INTERVAL = 2.0
+SHUTDOWN_GRACE = 10.0           # giây chờ job pause / thoát khi server tắt trước khi terminate
+ORPHAN_POLL = 5.0               # giây giữa hai lần kiểm tra process job của lần chạy trước
+
+
+def default_cpus() -> int:
+    """Mặc định chừa một core cho web server"""
+    return max(1, (os.cpu_count() or 1) - 1)
+
+
+def apply_cpu_limits(cpus: int = 0, threads: int = 0, nice: int = 0) -> Dict:
+    """
+    Giới hạn CPU của process hiện tại, gọi trước khi import torch / numpy để MKL / OpenMP nhận số thread
+    cpus: số core được dùng (các core cuối của affinity hiện tại, core đầu để lại cho web server), 0 = không giới hạn
+    threads: số intra-op thread, 0 = bằng số core được dùng
+    """
+    limits = {'cpus': None, 'threads': None, 'nice': None}
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        allowed = sorted(os.sched_getaffinity(0))
+        chosen = allowed[-cpus:] if cpus < len(allowed) else allowed
+        os.sched_setaffinity(0, chosen)
+        limits['cpus'] = chosen
+    threads = threads or cpus
+    if threads:
+        for var in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+            os.environ[var] = str(threads)
+        limits['threads'] = threads
+    if nice and hasattr(os, 'nice'):
+        limits['nice'] = os.nice(nice)
+    return limits
+
+
+def process_alive(pid: int, started_at: float = None) -> bool:
+    """
+    Process pid còn chạy không (job của lần chạy server trước)
+    started_at: có psutil thì so thời điểm tạo process để không nhầm với process khác dùng lại pid
+    """
+    if not pid:
+        return False
+    try:
+        import psutil
+        try:
+            process = psutil.Process(pid)
+            return process.is_running() and (started_at is None or process.create_time() <= started_at + 1.0)
+        except psutil.Error:
+            return False
+    except ImportError:
+        pass
+    if os.name == 'nt':
+        # os.kill trên Windows kết thúc process: không kiểm tra được thì coi như đã mất
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _set_torch_threads(threads: int):
+    if not threads:
+        return
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+
+def _run_train(config: Dict, params: Dict, emit: Callable, pause_event) -> Dict:
+    from book_embedding import VietnameseBookEmbedding
+
+    model = VietnameseBookEmbedding(**config['model'])
+    interval = config.get('status_interval', DEFAULT_STATUS_INTERVAL)
+    last_emit = [0.0]
+
+    def on_batch(status):
+        # Pause cooperative: dừng sau batch vừa commit, checkpoint được lưu trong pause_training()
+        if pause_event.is_set() and model.is_training:
+            model.pause_training()
+        now = time.time()
+        if now - last_emit[0] >= interval:
+            last_emit[0] = now
+            emit('progress', status)
+
+    completed = model.train(batch_size=params.get('batch_size', 32), save_interval=params.get('save_interval', 50),
+                            on_batch=on_batch, max_batch_tokens=params.get('max_batch_tokens'))
+    emit('progress', model.get_training_status())
+    return {'completed': completed}
+
+
+def _run_incremental(config: Dict, params: Dict, emit: Callable, pause_event) -> Dict:
+    from book_embedding import VietnameseBookEmbedding
+
+    model = VietnameseBookEmbedding(**config['model'])
+    return {'completed': True, 'summary': model.train_incremental(batch_size=params.get('batch_size', 32))}
+
+
+def _run_tts(config: Dict, params: Dict, emit: Callable, pause_event) -> Dict:
+    from vietnamese_tts import VietnameseTTS
+
+    return {'completed': True, 'metadata': VietnameseTTS().train_from_dataset()}
+
+
+JOB_RUNNERS = {
+    'train': _run_train,
+    'incremental': _run_incremental,
+    'tts': _run_tts
+}
+
+
+def _job_main(kind: str, params: Dict, config: Dict, events, pause_event):
+    """Entry point của process job (spawn)"""
+    # terminate() khi server tắt: thoát bằng SystemExit để finally / atexit đóng encoder worker
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+    limits = apply_cpu_limits(config.get('cpus', 0), config.get('threads', 0), config.get('nice', 0))
+    _set_torch_threads(limits['threads'])
+    events.put(('started', {'pid': os.getpid(), 'limits': limits}))
+    try:
+        result = JOB_RUNNERS[kind](config, params, lambda event, payload: events.put((event, payload)), pause_event)
+        events.put(('finished', result))
+    except Exception as e:
+        logger.error(f"Training job {kind} failed: {e}")
+        events.put(('failed', {'error': str(e)}))
+
+
+class JobRegistry:
+    """Danh sách job trong RAM + training_jobs.json (ghi file tạm + os.replace sau mỗi thay đổi)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.jobs: List[Dict] = []
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.jobs = json.load(f)['jobs']
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Could not read {path} ({e}), starting with an empty job registry")
+        self._recover()
+
+    def _recover(self):
+        """
+        Job còn running từ lần chạy trước: process đã mất thì paused / failed
+        Process còn sống (server trước bị kill, process job vẫn chạy) giữ running và được đánh dấu orphaned:
+        resume lúc này sẽ chạy hai trainer trên cùng checkpoint
+        """
+        changed = False
+        for job in self.jobs:
+            if job['state'] != RUNNING:
+                continue
+            if process_alive(job.get('pid'), job.get('started_at')):
+                if not job.get('orphaned'):
+                    logger.warning(f"Training job {job['id']} is still running in process {job['pid']}")
+                    job['orphaned'] = True
+                    changed = True
+                continue
+            job['state'] = PAUSED if job['kind'] in PAUSABLE_KINDS else FAILED
+            job['error'] = 'Interrupted by server restart'
+            job['pid'] = None
+            job['orphaned'] = False
+            changed = True
+        if changed:
+            self._save()
+
+    def recover(self) -> bool:
+        """Kiểm tra lại các job orphaned, trả về True nếu vẫn còn job orphaned đang chạy"""
+        with self._lock:
+            self._recover()
+            return any(job['state'] == RUNNING and job.get('orphaned') for job in self.jobs)
+
+    def _save(self):
+        finished = [job for job in self.jobs if job['state'] in (DONE, FAILED)]
+        if len(finished) > MAX_FINISHED_JOBS:
+            dropped = {job['id'] for job in finished[:len(finished) - MAX_FINISHED_JOBS]}
+            self.jobs = [job for job in self.jobs if job['id'] not in dropped]
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'jobs': self.jobs}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def add(self, kind: str, params: Dict) -> Dict:
+        job = {
+            'id': uuid.uuid4().hex[:12],
+            'kind': kind,
+            'params': params,
+            'state': QUEUED,
+            'created_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+            'pid': None,
+            'limits': None,
+            'progress': None,
+            'result': None,
+            'error': None,
+            'orphaned': False
+        }
+        with self._lock:
+            self.jobs.append(job)
+            self._save()
+            return dict(job)
+
+    def update(self, job_id: str, **fields) -> Dict:
+        with self._lock:
+            job = self._find(job_id)
+            job.update(fields)
+            self._save()
+            return dict(job)
+
+    def _find(self, job_id: str) -> Dict:
+        for job in self.jobs:
+            if job['id'] == job_id:
+                return job
+        raise KeyError(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            try:
+                return dict(self._find(job_id))
+            except KeyError:
+                return None
+
+    def find(self, kinds=None, states=None) -> List[Dict]:
+        """Job theo thứ tự tạo, lọc theo kind / state"""
+        with self._lock:
+            return [
+                dict(job) for job in self.jobs
+                if (kinds is None or job['kind'] in kinds) and (states is None or job['state'] in states)
+            ]
+
+
+class TrainingJobManager:
+    """
+    Hàng đợi job training: chạy lần lượt từng job trong process riêng, thread dispatcher nền
+    đọc event của process con, cập nhật registry và gọi on_event(job, event, payload)
+    event: queued | started | progress | paused | done | failed
+    config: {'model': kwargs của VietnameseBookEmbedding, 'cpus', 'threads', 'nice', 'status_interval'}
+    """
+
+    def __init__(self, registry_path: str, config: Dict, on_event: Callable = None):
+        self.registry = JobRegistry(registry_path)
+        self.config = config
+        self.on_event = on_event
+        self._ctx = mp.get_context('spawn')
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._current = None            # (job_id, process, pause_event)
+        self._status = {}               # job_id -> status đầy đủ gần nhất (registry chỉ giữ bản gọn)
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._dispatch, name='training-jobs', daemon=True)
+                self._thread.start()
+                # Đăng ký sau multiprocessing.util nên chạy trước bước join process con của nó
+                atexit.register(self.shutdown)
+        return self
+
+    def shutdown(self, grace: float = SHUTDOWN_GRACE):
+        """
+        Dừng job đang chạy khi server tắt: job train được pause (checkpoint sau batch hiện tại),
+        quá grace giây hoặc job không pause được thì terminate; job được ghi paused / failed để resume sau
+        """
+        current = self._current
+        if current is None:
+            return
+        job_id, process, pause_event = current
+        job = self.registry.get(job_id)
+        if job is not None and job['kind'] in PAUSABLE_KINDS:
+            pause_event.set()
+            process.join(grace)
+        if process.is_alive():
+            logger.warning(f"Terminating training job {job_id} (process {process.pid}) on shutdown")
+            process.terminate()
+            process.join(grace)
+        with self._lock:
+            job = self.registry.get(job_id)
+            # Dispatcher có thể đã ghi kết quả (pause xong) trước khi tới đây
+            if job is not None and job['state'] == RUNNING:
+                self.registry.update(job_id, state=PAUSED if job['kind'] in PAUSABLE_KINDS else FAILED,
+                                     error='Interrupted by server shutdown', pid=None, finished_at=time.time())
+
+    def submit(self, kind: str, params: Dict = None) -> Dict:
+        """
+        Xếp một job vào hàng đợi; ValueError nếu job cùng loại đang queued / running
+        train: nếu có job train đang paused thì resume job đó (train tiếp từ checkpoint)
+        """
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown job kind: {kind} (choose from {list(JOB_KINDS)})")
+        with self._lock:
+            if self.registry.find([kind], ACTIVE_STATES):
+                raise ValueError(f"A {kind} job is already queued or running")
+            paused = self.registry.find([kind], [PAUSED])
+            if paused:
+                job = self.registry.update(paused[-1]['id'], state=QUEUED, error=None, finished_at=None)
+            else:
+                job = self.registry.add(kind, params or {})
+        self._notify(job, 'queued', {})
+        self.start()
+        self._wake.set()
+        return job
+
+    def pause(self, job_id: str = None) -> Dict:
+        """Pause job đang chạy / đang chờ (mặc định job train đang active); ValueError nếu không pause được"""
+        with self._lock:
+            job = self.registry.get(job_id) if job_id else next(
+                iter(self.registry.find(PAUSABLE_KINDS, ACTIVE_STATES)), None)
+            if job is None or job['state'] not in ACTIVE_STATES:
+                raise ValueError('No training in progress')
+            if job['kind'] not in PAUSABLE_KINDS:
+                raise ValueError(f"{job['kind']} jobs cannot be paused")
+            if job['state'] == QUEUED:
+                job = self.registry.update(job['id'], state=PAUSED)
+                self._notify(job, 'paused', {})
+                return job
+            if job.get('orphaned'):
+                raise ValueError(f"Job {job['id']} runs in process {job['pid']} started by a previous server")
+            current = self._current
+            if current is not None and current[0] == job['id']:
+                current[2].set()
+            return dict(job, pause_requested=True)
+
+    def resume(self, job_id: str) -> Dict:
+        with self._lock:
+            job = self.registry.get(job_id)
+            if job is None or job['state'] != PAUSED:
+                raise ValueError(f"Job {job_id} is not paused")
+            if self.registry.find([job['kind']], ACTIVE_STATES):
+                raise ValueError(f"A {job['kind']} job is already queued or running")
+            job = self.registry.update(job_id, state=QUEUED, error=None, finished_at=None)
+        self._notify(job, 'queued', {})
+        self.start()
+        self._wake.set()
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        return self.registry.get(job_id)
+
+    def jobs(self) -> List[Dict]:
+        return self.registry.find()
+
+    def active(self, kinds=None) -> Optional[Dict]:
+        """Job queued / running đầu tiên (lọc theo kind)"""
+        return next(iter(self.registry.find(kinds, ACTIVE_STATES)), None)
+
+    def latest(self, kinds=None) -> Optional[Dict]:
+        """Job tạo gần nhất (lọc theo kind), bất kể state"""
+        jobs = self.registry.find(kinds)
+        return jobs[-1] if jobs else None
+
+    def last_status(self, job_id: str) -> Optional[Dict]:
+        """Status đầy đủ (get_training_status của process con) gửi về gần nhất"""
+        return self._status.get(job_id)
+
+    def _notify(self, job: Dict, event: str, payload: Dict):
+        if self.on_event is None:
+            return
+        try:
+            self.on_event(job, event, payload)
+        except Exception as e:
+            logger.warning(f"Job event handler failed ({event}): {e}")
+
+    def _dispatch(self):
+        while True:
+            # Job orphaned (process của server trước) còn chạy: chưa chạy job mới trên cùng checkpoint
+            if self.registry.recover():
+                self._wake.wait(ORPHAN_POLL)
+                self._wake.clear()
+                continue
+            queued = self.registry.find(states=[QUEUED])
+            if not queued:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            try:
+                self._run(queued[0])
+            except Exception as e:
+                logger.error(f"Training job {queued[0]['id']} could not run: {e}")
+                job = self.registry.update(queued[0]['id'], state=FAILED, error=str(e), finished_at=time.time())
+                self._notify(job, 'failed', {'error': str(e)})
+
+    def _run(self, job: Dict):
+        events = self._ctx.Queue()
+        pause_event = self._ctx.Event()
+        # Không daemon: job train có thể tự mở process encode (encode_workers > 1); shutdown() dừng nó khi server tắt
+        process = self._ctx.Process(
+            target=_job_main, args=(job['kind'], job['params'], self.config, events, pause_event),
+            name=f"training-job-{job['id']}"
+        )
+        process.start()
+        with self._lock:
+            self._current = (job['id'], process, pause_event)
+            job = self.registry.update(job['id'], state=RUNNING, pid=process.pid, started_at=time.time())
+        logger.info(f"Training job {job['id']} ({job['kind']}) started in process {process.pid}")
+
+        finished = False
+        while not finished:
+            try:
+                event, payload = events.get(timeout=EVENT_POLL)
+            except queue.Empty:
+                if process.is_alive():
+                    continue
+                # Process đã thoát: đọc nốt event còn trong queue
+                try:
+                    event, payload = events.get(timeout=EVENT_POLL)
+                except queue.Empty:
+                    error = f"Job process exited with code {process.exitcode}"
+                    job = self.registry.update(job['id'], state=FAILED, error=error, finished_at=time.time())
+                    self._notify(job, 'failed', {'error': error})
+                    break
+            finished = self._handle(job['id'], event, payload)
+
+        process.join()
+        with self._lock:
+            self._current = None
+
+    def _handle(self, job_id: str, event: str, payload: Dict) -> bool:
+        """Xử lý một event của process con, trả về True khi job kết thúc"""
+        if event == 'started':
+            job = self.registry.update(job_id, limits=payload['limits'])
+            self._notify(job, 'started', payload)
+            return False
+        if event == 'progress':
+            self._status[job_id] = payload
+            progress = {key: payload.get(key) for key in ('progress', 'current_index', 'total_books')}
+            job = self.registry.update(job_id, progress=progress)
+            self._notify(job, 'progress', payload)
+            return False
+        if event == 'finished':
+            state = DONE if payload.get('completed') else PAUSED
+            job = self.registry.update(job_id, state=state, result=payload, pid=None, finished_at=time.time())
+            logger.info(f"Training job {job_id} {state}")
+            self._notify(job, 'done' if state == DONE else 'paused', payload)
+            return True
+        if event == 'failed':
+            job = self.registry.update(job_id, state=FAILED, error=payload['error'], pid=None,
+                                       finished_at=time.time())
+            self._notify(job, 'failed', payload)
+            return True
+        logger.warning(f"Unknown training job event: {event}")
+        return False
+
+    def stats(self) -> Dict:
+        jobs = self.registry.find()
+        counts = {}
+        for job in jobs:
+            counts[job['state']] = counts.get(job['state'], 0) + 1
+        current = self._current
+        return {
+            'jobs': counts,
+            'running': current[0] if current else None,
+            'pid': current[1].pid if current else None,
+            'limits': {key: self.config.get(key) for key in ('cpus', 'threads', 'nice')}
+        }
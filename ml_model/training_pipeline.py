@@ -0,0 +1,247 @@
+"""
+Training Pipeline nhiều stage chạy song song
+read/build text -> tokenize -> encode, nối với nhau bằng queue có giới hạn
+Checkpoint được ghi bởi một writer thread nền nên không chặn forward pass
+Thời gian xử lý từng item của mỗi stage được ghi vào TrainingTelemetry (nếu có)
+"""
+
+import time
+import queue
+import threading
+from typing import Callable, Dict, Iterator
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class _StageError:
+    """Bọc exception của một stage để chuyển tiếp xuống consumer"""
+
+    def __init__(self, error: Exception):
+        self.error = error
+
+
+class PipelineStage(threading.Thread):
+    """Một stage: lấy item từ in_queue (hoặc iterator nguồn), xử lý, đẩy sang out_queue"""
+
+    def __init__(self, name: str, fn: Callable, in_queue: queue.Queue, out_queue: queue.Queue,
+                 stop_event: threading.Event, source: Iterator = None, telemetry=None):
+        super().__init__(name=f'pipeline-{name}', daemon=True)
+        self.stage_name = name
+        self.fn = fn
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        self.stop_event = stop_event
+        self.source = source
+        self.telemetry = telemetry
+
+        # Stats
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.started_at = None
+
+    def _put(self, item) -> bool:
+        # Put có timeout để stage dừng được khi pipeline bị đóng lúc queue đang đầy
+        while not self.stop_event.is_set():
+            try:
+                self.out_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _next(self):
+        if self.source is not None:
+            return next(self.source, _DONE)
+        while not self.stop_event.is_set():
+            try:
+                return self.in_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def run(self):
+        self.started_at = time.time()
+        try:
+            while not self.stop_event.is_set():
+                start = time.perf_counter()
+                item = self._next()
+                if self.source is None:
+                    # Stage giữa: không tính thời gian chờ stage trước vào busy time
+                    start = time.perf_counter()
+                if item is _DONE or isinstance(item, _StageError):
+                    self._put(item)
+                    return
+                tag, payload = item
+                result = self.fn(payload) if self.fn else payload
+                seconds = time.perf_counter() - start
+                self.busy_seconds += seconds
+                self.items += 1
+                if self.telemetry is not None:
+                    self.telemetry.record(self.stage_name, seconds)
+                if not self._put((tag, result)):
+                    return
+        except Exception as e:
+            logger.error(f"Pipeline stage {self.stage_name} failed: {e}")
+            self._put(_StageError(e))
+
+    def stats(self) -> Dict:
+        elapsed = time.time() - self.started_at if self.started_at else 0.0
+        return {
+            'items': self.items,
+            'items_per_second': round(self.items / elapsed, 2) if elapsed > 0 else 0.0,
+            'busy_pct': round(100.0 * self.busy_seconds / elapsed, 1) if elapsed > 0 else 0.0,
+            'out_queue_depth': self.out_queue.qsize()
+        }
+
+
+class MapStage(PipelineStage):
+    """
+    Stage dạng map trên cả stream (ví dụ encoder nhiều process giữ nhiều batch đang xử lý)
+    map_fn nhận iterator (tag, payload) và yield (tag, result) theo đúng thứ tự
+    """
+
+    def __init__(self, name: str, map_fn: Callable, in_queue: queue.Queue, out_queue: queue.Queue,
+                 stop_event: threading.Event, telemetry=None):
+        super().__init__(name, None, in_queue, out_queue, stop_event, telemetry=telemetry)
+        self.map_fn = map_fn
+        self._end = _DONE
+        self._waiting_seconds = 0.0
+
+    def _inputs(self):
+        while True:
+            start = time.perf_counter()
+            item = self._next()
+            self._waiting_seconds += time.perf_counter() - start
+            if item is _DONE or isinstance(item, _StageError):
+                self._end = item
+                return
+            yield item
+
+    def run(self):
+        self.started_at = time.time()
+        start = time.perf_counter()
+        try:
+            for item in self.map_fn(self._inputs()):
+                self.items += 1
+                busy_seconds = time.perf_counter() - start - self._waiting_seconds
+                if self.telemetry is not None:
+                    # Thời gian giữa hai output liên tiếp, không tính lúc chờ stage trước
+                    self.telemetry.record(self.stage_name, max(busy_seconds - self.busy_seconds, 0.0))
+                self.busy_seconds = busy_seconds
+                if not self._put(item):
+                    return
+            self._put(self._end)
+        except Exception as e:
+            logger.error(f"Pipeline stage {self.stage_name} failed: {e}")
+            self._put(_StageError(e))
+
+
+class TrainingPipeline:
+    """
+    Pipeline 3 stage: prefetch/build text -> tokenize -> encode
+    source yield (tag, texts); iterate pipeline nhận (tag, embeddings) theo đúng thứ tự
+    Nếu có encode_map (encoder nhiều process), tokenize + encode gộp thành một MapStage
+    """
+
+    def __init__(self, source: Iterator, tokenize_fn: Callable, encode_fn: Callable, queue_size: int = 4,
+                 encode_map: Callable = None, telemetry=None):
+        self.stop_event = threading.Event()
+        if encode_map is not None:
+            self.queues = [queue.Queue(maxsize=queue_size) for _ in range(2)]
+            self.stages = [
+                PipelineStage('read', None, None, self.queues[0], self.stop_event, source=source,
+                              telemetry=telemetry),
+                MapStage('encode', encode_map, self.queues[0], self.queues[1], self.stop_event, telemetry=telemetry),
+            ]
+        else:
+            self.queues = [queue.Queue(maxsize=queue_size) for _ in range(3)]
+            self.stages = [
+                PipelineStage('read', None, None, self.queues[0], self.stop_event, source=source,
+                              telemetry=telemetry),
+                PipelineStage('tokenize', tokenize_fn, self.queues[0], self.queues[1], self.stop_event,
+                              telemetry=telemetry),
+                PipelineStage('encode', encode_fn, self.queues[1], self.queues[2], self.stop_event,
+                              telemetry=telemetry),
+            ]
+        for stage in self.stages:
+            stage.start()
+
+    def __iter__(self):
+        while True:
+            try:
+                item = self.queues[-1].get(timeout=0.1)
+            except queue.Empty:
+                if self.stop_event.is_set():
+                    return
+                continue
+            if item is _DONE:
+                return
+            if isinstance(item, _StageError):
+                raise item.error
+            yield item
+
+    def close(self):
+        """Dừng tất cả stage (pause) và chờ các thread kết thúc"""
+        self.stop_event.set()
+        for stage in self.stages:
+            stage.join()
+
+    def stats(self) -> Dict:
+        return {stage.stage_name: stage.stats() for stage in self.stages}
+
+    def format_stats(self) -> str:
+        return ' | '.join(
+            f"{name} {s['items_per_second']:.1f}/s q={s['out_queue_depth']}"
+            for name, s in self.stats().items()
+        )
+
+
+class CheckpointWriter:
+    """
+    Ghi checkpoint trên thread nền; các yêu cầu dồn lại khi đang ghi được gộp thành một
+    (save_checkpoint chỉ ghi phần mới nên gộp không làm mất dữ liệu)
+    """
+
+    def __init__(self, save_fn: Callable):
+        self.save_fn = save_fn
+        self._requested = threading.Event()
+        self._stopped = False
+        self.saves = 0
+        self.save_seconds = 0.0
+        self.last_error = None
+        self._thread = threading.Thread(target=self._run, name='checkpoint-writer', daemon=True)
+        self._thread.start()
+
+    def request(self):
+        self._requested.set()
+
+    def _run(self):
+        while True:
+            self._requested.wait()
+            self._requested.clear()
+            if self._stopped:
+                return
+            start = time.perf_counter()
+            try:
+                self.save_fn()
+                self.saves += 1
+            except Exception as e:
+                self.last_error = e
+                logger.error(f"Background checkpoint failed: {e}")
+            self.save_seconds += time.perf_counter() - start
+
+    def close(self):
+        """Chờ lần ghi đang chạy (nếu có) rồi dừng writer"""
+        self._stopped = True
+        self._requested.set()
+        self._thread.join()
+
+    def stats(self) -> Dict:
+        return {
+            'saves': self.saves,
+            'avg_save_seconds': round(self.save_seconds / self.saves, 4) if self.saves else 0.0
+        }
@@ -0,0 +1,267 @@
+"""
+Training Telemetry theo từng stage
+- Timer + histogram (bucket log2, ms) cho read / tokenize / encode / commit / checkpoint
+- Books/s, tokens/s, peak RSS (process train + các process con, ví dụ encoder --workers), thời gian ghi checkpoint
+- Ghi snapshot ra file JSONL (append) tối đa một lần mỗi interval giây thay vì ghi lại JSON sau mỗi batch;
+  file vượt max_bytes thì xoay vòng sang .1, .2 ... (giữ tối đa backups file cũ)
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from typing import Dict
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+TELEMETRY_FILE = 'training_telemetry.jsonl'
+DEFAULT_INTERVAL = 5.0
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024      # kích thước tối đa của training_telemetry.jsonl trước khi xoay vòng
+DEFAULT_BACKUPS = 2
+# Cận trên các bucket (ms): 0.25, 0.5, 1, 2, ... ~ 67 giây, thêm một bucket cuối cho phần còn lại
+BUCKET_BOUNDS_MS = tuple(0.25 * 2 ** i for i in range(19))
+
+
+def peak_rss_bytes() -> int:
+    """Peak RSS của process hiện tại (resource trên Linux / macOS, psutil trên Windows)"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss: KB trên Linux, byte trên macOS
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss)
+    except Exception:
+        return None
+
+
+def _process_peak_rss(pid: int) -> int:
+    """Peak RSS của một process đang chạy (VmHWM trên Linux, psutil nếu có), None nếu không đọc được"""
+    try:
+        with open(f'/proc/{pid}/status', 'r', encoding='ascii') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    try:
+        import psutil
+        info = psutil.Process(pid).memory_info()
+        return getattr(info, 'peak_wset', info.rss)
+    except Exception:
+        return None
+
+
+def children_peak_rss_bytes() -> int:
+    """
+    Peak RSS lớn nhất của một process con đã kết thúc (RUSAGE_CHILDREN, Linux / macOS)
+    Process con còn chạy không có trong RUSAGE_CHILDREN, xem _process_peak_rss
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Histogram:
+    """Histogram thời gian với bucket cố định: ghi O(số bucket), không giữ từng mẫu"""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, ms: float):
+        bucket = 0
+        while bucket < len(BUCKET_BOUNDS_MS) and ms > BUCKET_BOUNDS_MS[bucket]:
+            bucket += 1
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, q: float) -> float:
+        """Ước lượng theo cận trên của bucket chứa phân vị q (không vượt quá max)"""
+        if not self.count:
+            return 0.0
+        rank = q / 100.0 * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                bound = BUCKET_BOUNDS_MS[bucket] if bucket < len(BUCKET_BOUNDS_MS) else self.max_ms
+                return round(min(bound, self.max_ms), 3)
+        return round(self.max_ms, 3)
+
+    def as_dict(self) -> Dict:
+        return {
+            'count': self.count,
+            'total_seconds': round(self.total_ms / 1000.0, 3),
+            'mean_ms': round(self.total_ms / self.count, 3) if self.count else 0.0,
+            'p50_ms': self.percentile(50),
+            'p95_ms': self.percentile(95),
+            'p99_ms': self.percentile(99),
+            'max_ms': round(self.max_ms, 3)
+        }
+
+
+class TrainingTelemetry:
+    """
+    Telemetry của một lần training, thread-safe (các stage pipeline ghi từ thread riêng)
+    log_path: file JSONL, maybe_flush() append một dòng khi đã qua interval giây kể từ lần ghi trước
+    max_bytes / backups: xoay vòng file log (0 = không giới hạn)
+    """
+
+    def __init__(self, log_path: str = None, interval: float = DEFAULT_INTERVAL,
+                 max_bytes: int = DEFAULT_MAX_BYTES, backups: int = DEFAULT_BACKUPS):
+        self.log_path = log_path
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.stages = {}
+        self.books = 0
+        self.tokens = 0
+        self.tokens_estimated = False
+        self.checkpoint_rows = 0
+        self._last_flush = 0.0
+        self.flushes = 0
+        # pid -> peak RSS lớn nhất đã thấy của process con (encoder worker), giữ lại sau khi process kết thúc
+        self._child_peaks = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        """with telemetry.stage('commit'): ..."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name: str, seconds: float):
+        with self._lock:
+            histogram = self.stages.get(name)
+            if histogram is None:
+                histogram = self.stages[name] = Histogram()
+            histogram.add(seconds * 1000.0)
+
+    def add_books(self, count: int):
+        with self._lock:
+            self.books += count
+
+    def add_tokens(self, count: int, estimated: bool = False):
+        with self._lock:
+            self.tokens += int(count)
+            self.tokens_estimated = self.tokens_estimated or estimated
+
+    def record_checkpoint(self, seconds: float, rows: int):
+        self.record('checkpoint', seconds)
+        with self._lock:
+            self.checkpoint_rows += rows
+
+    def peak_rss(self) -> Dict:
+        """
+        Peak RSS của process train và tổng peak của các process con
+        Process con đang chạy được đọc từng pid (các worker chạy song song nên cộng dồn);
+        RUSAGE_CHILDREN là cận dưới khi không đọc được theo pid
+        """
+        for child in multiprocessing.active_children():
+            peak = _process_peak_rss(child.pid)
+            if peak is not None:
+                with self._lock:
+                    self._child_peaks[child.pid] = max(peak, self._child_peaks.get(child.pid, 0))
+        with self._lock:
+            children = sum(self._child_peaks.values())
+        children = max(children, children_peak_rss_bytes() or 0)
+        own = peak_rss_bytes()
+        return {
+            'total': (own or 0) + children if own is not None or children else None,
+            'self': own,
+            'children': children
+        }
+
+    def as_dict(self) -> Dict:
+        elapsed = time.time() - self.started_at
+        with self._lock:
+            stages = {name: histogram.as_dict() for name, histogram in self.stages.items()}
+            books, tokens = self.books, self.tokens
+            checkpoint_rows = self.checkpoint_rows
+        rss = self.peak_rss()
+        return {
+            'started_at': self.started_at,
+            'elapsed_seconds': round(elapsed, 2),
+            'books': books,
+            'books_per_second': round(books / elapsed, 2) if elapsed > 0 else 0.0,
+            'tokens': tokens,
+            'tokens_per_second': round(tokens / elapsed, 1) if elapsed > 0 else 0.0,
+            'tokens_estimated': self.tokens_estimated,
+            'peak_rss_bytes': rss['total'],
+            'peak_rss_self_bytes': rss['self'],
+            'peak_rss_children_bytes': rss['children'],
+            'checkpoint': {
+                'writes': stages.get('checkpoint', {}).get('count', 0),
+                'rows': checkpoint_rows,
+                'total_seconds': stages.get('checkpoint', {}).get('total_seconds', 0.0),
+                'max_ms': stages.get('checkpoint', {}).get('max_ms', 0.0)
+            },
+            'stages': stages
+        }
+
+    def maybe_flush(self, extra: Dict = None, force: bool = False) -> Dict:
+        """Append snapshot vào log nếu đã qua interval (hoặc force); trả về snapshot đã ghi, None nếu bỏ qua"""
+        now = time.time()
+        if not force and now - self._last_flush < self.interval:
+            return None
+        self._last_flush = now
+        snapshot = self.as_dict()
+        snapshot['timestamp'] = now
+        if extra:
+            snapshot.update(extra)
+        if self.log_path:
+            try:
+                os.makedirs(os.path.dirname(self.log_path) or '.', exist_ok=True)
+                self._rotate()
+                with open(self.log_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(snapshot, ensure_ascii=False) + '\n')
+            except OSError as e:
+                logger.warning(f"Could not write telemetry log: {e}")
+        self.flushes += 1
+        return snapshot
+
+    def _rotate(self):
+        """log đạt max_bytes: .1 -> .2 ..., log -> .1, bản cũ hơn backups bị xóa"""
+        if not self.max_bytes or not os.path.exists(self.log_path) \
+                or os.path.getsize(self.log_path) < self.max_bytes:
+            return
+        if self.backups <= 0:
+            os.remove(self.log_path)
+            return
+        for i in range(self.backups - 1, 0, -1):
+            source = f'{self.log_path}.{i}'
+            if os.path.exists(source):
+                os.replace(source, f'{self.log_path}.{i + 1}')
+        os.replace(self.log_path, f'{self.log_path}.1')
+
+    def format_stats(self) -> str:
+        snapshot = self.as_dict()
+        parts = [f"{snapshot['books_per_second']:.1f} books/s", f"{snapshot['tokens_per_second']:.0f} tok/s"]
+        parts += [f"{name} p95={s['p95_ms']:.0f}ms" for name, s in snapshot['stages'].items()]
+        if snapshot['peak_rss_bytes']:
+            rss = f"peak RSS {snapshot['peak_rss_bytes'] / (1024 * 1024):.0f} MB"
+            if snapshot['peak_rss_children_bytes']:
+                rss += f" (workers {snapshot['peak_rss_children_bytes'] / (1024 * 1024):.0f} MB)"
+            parts.append(rss)
+        return ' | '.join(parts)
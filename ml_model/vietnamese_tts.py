@@ -3,7 +3,6 @@ Vietnamese Text-to-Speech Module
 Sử dụng dataset VietSpeech và model TTS để generate giọng nói tiếng Việt
 """
 
-import torch
 import numpy as np
 from typing import List, Dict
 import logging
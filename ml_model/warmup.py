@@ -0,0 +1,111 @@
+"""
+Warm-up nền cho backend
+Import nặng (numpy / faiss / sentence_transformers / torch) và load model chạy trên một thread nền
+sau khi server đã nhận request, /api/health/live trả lời ngay, /api/health/ready chỉ OK khi warm-up xong
+Module này chỉ dùng thư viện chuẩn để import không tốn thời gian
+"""
+
+import time
+import threading
+from typing import Callable, Dict, List, Tuple
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+RUNNING = 'running'
+READY = 'ready'
+FAILED = 'failed'
+
+
+class WarmupTask:
+    """
+    Các bước (name, fn) hoặc (name, fn, required) chạy tuần tự trên thread nền
+    - Bước bắt buộc lỗi thì dừng (state = failed)
+    - Bước optional (required=False) lỗi chỉ được ghi vào status, không chặn readiness;
+      state = ready ngay khi bước bắt buộc cuối cùng xong, các bước optional sau đó chạy tiếp
+    start() idempotent: gọi nhiều lần (main, readiness probe) chỉ chạy một lần
+    """
+
+    def __init__(self, steps: List[Tuple]):
+        self.steps = [(step[0], step[1], step[2] if len(step) > 2 else True) for step in steps]
+        self._last_required = max((i for i, (_, _, required) in enumerate(self.steps) if required), default=-1)
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._thread = None
+        self.state = PENDING
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self._step_status = [{'name': name, 'state': PENDING, 'seconds': None, 'required': required}
+                             for name, _, required in self.steps]
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return self
+            self.state = RUNNING
+            self.started_at = time.time()
+            self._thread = threading.Thread(target=self._run, name='warmup', daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            if self._last_required < 0:
+                self.state = READY
+            for i, ((name, fn, required), status) in enumerate(zip(self.steps, self._step_status)):
+                status['state'] = RUNNING
+                start = time.perf_counter()
+                try:
+                    fn()
+                except Exception as e:
+                    status['state'] = FAILED
+                    status['error'] = str(e)
+                    if not required:
+                        logger.warning(f"Optional warm-up step {name} failed: {e}")
+                        continue
+                    self.error = f"{name}: {e}"
+                    self.state = FAILED
+                    logger.error(f"Warm-up step {name} failed: {e}")
+                    return
+                finally:
+                    status['seconds'] = round(time.perf_counter() - start, 3)
+                status['state'] = READY
+                logger.info(f"Warm-up step {name} done in {status['seconds']}s")
+                if i == self._last_required:
+                    self.state = READY
+        finally:
+            self.finished_at = time.time()
+            self._done.set()
+
+    @property
+    def started(self) -> bool:
+        return self._thread is not None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == READY
+
+    @property
+    def running(self) -> bool:
+        return self.state == RUNNING
+
+    def wait(self, timeout: float = None) -> bool:
+        """Chờ warm-up kết thúc (xong hoặc lỗi), trả về ready"""
+        self._done.wait(timeout)
+        return self.ready
+
+    def status(self) -> Dict:
+        end = self.finished_at or time.time()
+        return {
+            'state': self.state,
+            'ready': self.ready,
+            'error': self.error,
+            # Bước optional lỗi: phục vụ được nhưng thiếu tính năng tương ứng
+            'degraded': [status['name'] for status in self._step_status
+                         if not status['required'] and status['state'] == FAILED],
+            'seconds': round(end - self.started_at, 3) if self.started_at else None,
+            'steps': [dict(status) for status in self._step_status]
+        }
@@ -5,6 +5,16 @@ Features:
 - Auto-save checkpoint (graceful shutdown)
 - Resume từ checkpoint
 - Training metrics tracking
+- Incremental re-indexing: python train_offline.py --incremental
+- Encode bằng nhiều process: python train_offline.py --workers 4
+- Passage index (tìm sâu trong nội dung, chạy sau khi đã train): python train_offline.py --passages
+- Encoder ONNX Runtime: python train_offline.py --backend onnx-int8 (torch | onnx | onnx-int8)
+- Batch theo độ dài với ngân sách token: python train_offline.py --max-batch-tokens 8192
+- k-NN graph cho sách tương tự (tự chạy sau khi train xong): python train_offline.py --knn [k]
+- Telemetry từng stage (read / tokenize / encode / commit / checkpoint), tokens/s, peak RSS:
+  data/checkpoints/training_telemetry.jsonl, progress JSON ghi tối đa một lần mỗi PROGRESS_INTERVAL giây
+- Đọc sách từ corpus pack thay vì từng file: python train_offline.py --pack data/corpus_pack
+  (build pack từ dataset nếu chưa có; build lại: python ml_model/corpus_pack.py <dataset> <pack_dir> [--zstd])
 """
 
 import os
@@ -20,6 +30,7 @@ from datetime import datetime
 sys.path.append(str(Path(__file__).parent / 'ml_model'))
 
 from book_embedding import VietnameseBookEmbedding
+from corpus_pack import pack_corpus, resolve_pack_dir
 
 logging.basicConfig(
     level=logging.INFO,
@@ -33,6 +44,7 @@ model_instance = None
 
 PROGRESS_FILE = "./data/training_progress.json"
 METRICS_FILE = "./data/training_metrics.json"
+PROGRESS_INTERVAL = 2.0     # giây giữa hai lần ghi PROGRESS_FILE
 
 def signal_handler(sig, frame):
     """Handle Ctrl+C for graceful shutdown"""
@@ -49,10 +61,12 @@ def signal_handler(sig, frame):
 signal.signal(signal.SIGINT, signal_handler)
 
 def save_progress(data):
-    """Save training progress to JSON"""
+    """Save training progress to JSON (file tạm + os.replace, reader không thấy file ghi dở)"""
     os.makedirs(os.path.dirname(PROGRESS_FILE), exist_ok=True)
-    with open(PROGRESS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    tmp_path = PROGRESS_FILE + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, PROGRESS_FILE)
 
 def save_metrics(data):
     """Save training metrics"""
@@ -72,6 +86,8 @@ def print_progress_bar(current, total, bar_length=50, metrics=None):
         elapsed = metrics.get('elapsed', 0)
         eta = metrics.get('eta', 0)
         print(f' │ ⏱️  {format_time(elapsed)} │ ETA: {format_time(eta)}', end='')
+        if metrics.get('pipeline'):
+            print(f" │ {metrics['pipeline']}", end='')
     
     sys.stdout.flush()
 
@@ -84,6 +100,20 @@ def format_time(seconds):
     else:
         return f"{int(seconds/3600)}h {int((seconds%3600)/60)}m"
 
+def print_telemetry(telemetry):
+    """Bảng thời gian từng stage: stage nào chiếm nhiều thời gian nhất là nút thắt"""
+    print(f"   🔤 Tokens: {telemetry['tokens']:,} ({telemetry['tokens_per_second']:,.0f} tokens/sec"
+          f"{', estimated' if telemetry['tokens_estimated'] else ''})")
+    if telemetry['peak_rss_bytes']:
+        print(f"   🧮 Peak RSS: {telemetry['peak_rss_bytes'] / (1024 * 1024):,.0f} MB")
+    checkpoint = telemetry['checkpoint']
+    print(f"   💾 Checkpoint writes: {checkpoint['writes']} ({checkpoint['total_seconds']}s, "
+          f"max {checkpoint['max_ms']:.0f} ms)")
+    print(f"   {'stage':<16}{'count':>8}{'total s':>10}{'mean ms':>10}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for name, stage in telemetry['stages'].items():
+        print(f"   {name:<16}{stage['count']:>8}{stage['total_seconds']:>10.1f}{stage['mean_ms']:>10.1f}"
+              f"{stage['p50_ms']:>9.1f}{stage['p95_ms']:>9.1f}{stage['p99_ms']:>9.1f}")
+
 def main():
     """Train AI model offline với real-time dashboard"""
     global training_active, model_instance
@@ -97,8 +127,13 @@ def main():
     DATASET_PATH = r"C:\Users\karin\.cache\kagglehub\datasets\iambestfeeder\10000-vietnamese-books\versions\1\output"
     CHECKPOINT_DIR = "./data/checkpoints"
     
+    # Corpus pack: một container mmap thay vì hàng nghìn file nhỏ
+    corpus_pack = None
+    if '--pack' in sys.argv:
+        corpus_pack = sys.argv[sys.argv.index('--pack') + 1]
+    
     # Check dataset exists
-    if not os.path.exists(DATASET_PATH):
+    if not os.path.exists(DATASET_PATH) and not (corpus_pack and os.path.exists(corpus_pack)):
         logger.error(f"❌ Dataset not found: {DATASET_PATH}")
         logger.info("Please run: python download_dataset.py")
         return
@@ -107,16 +142,69 @@ def main():
     logger.info(f"💾 Checkpoint: {CHECKPOINT_DIR}")
     print()
     
+    # Số process encode (mỗi process một bản model, chia đều CPU core)
+    encode_workers = 1
+    if '--workers' in sys.argv:
+        encode_workers = int(sys.argv[sys.argv.index('--workers') + 1])
+    
+    max_batch_tokens = None
+    if '--max-batch-tokens' in sys.argv:
+        max_batch_tokens = int(sys.argv[sys.argv.index('--max-batch-tokens') + 1])
+    
+    encoder_backend = 'torch'
+    if '--backend' in sys.argv:
+        encoder_backend = sys.argv[sys.argv.index('--backend') + 1]
+    
+    if corpus_pack and resolve_pack_dir(corpus_pack) is None:
+        print(f"📦 Building corpus pack: {corpus_pack}")
+        info = pack_corpus(DATASET_PATH, corpus_pack)
+        print(f"   📚 Books: {info['count']:,} ({info['raw_bytes'] / (1024 * 1024):.1f} MB)")
+        print(f"   ⏱️  Time: {format_time(info['build_seconds'])}")
+        print()
+    
     # Initialize model
     logger.info("⚙️  Initializing model...")
-    model = VietnameseBookEmbedding(DATASET_PATH, CHECKPOINT_DIR)
+    model = VietnameseBookEmbedding(DATASET_PATH, CHECKPOINT_DIR, encode_workers=encode_workers,
+                                    encoder_backend=encoder_backend, corpus_pack=corpus_pack)
     model_instance = model
     
-    # Check existing checkpoint
-    checkpoint_loaded = model.load_checkpoint()
+    # Incremental mode: chỉ embed sách mới / đã sửa
+    if '--incremental' in sys.argv:
+        print("🔁 Incremental re-indexing...")
+        start_time = time.time()
+        summary = model.train_incremental(batch_size=32)
+        print(f"   ➕ Added: {summary['added']:,}")
+        print(f"   ✏️  Modified: {summary['modified']:,}")
+        print(f"   ➖ Deleted: {summary['deleted']:,}")
+        print(f"   ⏱️  Time: {format_time(time.time() - start_time)}")
+        return
+    
+    # Passage index: chia sách thành passage và embed (cần metadata.sqlite do lần train trước ghi ra)
+    if '--passages' in sys.argv:
+        print("📑 Building passage index...")
+        start_time = time.time()
+        info = model.build_passages()
+        print(f"   📄 Passages: {info.get('passages', 0):,} ({info.get('books', 0):,} books)")
+        print(f"   💾 Size: {info.get('bytes', 0) / (1024 * 1024):.1f} MB")
+        print(f"   ⏱️  Time: {format_time(time.time() - start_time)}")
+        return
+    
+    # k-NN graph: tính lại láng giềng của mọi sách từ embeddings.npy hiện có
+    if '--knn' in sys.argv:
+        position = sys.argv.index('--knn') + 1
+        k = int(sys.argv[position]) if position < len(sys.argv) and sys.argv[position].isdigit() else None
+        print("🕸️  Building k-NN graph...")
+        start_time = time.time()
+        info = model.build_knn(k)
+        print(f"   📚 Books: {info['count']:,} x {info['k']} neighbours")
+        print(f"   💾 Size: {info['bytes'] / (1024 * 1024):.1f} MB")
+        print(f"   ⏱️  Time: {format_time(time.time() - start_time)}")
+        return
+    
+    # Check existing checkpoint: chỉ đọc manifest, train() tự load và stream phần sách còn lại
+    status = model.peek_checkpoint()
     
-    if checkpoint_loaded and model.books and len(model.books) > 0:
-        status = model.get_training_status()
+    if status and status['total_books'] > 0:
         print()
         print("📊 CHECKPOINT FOUND")
         print(f"   Progress: {status['progress']:.2f}%")
@@ -134,8 +222,10 @@ def main():
                 import shutil
                 shutil.rmtree(CHECKPOINT_DIR, ignore_errors=True)
                 os.makedirs(CHECKPOINT_DIR, exist_ok=True)
-                model = VietnameseBookEmbedding(DATASET_PATH, CHECKPOINT_DIR)
+                model = VietnameseBookEmbedding(DATASET_PATH, CHECKPOINT_DIR, encode_workers=encode_workers,
+                                                encoder_backend=encoder_backend, corpus_pack=corpus_pack)
                 model_instance = model
+                status = None
         else:
             print("⏩ Resuming from checkpoint...")
     else:
@@ -155,84 +245,57 @@ def main():
     print()
     
     start_time = time.time()
-    last_save_time = start_time
+    start_index = status['current_index'] if status else 0
+    last_progress_write = [0.0]
     
-    try:
-        model.is_training = True
+    def on_batch(status):
+        """Progress bar sau mỗi batch, progress JSON tối đa một lần mỗi PROGRESS_INTERVAL giây"""
+        total_books = status['total_books']
+        current = status['current_index']
         
-        # Load books if not loaded
-        if not model.books:
-            logger.info("📚 Loading books metadata...")
-            model.books = model.load_books_metadata()
-            model.metadata = model.books.copy()
-            print()
+        # Calculate metrics
+        elapsed = time.time() - start_time
+        books_per_sec = (current - start_index) / elapsed if elapsed > 0 else 0
+        eta = (total_books - current) / books_per_sec if books_per_sec > 0 else 0
         
-        total_books = len(model.books)
-        logger.info(f"📖 Total books: {total_books:,}")
-        print()
+        # Display progress (kèm throughput / queue depth của từng stage)
+        metrics = {
+            'elapsed': elapsed,
+            'eta': eta,
+            'speed': books_per_sec,
+            'pipeline': model.pipeline.format_stats() if model.pipeline else None
+        }
+        print_progress_bar(current, total_books, metrics=metrics)
         
-        batch_size = 32
-        save_interval = 50
+        now = time.time()
+        if now - last_progress_write[0] < PROGRESS_INTERVAL and current < total_books:
+            return
+        last_progress_write[0] = now
         
-        # Training loop
-        while model.current_index < total_books and training_active:
-            batch_start = model.current_index
-            batch_end = min(model.current_index + batch_size, total_books)
-            batch_books = model.books[batch_start:batch_end]
-            
-            # Create embeddings
-            texts = []
-            for book in batch_books:
-                text = f"Tên sách: {book['title']}. "
-                if 'summary' in book and book['summary']:
-                    text += f"Tóm tắt: {book['summary']}. "
-                text += f"Nội dung: {book['preview']}"
-                texts.append(text)
-            
-            # Encode
-            batch_embeddings = model.model.encode(texts, show_progress_bar=False)
-            model.embeddings.extend(batch_embeddings)
-            model.current_index = batch_end
-            model.training_progress = (model.current_index / total_books) * 100
-            
-            # Calculate metrics
-            elapsed = time.time() - start_time
-            books_per_sec = model.current_index / elapsed if elapsed > 0 else 0
-            eta = (total_books - model.current_index) / books_per_sec if books_per_sec > 0 else 0
-            
-            # Display progress
-            metrics = {
-                'elapsed': elapsed,
-                'eta': eta,
-                'speed': books_per_sec
-            }
-            print_progress_bar(model.current_index, total_books, metrics=metrics)
-            
-            # Save progress data
-            progress_data = {
-                'current_index': model.current_index,
-                'total_books': total_books,
-                'progress': model.training_progress,
-                'embeddings_count': len(model.embeddings),
-                'elapsed_seconds': int(elapsed),
-                'eta_seconds': int(eta),
-                'books_per_second': round(books_per_sec, 2),
-                'last_update': datetime.now().isoformat()
-            }
-            save_progress(progress_data)
-            
-            # Save checkpoint periodically
-            if (model.current_index % save_interval == 0 and 
-                time.time() - last_save_time > 30):  # At least 30s between saves
-                model.save_checkpoint()
-                last_save_time = time.time()
-                print(f"\n💾 Checkpoint saved at {model.current_index:,}/{total_books:,}")
+        # Save progress data
+        progress_data = {
+            'current_index': current,
+            'total_books': total_books,
+            'progress': status['progress'],
+            'embeddings_count': status['embeddings_count'],
+            'elapsed_seconds': int(elapsed),
+            'eta_seconds': int(eta),
+            'books_per_second': round(books_per_sec, 2),
+            'pipeline': status['pipeline'],
+            'telemetry': status['telemetry'],
+            'last_update': datetime.now().isoformat()
+        }
+        save_progress(progress_data)
+    
+    try:
+        # Training pipeline: read/tokenize/encode song song, checkpoint ghi trên thread nền
+        completed = model.train(batch_size=32, save_interval=50, on_batch=on_batch,
+                                max_batch_tokens=max_batch_tokens)
         
         # Final save
-        if training_active:
+        if completed and training_active:
             print("\n")
-            model.save_checkpoint()
-            model.save_embeddings()
+            total_books = model.total_books
             
             # Save final metrics
             total_time = time.time() - start_time
@@ -241,7 +304,9 @@ def main():
                 'total_books': total_books,
                 'total_embeddings': len(model.embeddings),
                 'total_time_seconds': int(total_time),
-                'average_speed': round(total_books / total_time, 2),
+                'average_speed': round((total_books - start_index) / total_time, 2),
+                'padding': model.padding_stats.as_dict() if model.padding_stats else None,
+                'telemetry': model.telemetry.as_dict() if model.telemetry else None,
                 'completed_at': datetime.now().isoformat()
             }
             save_metrics(final_metrics)
@@ -252,8 +317,14 @@ def main():
             print(f"   📚 Books: {total_books:,}")
             print(f"   🧠 Embeddings: {len(model.embeddings):,}")
             print(f"   ⏱️  Time: {format_time(total_time)}")
-            print(f"   ⚡ Speed: {round(total_books/total_time, 2)} books/sec")
+            print(f"   ⚡ Speed: {round((total_books - start_index)/total_time, 2)} books/sec")
             print(f"   💾 Location: {CHECKPOINT_DIR}")
+            if model.padding_stats:
+                padding = model.padding_stats.as_dict()
+                print(f"   📏 Padding waste: {padding['fixed']['padding_waste_pct']}% (fixed) -> "
+                      f"{padding['bucketed']['padding_waste_pct']}% (bucketed)")
+            if model.telemetry:
+                print_telemetry(model.telemetry.as_dict())
             print()
             print("🎉 Ready for deployment!")
             print()